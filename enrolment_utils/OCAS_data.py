@@ -11,7 +11,7 @@ from typing import List
 import pandas as pd
 import io
 # import python_utils
-from enrolment_utils import custom_sharepoint, python_utils
+from enrolment_utils import custom_sharepoint, python_utils, storage
 def sharepoint_download_excel_OCAS(sharepoint_base_url:str, 
                                    report_name:str):
     """
@@ -41,28 +41,12 @@ def sharepoint_download_excel_OCAS(sharepoint_base_url:str,
                                         allapplicants_flag = True)
     
      """
-	# Getting credentials
-    sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-    
-
-    folder_in_sharepoint = '/sites/EnrolmentDashboard/Shared%20Documents/OCAS/'
-
-    #Constructing Details For Authenticating SharePoint
-
-    auth = AuthenticationContext(sharepoint_base_url)
-    auth.acquire_token_for_user(sharepoint_user, sharepoint_password)
-    ctx = ClientContext(sharepoint_base_url, auth)
-    web = ctx.web
-    ctx.load(web)
-    ctx.execute_query()
-
-    # #Reading File from SharePoint Folder
-    sharepoint_file = folder_in_sharepoint+report_name
-    response = File.open_binary(ctx, sharepoint_file)
+    # #Reading File from storage (SharePoint OCAS folder by default, local cache when unchanged)
+    byte_content = storage.reading_file(path = 'OCAS/'+report_name)
 
     #save data to BytesIO stream
     bytes_file_obj = io.BytesIO()
-    bytes_file_obj.write(response.content)
+    bytes_file_obj.write(byte_content)
     bytes_file_obj.seek(0) #set file object to start
 
     #read excel file and each sheet into pandas dataframe 
@@ -0,0 +1,134 @@
+import pandas as pd
+import numpy as np
+from typing import List
+from enrolment_utils import global_params, count_cube
+
+
+def cycle_end_date(term: str) -> pd.Timestamp:
+    """
+    This function gets the last day of the enrolment cycle of a term (day 10th of the term, more or less)
+
+    Example Usage:
+        cycle_end_date(term = '2023F') # 2023-09-20
+    """
+    end_date_map, _ = global_params.start_end_term_dates()
+    return pd.Timestamp(f"{int(term[:4])}{end_date_map[term[-1]]}")
+
+
+def building_cycle_matrix(jobs: List[dict],
+                          terms: List[str]) -> np.ndarray:
+    """
+    This function lays out the registrations history of every program as a programs x terms x days array, where
+    days are counted from the start of every enrolment cycle. Days without data are forward filled (and left as NaN
+    before the first available value).
+
+    Args:
+        jobs (List[dict]): one dictionary per program, with the registrations history (ds, y) under 'dataframe'
+        terms (List[str]): terms (enrolment cycles) to lay out
+
+    Returns:
+        np.ndarray with shape (programs, terms, days)
+
+    Example Usage:
+        building_cycle_matrix(jobs = jobs, terms = ['2022F', '2023F'])
+    """
+    starts = np.array([count_cube.cycle_start_date(term) for term in terms], dtype = 'datetime64[D]')
+    ends = np.array([cycle_end_date(term) for term in terms], dtype = 'datetime64[D]')
+    n_days = int((ends - starts).astype(int).max()) + 1
+
+    matrix = np.full((len(jobs), len(terms), n_days), np.nan)
+    for p, job in enumerate(jobs):
+        dates = pd.to_datetime(job['dataframe']['ds'], cache = False).values.astype('datetime64[D]')
+        values = job['dataframe']['y'].to_numpy(dtype = float)
+        # Day of cycle of every date, for every term at once
+        days = (dates[None, :] - starts[:, None]).astype(int)
+        k, i = np.nonzero((days >= 0) & (days < n_days))
+        matrix[p, k, days[k, i]] = values[i]
+
+    # Forward filling gaps along days
+    index = np.where(np.isnan(matrix), 0, np.arange(n_days))
+    index = np.maximum.accumulate(index, axis = -1)
+    matrix = np.take_along_axis(matrix, index, axis = -1)
+    return matrix
+
+
+def analog_projections(jobs: List[dict],
+                       years: int = None):
+    """
+    This function projects end of cycle registrations of every program once per previous enrolment cycle (analog
+    year): the share of final registrations reached by the same day of cycle in that cycle gives a projection
+    (current registrations / share). Everything is computed at once for all programs.
+
+    Args:
+        jobs (List[dict]): one dictionary per program with program, dataframe (ds, y), target_value and term
+        years (int): number of previous cycles to use (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        projections (np.ndarray): programs x years projections (NaN when a year gives no projection)
+        current (np.ndarray): current registrations of every program
+
+    Example Usage:
+        projections, current = analog_projections(jobs = jobs)
+    """
+    if years is None:
+        years = global_params.forecasting_settings()['analog_years']
+
+    term = jobs[0]['term']
+    terms = [f'{int(term[:4]) - k}{term[-1]}' for k in range(years, 0, -1)]
+    matrix = building_cycle_matrix(jobs = jobs, terms = terms)
+
+    # Current registrations and day of cycle (as of the last available date)
+    current = np.array([job['dataframe']['y'].iloc[-1] for job in jobs], dtype = float)
+    last_dates = np.array([pd.to_datetime(job['dataframe']['ds'].iloc[-1]) for job in jobs], dtype = 'datetime64[D]')
+    start = np.datetime64(count_cube.cycle_start_date(term).date())
+    day = np.clip((last_dates - start).astype(int), 0, matrix.shape[-1] - 1)
+
+    # Share of final registrations reached by the same day of cycle, on every previous cycle
+    final_day = np.array([(cycle_end_date(t) - count_cube.cycle_start_date(t)).days for t in terms])
+    final = matrix[:, np.arange(len(terms)), final_day]
+    same_day = np.take_along_axis(matrix, np.broadcast_to(day[:, None, None], (len(jobs), len(terms), 1)), axis = -1)[:, :, 0]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ratio = same_day / final
+        projections = np.where(ratio > 0, current[:, None] / ratio, np.nan)
+    return projections, current
+
+
+def analog_forecasting_programs(jobs: List[dict],
+                                years: int = None) -> pd.DataFrame:
+    """
+    This function projects end of cycle registrations for every program using its own previous enrolment cycles
+    (see analog_projections). Projected registrations is the average projection across years, and probability of
+    reaching target assumes normality with the spread across years. Everything is computed at once for all programs.
+
+    Args:
+        jobs (List[dict]): one dictionary per program with program, dataframe (ds, y), target_value and term
+                           (same input as probs_target_utils.forecasting_programs)
+        years (int): number of previous cycles to use (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        Dataframe (pd.DataFrame) with program, probability and projected_regs, in jobs order
+
+    Example Usage:
+        analog_forecasting_programs(jobs = [{'program': 'BGEN', 'dataframe': dataframe, 'target_value': 40, 'term': '2024F'}])
+    """
+    from scipy.stats import norm
+
+    if len(jobs) == 0:
+        return pd.DataFrame(columns = ['program', 'probability', 'projected_regs'])
+
+    projections, current = analog_projections(jobs = jobs, years = years)
+    targets = np.array([job['target_value'] for job in jobs], dtype = float)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        valid = np.isfinite(projections).sum(axis = 1)
+        mean = np.where(valid > 0, np.nanmean(np.where(valid[:, None] > 0, projections, 0), axis = 1), np.nan)
+        spread = np.where(valid > 1, np.nanstd(np.where(valid[:, None] > 1, projections, 0), axis = 1, ddof = 1), np.nan)
+
+        # Probability (assumption: normality); without spread, either it is projected to reach target or not
+        prob = np.where(spread > 0, 1 - norm.cdf(targets, loc = mean, scale = spread), (mean >= targets).astype(float))
+    prob = np.where(current >= targets, 1, np.nan_to_num(prob))
+    projected_regs = np.maximum(current, np.nan_to_num(np.floor(mean)))
+
+    dataframe = pd.DataFrame({'program': [job['program'] for job in jobs],
+                              'probability': prob,
+                              'projected_regs': projected_regs.astype(int)})
+    return dataframe
@@ -4,6 +4,7 @@ import pyodbc
 # import python_utils
 from tqdm import tqdm
 from io import StringIO
+from pathlib import Path
 from enrolment_utils import probs_target_utils, apps_confs_progression, custom_sharepoint, global_params, python_utils
 
 def retrieving_apps_program_per_term_per_date(program:str, 
@@ -363,15 +364,25 @@ def compiling_historical_college(terms: List[str],
     
     last update: Oct 5, 2023
     """
-    # sharepoing folder contains individual lists
-    files, folder = custom_sharepoint.list_files_in_sharepoint(term = terms[-1], 
-                                                               folder = folder)
+    # School of every program, downloaded while program files are
+    testing_dict = global_params.naming_files()
+    file_name = [data['file_name_order'] for data in testing_dict.values() if data['terms'] == terms][0]
+    school_download = custom_sharepoint.submitting_transfer(global_params.program_school_dict, file_name = file_name)
 
-    dataframe = pd.DataFrame()
-    for program_file in files:
+    # sharepoing folder contains individual lists
+    files, sharepoint_folder = custom_sharepoint.list_files_in_sharepoint(term = terms[-1], 
+                                                                          folder = folder, 
+                                                                          metadata = True)
+    
+    # Local copies of program files, one folder per intake
+    intake_dict = global_params.intake_dict()
+    cache_folder = Path(global_params.transfer_settings()['cache_folder'])/'program_history'/folder/intake_dict[terms[-1][-1]]
 
-        # Get the file from SharePoint
-        byte_content = folder.get_file(program_file)
+    # Files are downloaded in parallel and parsed as they arrive
+    frames = {}
+    for program_file, byte_content in custom_sharepoint.downloading_folder_files(folder = sharepoint_folder, 
+                                                                                 files = files, 
+                                                                                 cache_folder = cache_folder):
 
         # Convert byte string to a regular string
         content_str = byte_content.decode('utf-8')
@@ -381,13 +392,13 @@ def compiling_historical_college(terms: List[str],
 
         # Adding program name
         df_aux['program'] = program_file.split('.')[0]
+        frames[program_file] = df_aux
 
-        # All programs together
-        dataframe = dataframe.append(df_aux)
+    # All programs together (keeping Sharepoint listing order)
+    frames = [frames[file['Name']] for file in files if file['Name'] in frames]
+    dataframe = pd.concat(frames) if frames else pd.DataFrame(columns = ['program'])
     
-    testing_dict = global_params.naming_files()
-    file_name = [data['file_name_order'] for data in testing_dict.values() if data['terms'] == terms][0]
-    program_school_dict = global_params.program_school_dict(file_name = file_name)
+    program_school_dict = custom_sharepoint.waiting_transfers([school_download])[0]
     dataframe['lambton_school'] = dataframe['program'].map(program_school_dict)
     
     return dataframe
@@ -0,0 +1,245 @@
+import pandas as pd
+import pyodbc
+import argparse
+import threading
+import time
+from pathlib import Path
+from typing import List
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enrolment_utils import probs_target_utils, apps_confs_progression, custom_sharepoint, global_params, python_utils, storage
+
+
+def creating_partitions(programs: List[str], 
+                        term: str, 
+                        start_year: int, 
+                        end_year: int, 
+                        partition_days: int) -> List[dict]:
+    """
+    This function splits the (program, term, date range) space of a backfill into partitions of at most partition_days days. 
+    
+    Args: 
+        programs (List[str]): Programs of interest
+        term (str): current enrolment term
+        start_year (int): start year to start tracking historical data
+        end_year (int): end year to stop tracking historical data
+        partition_days (int): Maximum number of days per partition
+    
+    Returns: 
+        List of partitions (dictionaries with program, term and dates)
+    
+    Example Usage: 
+        creating_partitions(programs = ['ACTG'], term = '2023F', start_year = 2019, end_year = 2023, partition_days = 30)
+    """
+    dates_dict = probs_target_utils.creating_dates_per_term(start_year = start_year, 
+                                                            end_year = end_year, 
+                                                            term = term)
+    partitions = []
+    for program in programs: 
+        for cycle_term in dates_dict.keys():
+            dates = probs_target_utils.getting_individual_dates(start_date = dates_dict[cycle_term]['start_date'],
+                                                                end_date = dates_dict[cycle_term]['end_date'])
+            for i in range(0, len(dates), partition_days):
+                partitions.append({'program': program, 
+                                   'term': cycle_term, 
+                                   'dates': dates[i:i + partition_days]})
+    return partitions
+
+
+def checkpoint_path(partition: dict, 
+                    folder_name: str, 
+                    checkpoint_folder: str) -> Path:
+    """
+    Location of the checkpoint file of a partition. It is keyed on term and first day only, so the last partition of 
+    the running term (which grows every day) keeps one checkpoint, the days it covers being written in the file 
+    (see writing_checkpoint). 
+    """
+    file_name = f"{partition['term']}_{partition['dates'][0]}.txt"
+    return Path(checkpoint_folder) / folder_name / partition['program'] / file_name
+
+
+def writing_checkpoint(dataframe: pd.DataFrame, 
+                       partition: dict, 
+                       path: Path): 
+    """
+    Writes the checkpoint of a partition: a first line with the days covered ('# first last'), then its daily numbers. 
+    It is written aside and renamed, so a crash never leaves half a partition. 
+    """
+    path.parent.mkdir(parents = True, exist_ok = True)
+    temporary_path = path.with_suffix('.tmp')
+    temporary_path.write_text(f"# {partition['dates'][0]} {partition['dates'][-1]}\n" + dataframe.to_csv(sep = '\t', index = False))
+    temporary_path.replace(path)
+
+
+def checkpoint_covers(partition: dict, 
+                      path: Path) -> bool: 
+    """
+    Tells whether a checkpoint holds every day of a partition (a checkpoint of the running term taken on an earlier 
+    day does not). 
+    """
+    if not path.exists(): 
+        return False
+    with open(path) as checkpoint: 
+        covered = checkpoint.readline().split()
+    return len(covered) == 3 and covered[0] == '#' and covered[2] >= partition['dates'][-1]
+
+
+def reading_checkpoint(path: Path) -> pd.DataFrame: 
+    """
+    Reads the daily numbers of a checkpoint (see writing_checkpoint). 
+    """
+    return pd.read_csv(path, delimiter = '\t', skiprows = 1)
+
+
+def retrieving_partition(partition: dict, 
+                         folder_name: str, 
+                         cnxn: pyodbc.Connection) -> pd.DataFrame:
+    """
+    This function pulls the daily numbers of a partition from production. 
+    
+    Args: 
+        partition (dict): Partition of interest (output of creating_partitions)
+        folder_name (str): Kind of history of interest (registrations, applications or confirmations)
+        cnxn (pyodbc.Connection): Connection to retrieve data from
+    
+    Returns: 
+        pd.DataFrame with day by day numbers, same columns as apps_confs_progression.building_program_record* 
+    """
+    retrieving = {'registrations': apps_confs_progression.retrieving_regs_program_per_term_per_date, 
+                  'applications': apps_confs_progression.retrieving_apps_program_per_term_per_date, 
+                  'confirmations': apps_confs_progression.retrieving_confs_program_per_term_per_date}[folder_name]
+    
+    dataframe = pd.concat([retrieving(program = partition['program'], 
+                                      term = partition['term'], 
+                                      date = date, 
+                                      cnxn = cnxn) for date in partition['dates']])
+    
+    # Setting column names
+    if folder_name == 'registrations': 
+        dataframe.columns = ['ds','y']
+    else: 
+        dataframe.columns = ['ds','y','term']
+    return dataframe
+
+
+def backfilling_program_history(programs: List[str], 
+                                term: str, 
+                                start_year: int, 
+                                end_year: int, 
+                                folder_name: str = 'registrations', 
+                                max_workers: int = None, 
+                                upload: bool = True) -> dict:
+    """
+    This function builds the history of registrations, applications or confirmations of programs from scratch. The work 
+    is split into partitions (program, term, date range) which are pulled by a pool of workers, each with its own 
+    connection to production. Every finished partition is checkpointed locally, so an interrupted backfill resumes 
+    where it left off. Progress and throughput (days/sec) are reported per worker. 
+    
+    Args: 
+        programs (List[str]): Programs of interest
+        term (str): current enrolment term
+        start_year (int): start year to start tracking historical data
+        end_year (int): end year to stop tracking historical data
+        folder_name (str): Kind of history of interest: registrations, applications or confirmations (set as registrations by default)
+        max_workers (int): Number of workers (taken from global_params.backfill_settings by default)
+        upload (bool): If True, each program history is uploaded to its program_history folder within Sharepoint (set as True by default)
+    
+    Returns: 
+        dictionary with program as key and pd.DataFrame with its history as value
+    
+    Example Usage: 
+        backfilling_program_history(programs = ['ACTG','BGEN'], 
+                                    term = '2024F', 
+                                    start_year = 2019, 
+                                    end_year = 2024, 
+                                    folder_name = 'applications')
+    """
+    settings = global_params.backfill_settings()
+    if max_workers is None: 
+        max_workers = settings['max_workers']
+    
+    # Splitting work, and skipping partitions finished on previous runs
+    partitions = creating_partitions(programs = programs, 
+                                     term = term, 
+                                     start_year = start_year, 
+                                     end_year = end_year, 
+                                     partition_days = settings['partition_days'])
+    pending = [partition for partition in partitions 
+               if not checkpoint_covers(partition, checkpoint_path(partition, folder_name, settings['checkpoint_folder']))]
+    print(f'[Info] Backfilling {folder_name} for {len(programs)} programs: {len(partitions)} partitions, {len(partitions) - len(pending)} already checkpointed.')
+    
+    # One connection and one progress record per worker
+    local = threading.local()
+    progress = {}
+    progress_lock = threading.Lock()
+    
+    def running_partition(partition):
+        if not hasattr(local, 'cnxn'): 
+            local.cnxn = python_utils.get_connection()
+        worker = threading.current_thread().name
+        start_time = time.perf_counter()
+        
+        dataframe = retrieving_partition(partition = partition, 
+                                         folder_name = folder_name, 
+                                         cnxn = local.cnxn)
+        
+        # Checkpointing (replacing the checkpoint of an earlier day of the running term, if any)
+        writing_checkpoint(dataframe = dataframe, 
+                           partition = partition, 
+                           path = checkpoint_path(partition, folder_name, settings['checkpoint_folder']))
+        
+        with progress_lock: 
+            record = progress.setdefault(worker, {'partitions': 0, 'days': 0, 'seconds': 0.0})
+            record['partitions'] += 1
+            record['days'] += len(partition['dates'])
+            record['seconds'] += time.perf_counter() - start_time
+            print(f"[Info] {worker}: {partition['program']} {partition['term']} {partition['dates'][0]} to {partition['dates'][-1]} done. "
+                  f"{record['partitions']} partitions, {record['days'] / record['seconds']:.2f} days/sec")
+        return partition
+    
+    with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'backfill') as executor:
+        futures = [executor.submit(running_partition, partition) for partition in pending]
+        for future in as_completed(futures):
+            future.result()
+    
+    for worker, record in sorted(progress.items()):
+        print(f"[Info] {worker}: {record['partitions']} partitions, {record['days']} days in {record['seconds']:.0f} seconds ({record['days'] / record['seconds']:.2f} days/sec)")
+    
+    # Putting partitions together, program by program
+    if upload: 
+        _, folder = custom_sharepoint.list_files_in_sharepoint(term = term, 
+                                                               folder = folder_name)
+    histories = {}
+    for program in programs: 
+        dataframe = pd.concat([reading_checkpoint(checkpoint_path(partition, folder_name, settings['checkpoint_folder'])) 
+                               for partition in partitions if partition['program'] == program], 
+                              ignore_index = True)
+        histories[program] = dataframe
+        
+        if upload: 
+            output = StringIO()
+            dataframe.to_csv(output, sep = '\t', index = False)
+            storage.writing_file(path = f'{folder}/{program}.txt', 
+                                 content = output.getvalue().encode('utf-8'))
+            print(f'[Info] {program} {folder_name} history uploaded to storage.')
+    
+    return histories
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Builds program histories from scratch, resuming from local checkpoints.')
+    parser.add_argument('--program', type = str, action = 'append', required = True, help = 'program of interest (repeat for more than one)')
+    parser.add_argument('--term', type = str, required = True, help = 'current enrolment term, e.g. 2024F')
+    parser.add_argument('--start-year', type = int, required = True)
+    parser.add_argument('--end-year', type = int, required = True)
+    parser.add_argument('--folder', type = str, default = 'registrations', choices = ['registrations', 'applications', 'confirmations'])
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--no-upload', action = 'store_true', help = 'keep histories local')
+    args = parser.parse_args()
+    backfilling_program_history(programs = args.program, 
+                                term = args.term, 
+                                start_year = args.start_year, 
+                                end_year = args.end_year, 
+                                folder_name = args.folder, 
+                                max_workers = args.workers, 
+                                upload = not args.no_upload)
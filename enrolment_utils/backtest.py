@@ -0,0 +1,172 @@
+import pandas as pd
+import argparse
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+from enrolment_utils import count_cube, analog_forecast, probs_target_utils
+
+
+def loading_local_histories(history_folder: str,
+                            programs: List[str] = None) -> dict:
+    """
+    This function reads program registrations histories (one <program>.txt file with ds, y columns per program, as
+    stored on Sharepoint program_history folders) from a local folder.
+
+    Args:
+        history_folder (str): local folder containing program history files
+        programs (List[str]): programs of interest (all files in folder by default)
+
+    Returns:
+        dictionary {program: pd.DataFrame (ds, y)}
+
+    Example Usage:
+        loading_local_histories(history_folder = 'cache/program_history/registrations/fall')
+    """
+    histories = {}
+    for path in sorted(Path(history_folder).glob('*.txt')):
+        if programs is not None and path.stem not in programs:
+            continue
+        dataframe = pd.read_csv(path, delimiter = '\t')
+        dataframe['ds'] = pd.to_datetime(dataframe['ds'])
+        histories[path.stem] = dataframe[['ds', 'y']].dropna().sort_values('ds').reset_index(drop = True)
+    print(f'[Info] {len(histories)} program histories loaded from {history_folder}')
+    return histories
+
+
+def backtest_dates(term: str,
+                   frequency_days: int = 7) -> List[pd.Timestamp]:
+    """
+    This function lists the dates a closed enrolment cycle is replayed on: every frequency_days from the start of the
+    cycle, up to the day before it closes.
+
+    Example Usage:
+        backtest_dates(term = '2023F') # 2022-09-28, 2022-10-05, ...
+    """
+    start = count_cube.cycle_start_date(term)
+    end = analog_forecast.cycle_end_date(term)
+    return list(pd.date_range(start + pd.Timedelta(days = frequency_days), end - pd.Timedelta(days = 1), freq = f'{frequency_days}D'))
+
+
+def backtesting_forecasts(term: str,
+                          history_folder: str,
+                          engines: List[str] = None,
+                          targets: dict = None,
+                          frequency_days: int = 7,
+                          programs: List[str] = None):
+    """
+    This function replays a closed enrolment cycle: for every backtest date, histories are cut at that date and every
+    engine forecasts the end of cycle, which is then compared to the actual registrations at the end of the cycle.
+    Everything runs from local files (no production nor Sharepoint access), and stored Prophet models are not touched.
+
+    Args:
+        term (str): closed term to replay (e.g. '2023F')
+        history_folder (str): local folder containing program history files (see loading_local_histories)
+        engines (List[str]): engines to evaluate ('analog', 'prophet', both by default)
+        targets (dict): target per program; by default, final registrations of the previous cycle are used as target
+        frequency_days (int): days between replayed dates (weekly by default)
+        programs (List[str]): programs of interest (all files in folder by default)
+
+    Returns:
+        detail (pd.DataFrame): one row per engine, program and date with forecast, actual and timings
+        summary (pd.DataFrame): one row per engine with MAE of projected_regs, Brier score of probability and
+                                average fit and predict seconds per program
+
+    Example Usage:
+        detail, summary = backtesting_forecasts(term = '2023F',
+                                                history_folder = 'cache/program_history/registrations/fall')
+    """
+    if engines is None:
+        engines = ['analog', 'prophet']
+    histories = loading_local_histories(history_folder = history_folder, programs = programs)
+    end = analog_forecast.cycle_end_date(term)
+    previous_end = analog_forecast.cycle_end_date(f'{int(term[:4]) - 1}{term[-1]}')
+
+    # Actual end of cycle registrations (and default targets: last cycle final registrations)
+    actuals, default_targets = {}, {}
+    for program, dataframe in histories.items():
+        final = dataframe.loc[dataframe['ds'] <= end, 'y']
+        previous = dataframe.loc[dataframe['ds'] <= previous_end, 'y']
+        if len(final) > 0 and dataframe.loc[dataframe['ds'] <= end, 'ds'].max() >= end:
+            actuals[program] = float(final.iloc[-1])
+            default_targets[program] = int(previous.iloc[-1]) if len(previous) > 0 else 0
+    if targets is None:
+        targets = default_targets
+    print(f'[Info] {len(actuals)} programs with a closed {term} cycle to replay')
+
+    rows = []
+    for as_of in backtest_dates(term = term, frequency_days = frequency_days):
+        jobs = []
+        for program in actuals:
+            dataframe = histories[program][histories[program]['ds'] <= as_of]
+            if len(dataframe) > 1:
+                jobs.append({'program': program, 'dataframe': dataframe, 'target_value': targets.get(program, 0), 'term': term})
+
+        for engine in engines:
+            if engine == 'analog':
+                # All programs at once, timing is shared among them
+                start = time.perf_counter()
+                forecasts = analog_forecast.analog_forecasting_programs(jobs = jobs)
+                seconds = (time.perf_counter() - start) / max(len(jobs), 1)
+                for job, (i, forecast) in zip(jobs, forecasts.iterrows()):
+                    rows.append({'engine': engine, 'program': job['program'], 'as_of_date': as_of,
+                                 'target': job['target_value'], 'actual': actuals[job['program']],
+                                 'probability': forecast['probability'], 'projected_regs': forecast['projected_regs'],
+                                 'fit_seconds': 0.0, 'predict_seconds': seconds})
+            elif engine == 'prophet':
+                for job in jobs:
+                    start = time.perf_counter()
+                    model = probs_target_utils.fitting_program_model(program = job['program'],
+                                                                     dataframe = job['dataframe'],
+                                                                     term = term,
+                                                                     store = False)
+                    fitted = time.perf_counter()
+                    forecast = probs_target_utils.predicting_program(program = job['program'],
+                                                                     model = model,
+                                                                     dataframe = job['dataframe'],
+                                                                     target_value = job['target_value'],
+                                                                     term = term,
+                                                                     as_of = as_of.to_pydatetime()).iloc[0]
+                    rows.append({'engine': engine, 'program': job['program'], 'as_of_date': as_of,
+                                 'target': job['target_value'], 'actual': actuals[job['program']],
+                                 'probability': forecast['probability'], 'projected_regs': forecast['projected_regs'],
+                                 'fit_seconds': fitted - start, 'predict_seconds': time.perf_counter() - fitted})
+            else:
+                raise ValueError(f"Unknown forecasting engine '{engine}', use 'prophet' or 'analog'.")
+
+    detail = pd.DataFrame(rows, columns = ['engine', 'program', 'as_of_date', 'target', 'actual', 'probability',
+                                           'projected_regs', 'fit_seconds', 'predict_seconds'])
+
+    # Scores: absolute error of projection and squared error of probability against reaching target (Brier)
+    detail['absolute_error'] = (detail['projected_regs'] - detail['actual']).abs()
+    detail['reached'] = (detail['actual'] >= detail['target']).astype(float)
+    detail['squared_error'] = (detail['probability'] - detail['reached'])**2
+    summary = detail.groupby('engine').agg(forecasts = ('program', 'count'),
+                                           mae = ('absolute_error', 'mean'),
+                                           brier = ('squared_error', 'mean'),
+                                           fit_seconds = ('fit_seconds', 'mean'),
+                                           predict_seconds = ('predict_seconds', 'mean')).reset_index()
+    print(summary.to_string(index = False))
+    return detail, summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay a closed enrolment cycle to score forecasting engines (offline).')
+    parser.add_argument('term', help = 'closed term to replay, e.g. 2023F')
+    parser.add_argument('history_folder', help = 'local folder with <program>.txt registrations histories')
+    parser.add_argument('--engines', nargs = '+', default = ['analog', 'prophet'])
+    parser.add_argument('--frequency-days', type = int, default = 7)
+    parser.add_argument('--programs', nargs = '+', default = None)
+    parser.add_argument('--output', default = None, help = 'folder to write detail and summary csv files')
+    args = parser.parse_args()
+
+    detail, summary = backtesting_forecasts(term = args.term,
+                                            history_folder = args.history_folder,
+                                            engines = args.engines,
+                                            frequency_days = args.frequency_days,
+                                            programs = args.programs)
+    if args.output is not None:
+        Path(args.output).mkdir(parents = True, exist_ok = True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M')
+        detail.to_csv(Path(args.output)/f'backtest_{args.term}_{stamp}_detail.csv', index = False)
+        summary.to_csv(Path(args.output)/f'backtest_{args.term}_{stamp}_summary.csv', index = False)
@@ -0,0 +1,222 @@
+import pandas as pd 
+import numpy as np
+import pyodbc
+import argparse
+from pathlib import Path
+from typing import List
+from enrolment_utils import data_manipulation_as_of_dates, global_params, python_utils
+
+# Cubes already read in this process, by term
+_loaded_cubes = {}
+
+# Version of the metric definitions, cubes built with other definitions are ignored (and rebuilt by materializing_count_cubes)
+CUBE_VERSION = 2
+
+
+def cycle_start_date(term: str) -> pd.Timestamp:
+    """
+    This function gets the start date of the enrolment cycle of a term (as in probs_target_utils.creating_dates_per_term)
+    
+    Args: 
+        term (str): Term of interest
+    
+    Returns: 
+        pd.Timestamp with the first day of the enrolment cycle
+    
+    Example Usage: 
+        cycle_start_date(term = '2023F') # 2022-09-21
+    """
+    _, start_date_map = global_params.start_end_term_dates()
+    return pd.Timestamp(f"{int(term[:4]) - 1}{start_date_map[term[-1]]}")
+
+
+def count_cube_path(term: str) -> Path:
+    """
+    Location of the count cube file of a term 
+    """
+    return Path(global_params.count_cube_settings()['cube_folder']) / f'{term}.npz'
+
+
+def building_count_cube(term: str, 
+                        cnxn: pyodbc.Connection = None) -> Path:
+    """
+    This function materializes the daily count cube of a term: program x day of cycle x metric, for every metric in 
+    data_manipulation_as_of_dates.ALL_METRICS (applications, offers, confirmations, holds, withdrawals, waitlist, 
+    deposits and registrations). Counts are computed in one batched pass per source and stored compressed on local disk. 
+    
+    The cube covers the cycle from its start date up to the configured number of days, or up to yesterday if such 
+    window has not finished yet. 
+    
+    Args: 
+        term (str): Term of interest
+        cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+    
+    Returns: 
+        Path to the cube file
+    
+    Example Usage: 
+        building_count_cube(term = '2023F')
+    """
+    # Creating connection if none is provided
+    if cnxn is None: 
+        cnxn = python_utils.get_connection()
+    
+    # Days of the cycle to be materialized 
+    start_date = cycle_start_date(term)
+    last_date = min(start_date + pd.Timedelta(days = global_params.count_cube_settings()['days'] - 1), 
+                    pd.Timestamp.today().normalize() - pd.Timedelta(days = 1))
+    dates = pd.date_range(start_date, last_date, freq = 'D')
+    
+    # Counting every metric for every day of the cycle
+    programs, counts = data_manipulation_as_of_dates.counting_metrics_as_of_dates(term = term, 
+                                                                                  dates = dates, 
+                                                                                  deposits = True, 
+                                                                                  cnxn = cnxn)
+    cube = np.stack([counts[metric] for metric in data_manipulation_as_of_dates.ALL_METRICS], axis = -1).astype(np.int32)
+    
+    # Storing cube (compressed)
+    path = count_cube_path(term)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    np.savez_compressed(path, 
+                        counts = cube, 
+                        programs = np.array(programs, dtype = str), 
+                        metrics = np.array(data_manipulation_as_of_dates.ALL_METRICS, dtype = str), 
+                        start_date = np.array(str(start_date.date())), 
+                        built_through = np.array(str(last_date.date())), 
+                        version = np.array(CUBE_VERSION))
+    _loaded_cubes.pop(term, None)
+    print(f'[Info] Count cube for {term} built successfully: {len(programs)} programs, {len(dates)} days, {cube.shape[-1]} metrics.')
+    return path
+
+
+def loading_count_cube(term: str):
+    """
+    This function reads the count cube of a term (once per process). 
+    
+    Args: 
+        term (str): Term of interest
+    
+    Returns: 
+        dictionary with cube arrays, or None if the cube was not materialized (or built with other metric definitions)
+    """
+    if term not in _loaded_cubes:
+        path = count_cube_path(term)
+        if not path.exists(): 
+            return None
+        with np.load(path) as data: 
+            if 'version' not in data.files or int(data['version']) != CUBE_VERSION: 
+                return None
+            _loaded_cubes[term] = {'counts': data['counts'], 
+                                   'programs': data['programs'].tolist(), 
+                                   'metrics': data['metrics'].tolist(), 
+                                   'start_date': pd.Timestamp(str(data['start_date'])), 
+                                   'built_through': pd.Timestamp(str(data['built_through']))}
+    return _loaded_cubes[term]
+
+
+def count_cube_lookup(term: str, 
+                      k: int, 
+                      metric: str, 
+                      column_name: str) -> pd.DataFrame:
+    """
+    This function reads the counts of a metric per program as of today k years back from the count cube. Only past 
+    terms are served (k > 0); the current term, missing cubes and days out of the cube return None, so callers run the 
+    regular query instead. 
+    
+    Deposits are also returned None when the day deposist_process compares sponsorships and RO flags to (today minus 
+    k * 365.2524 days) is not the day ReturningStudentsQuery cuts payments at (today k years back), since the cube 
+    holds a single date per day. 
+    
+    Args: 
+        term (str): Term of interest
+        k (int): Number of years to go back, so numbers are as of this day in previous years
+        metric (str): Metric of interest (one of data_manipulation_as_of_dates.ALL_METRICS)
+        column_name (str): Name given to the counts column
+    
+    Returns: 
+        pd.DataFrame with Program and counts columns, or None
+    
+    Example Usage: 
+        count_cube_lookup(term = '2023F', k = 1, metric = 'Offers', column_name = 'Offers 2023F')
+    """
+    if k <= 0: 
+        return None
+    cube = loading_count_cube(term)
+    if cube is None: 
+        return None
+    
+    # Today's date as of the term's cycle (as DATEADD(YEAR, -k, GETDATE()) in the queries)
+    date = pd.Timestamp.today().normalize() - pd.DateOffset(years = k)
+    day = (date - cube['start_date']).days
+    if day < 0 or date > cube['built_through']: 
+        return None
+    if 'Deposits' in metric and (pd.Timestamp.now() - pd.Timedelta(days = k * 365.2524)).normalize() != date: 
+        return None
+    
+    return pd.DataFrame({'Program': cube['programs'], 
+                         column_name: cube['counts'][:, day, cube['metrics'].index(metric)]})
+
+
+def count_cube_lookup_students(term: str, 
+                               k: int, 
+                               metric: str, 
+                               column_name: str) -> pd.DataFrame:
+    """
+    Same as count_cube_lookup, for metrics split by domestic and international students (deposits and registrations). 
+    
+    Returns: 
+        pd.DataFrame with Program, counts and student columns, or None
+    
+    Example Usage: 
+        count_cube_lookup_students(term = '2023F', k = 1, metric = 'Term01Deposits', column_name = 'Returning students 2023F')
+    """
+    frames = []
+    for student in ['international', 'domestic']:
+        dataset = count_cube_lookup(term = term, k = k, metric = f'{metric}_{student}', column_name = column_name)
+        if dataset is None: 
+            return None
+        dataset['student'] = student
+        frames.append(dataset)
+    return pd.concat(frames, ignore_index = True)
+
+
+def materializing_count_cubes(intakes: List[str] = None, 
+                              rebuild: bool = False, 
+                              cnxn: pyodbc.Connection = None):
+    """
+    One-time job building the count cubes of every past term (all terms but the current one) for the intakes of interest. 
+    Cubes already covering their full window are skipped unless rebuild is True. 
+    
+    Args: 
+        intakes (List[str]): intakes of interest (all intakes in global_params.naming_files by default)
+        rebuild (bool): If True, existing cubes are built again (set as False by default)
+        cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+    
+    Returns: 
+        None
+    
+    Example Usage: 
+        materializing_count_cubes(intakes = ['fall'])
+    """
+    # Creating connection if none is provided
+    if cnxn is None: 
+        cnxn = python_utils.get_connection()
+    
+    intake_mapping = global_params.naming_files()
+    days = global_params.count_cube_settings()['days']
+    for intake in intakes or intake_mapping.keys():
+        for term in intake_mapping[intake]['terms'][:-1]:
+            cube = loading_count_cube(term)
+            if cube is not None and not rebuild and cube['built_through'] >= cube['start_date'] + pd.Timedelta(days = days - 1):
+                print(f'[Info] Count cube for {term} is complete, skipping.')
+                continue
+            building_count_cube(term = term, cnxn = cnxn)
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Builds the daily count cubes of past terms.')
+    parser.add_argument('--intake', type = str, action = 'append', help = 'intake of interest (fall, winter, summer). All by default')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'build existing cubes again')
+    args = parser.parse_args()
+    materializing_count_cubes(intakes = args.intake, rebuild = args.rebuild)
@@ -1,20 +1,577 @@
 from office365.runtime.auth.authentication_context import AuthenticationContext
 from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.files.file import File
+from office365.runtime.http.request_options import RequestOptions
 import os
 # import python_utils
-from enrolment_utils import global_params, python_utils
+from enrolment_utils import global_params, python_utils, storage
 
 from shareplum import Office365
 from shareplum import Site
 from shareplum.site import Version
+import office365.runtime.client_request
+import office365.runtime.auth.providers.saml_token_provider
+import office365.runtime.auth.providers.acs_token_provider
+import shareplum.office365
 
 from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import concurrent.futures
+from typing import List
 
 import pandas as pd
+import json
 import io
+import time
+import threading
+import uuid
+import random
+import requests
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from io import StringIO 
 
+# Sharepoint session of the current run (see getting_sharepoint_session)
+_session = {}
+
+# Local cache of downloaded files, counters of the current run (see downloading_sharepoint_file)
+_cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+_cache_lock = threading.Lock()
+
+# Thread pool running Sharepoint downloads and uploads of the process (see submitting_transfer)
+_transfers = {}
+_session_lock = threading.RLock()
+
+# Sharepoint requests of the current run, and the time until which they are held back after throttling 
+# (see requesting_sharepoint)
+_request_stats = {'requests': 0, 'retries': 0, 'throttled_seconds': 0.0}
+_request_lock = threading.Lock()
+_throttle = {'until': 0.0}
+
+# Progress of the transfer running on the current thread (see submitting_transfer)
+_transfer_local = threading.local()
+
+
+class TimedRequests: 
+    """
+    Stands for the requests module within the Office365 and Shareplum clients, which call requests without timeout: 
+    every call gets transfer_settings()['request_timeout'] (connect and read timeout), so a single stuck request 
+    fails (and is retried, see calling_sharepoint) instead of holding its transfer forever. 
+    """
+    def __getattr__(self, name): 
+        function = getattr(requests, name)
+        if name not in ('request', 'get', 'post', 'put', 'patch', 'delete', 'head'): 
+            return function
+        def calling(*args, **kwargs): 
+            kwargs.setdefault('timeout', global_params.transfer_settings()['request_timeout'])
+            return function(*args, **kwargs)
+        return calling
+
+
+for client_module in (office365.runtime.client_request, 
+                      office365.runtime.auth.providers.saml_token_provider, 
+                      office365.runtime.auth.providers.acs_token_provider, 
+                      shareplum.office365): 
+    client_module.requests = TimedRequests()
+
+
+def starting_sharepoint_session():
+    """
+    Drops the current Sharepoint session (if any), so the next Sharepoint call of the run logs in again, and resets 
+    the download cache, request and storage counters. Meant to be called at the start of every run. 
+    """
+    with _session_lock: 
+        _session.clear()
+    _cache_stats.update({'hits': 0, 'misses': 0, 'bytes_saved': 0})
+    with _request_lock: 
+        _request_stats.update({'requests': 0, 'retries': 0, 'throttled_seconds': 0.0})
+        _throttle['until'] = 0.0
+    storage.resetting_storage_statistics()
+
+
+def getting_sharepoint_session(sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/', 
+                               site: bool = False, 
+                               refresh: bool = False) -> dict:
+    """
+    Gets the Sharepoint session shared by every helper of this module (and OCAS_data, global_params), logging in only 
+    when there is no session yet, when it is older than transfer_settings()['session_lifetime'] or when asked to 
+    (refresh, after an authentication error). The Office365 client context and the Shareplum site are created the 
+    first time they are needed. A new session is built aside and swapped in whole, and callers get their own copy, 
+    so a refresh from another transfer never leaves them with half a session. 
+    
+    Args: 
+        sharepoint_base_url (str): Sharepoint base url
+        site (bool): If True, makes sure the Shareplum site is available too (set as False by default)
+        refresh (bool): If True, logs in again (set as False by default)
+    
+    Returns: 
+        dict with 'ctx' (office365 ClientContext), 'site' (shareplum Site, if requested) and 'files' (files read 
+        during the session, see program_school_dict)
+    
+    Example Usage: 
+        ctx = getting_sharepoint_session(sharepoint_base_url = sharepoint_base_url)['ctx']
+    """
+    sharepoint_base_url = sharepoint_base_url.rstrip('/') + '/'
+    lifetime = global_params.transfer_settings()['session_lifetime']
+
+    # One thread logs in at a time, the others wait for its session
+    with _session_lock: 
+        if refresh or _session.get('url') != sharepoint_base_url or time.monotonic() - _session.get('created_at', 0) > lifetime: 
+            # Getting credentials
+            sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
+        
+            #Constructing Details For Authenticating SharePoint
+            requesting_sharepoint()
+            auth = AuthenticationContext(sharepoint_base_url)
+            auth.acquire_token_for_user(sharepoint_user, sharepoint_password)
+            ctx = ClientContext(sharepoint_base_url, auth)
+            web = ctx.web
+            ctx.load(web)
+            ctx.execute_query()
+        
+            # Files already read are kept when only the login is renewed
+            files = _session.get('files', {}) if _session.get('url') in (None, sharepoint_base_url) else {}
+            session = {'url': sharepoint_base_url, 
+                       'ctx': ctx, 
+                       'files': files, 
+                       'created_at': time.monotonic()}
+            _session.clear()
+            _session.update(session)
+            print('[Info] Sharepoint session started.')
+    
+        if site and 'site' not in _session: 
+            sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
+            sharepoint_url = 'https://mylambton.sharepoint.com'
+        
+            # Authenticate with SharePoint
+            requesting_sharepoint()
+            authcookie = Office365(sharepoint_url, 
+                                   username=sharepoint_user, 
+                                   password=sharepoint_password).GetCookies()
+            _session['site'] = Site(sharepoint_base_url,  
+                                    version=Version.v2016,
+                                    authcookie=authcookie, 
+                                    timeout=global_params.transfer_settings()['request_timeout'])
+        return dict(_session)
+
+
+def is_authentication_error(error: Exception) -> bool:
+    """
+    Tells whether an error coming from Sharepoint looks like an expired or rejected login.
+    """
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None: 
+        return status_code in (401, 403)
+    message = str(error).lower()
+    return any(word in message for word in ['401', '403', 'unauthorized', 'forbidden', 'authentication', 'token'])
+
+
+def requesting_sharepoint(): 
+    """
+    Accounts for one Sharepoint request of the run: it is counted against transfer_settings()['request_budget'] and, 
+    while Sharepoint is throttling the run, held back until the time Sharepoint asked for (see backing_off). Once the 
+    budget is spent requests still go through (with a warning), optional transfers are skipped instead (see 
+    submitting_optional_transfer). The request counts as progress of the transfer running it (see transfer_expired), 
+    and a transfer the run gave up on (see waiting_transfers) sends no more requests. 
+    """
+    budget = global_params.transfer_settings()['request_budget']
+    progress = getattr(_transfer_local, 'progress', None)
+    if progress is not None and progress.get('abandoned'): 
+        raise TimeoutError('Sharepoint transfer given up by the run, not sending more requests.')
+    with _request_lock: 
+        _request_stats['requests'] += 1
+        if budget is not None and _request_stats['requests'] == budget + 1: 
+            print(f'[Info] Sharepoint request budget of the run ({budget} requests) spent, skipping optional transfers.')
+        wait = _throttle['until'] - time.monotonic()
+        if wait > 0: 
+            _request_stats['throttled_seconds'] += wait
+    if progress is not None: 
+        # The transfer is making progress (its next request goes once the throttling wait is over)
+        progress['at'] = time.monotonic() + max(wait, 0)
+    if wait > 0: 
+        time.sleep(wait)
+
+
+def sharepoint_budget_spent() -> bool: 
+    """
+    Tells whether the Sharepoint requests of the run reached transfer_settings()['request_budget']. 
+    """
+    budget = global_params.transfer_settings()['request_budget']
+    with _request_lock: 
+        return budget is not None and _request_stats['requests'] >= budget
+
+
+def retry_after_seconds(error: Exception) -> float: 
+    """
+    Reads the Retry-After header (seconds or HTTP date) Sharepoint sends along with throttled (429) and unavailable 
+    (503) answers. Returns None when there is no such header. 
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    retry_after = headers.get('Retry-After')
+    if retry_after is None: 
+        return None
+    try: 
+        return max(float(retry_after), 0.0)
+    except ValueError: 
+        pass
+    try: 
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError): 
+        return None
+
+
+def backing_off(error: Exception, 
+                attempt: int) -> float: 
+    """
+    Holds back every Sharepoint request of the run after a transient error: for as long as Sharepoint asked 
+    (Retry-After), otherwise for a random time up to backoff_base * 2 ** attempt seconds (exponential backoff with 
+    jitter, capped at backoff_max), so threads throttled together do not come back together. 
+    
+    Args: 
+        error (Exception): transient error (see is_transient_error)
+        attempt (int): number of retries of the request so far
+    
+    Returns: 
+        seconds to wait
+    """
+    settings = global_params.transfer_settings()
+    wait = retry_after_seconds(error)
+    if wait is None: 
+        wait = random.uniform(0, min(settings['backoff_max'], settings['backoff_base'] * 2 ** attempt))
+    wait = min(wait, settings['request_timeout'])
+    with _request_lock: 
+        _request_stats['retries'] += 1
+        _throttle['until'] = max(_throttle['until'], time.monotonic() + wait)
+    return wait
+
+
+def sharepoint_request_statistics() -> dict:
+    """
+    Returns the request counters of the current run: requests (logins included), retries, throttled_seconds (time 
+    requests were held back, summed over threads) and the request budget. 
+    
+    Example Usage: 
+        logger.info(f'Sharepoint requests: {custom_sharepoint.sharepoint_request_statistics()}')
+    """
+    with _request_lock: 
+        return dict(_request_stats, budget = global_params.transfer_settings()['request_budget'])
+
+
+def calling_sharepoint(operation, 
+                       sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/', 
+                       site: bool = False): 
+    """
+    Runs an operation with the shared Sharepoint session. If it fails with an authentication error, the session is 
+    refreshed and the operation tried once more. If it fails for a transient reason (throttling, server errors, 
+    timeouts, see is_transient_error), it is tried again after backing off (see backing_off), up to 
+    transfer_settings()['max_retries'] times. Every attempt is counted against the request budget of the run. 
+    
+    Args: 
+        operation (callable): function taking the session dictionary (see getting_sharepoint_session)
+        sharepoint_base_url (str): Sharepoint base url
+        site (bool): If True, the operation needs the Shareplum site (set as False by default)
+    
+    Returns: 
+        Whatever operation returns
+    
+    Example Usage: 
+        response = calling_sharepoint(lambda session: File.open_binary(session['ctx'], url))
+    """
+    max_retries = global_params.transfer_settings()['max_retries']
+    refresh = False
+    attempt = 0
+    while True: 
+        session = getting_sharepoint_session(sharepoint_base_url = sharepoint_base_url, site = site, refresh = refresh)
+        requesting_sharepoint()
+        try: 
+            return operation(session)
+        except Exception as e: 
+            if is_authentication_error(e) and not refresh: 
+                print(f'[Info] Sharepoint session expired ({e}), logging in again.')
+                refresh = True
+                continue
+            if not is_transient_error(e) or attempt >= max_retries: 
+                raise
+            wait = backing_off(e, attempt)
+            attempt += 1
+            refresh = False
+            status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+            print(f'[Info] Sharepoint busy ({status_code or e}), trying again in {wait:.1f} seconds.')
+
+def submitting_transfer(function, *args, **kwargs) -> Future: 
+    """
+    Runs a Sharepoint download or upload on the transfer manager, a thread pool shared by the whole process, so no more 
+    than transfer_settings()['max_workers'] transfers run at the same time. The caller gets a future right away and can 
+    keep working (database queries, pandas) while the transfer runs; its result is collected with waiting_transfers. 
+    Transfers submitted from a transfer run inline (no deadlock on a full pool), as part of the calling transfer. 
+    
+    Args: 
+        function (callable): function doing the transfer (e.g. upload_dataframe_as_txt_to_sharepoint, storage.reading_file)
+        *args, **kwargs: arguments of function
+    
+    Returns: 
+        concurrent.futures.Future with the result of function
+    
+    Example Usage: 
+        upload = submitting_transfer(upload_dataframe_as_txt_to_sharepoint, 
+                                     sharepoint_base_url = sharepoint_base_url, 
+                                     dataframe = dataframe, 
+                                     file_name = 'order.txt')
+        ...
+        waiting_transfers([upload])
+    """
+    progress = {}
+    def transferring(): 
+        progress['at'] = time.monotonic()
+        _transfer_local.progress = progress
+        try: 
+            return function(*args, **kwargs)
+        finally: 
+            _transfer_local.progress = None
+    
+    if threading.current_thread().name.startswith('sharepoint_transfer'): 
+        future = Future()
+        # Requests of the inline transfer are progress of the calling one
+        progress = getattr(_transfer_local, 'progress', None) or progress
+        try: 
+            future.set_result(function(*args, **kwargs))
+        except Exception as e: 
+            future.set_exception(e)
+    else: 
+        with _session_lock: 
+            if 'executor' not in _transfers: 
+                _transfers['executor'] = ThreadPoolExecutor(max_workers = global_params.transfer_settings()['max_workers'], 
+                                                            thread_name_prefix = 'sharepoint_transfer')
+        future = _transfers['executor'].submit(transferring)
+    future.description = getattr(function, '__name__', str(function))
+    future.progress = progress
+    return future
+
+
+def submitting_optional_transfer(function, *args, **kwargs) -> Future: 
+    """
+    Same as submitting_transfer, for transfers the run can do without (e.g. updating history files that the next run 
+    completes again): once the Sharepoint request budget of the run is spent (see sharepoint_budget_spent), the 
+    transfer is skipped with a warning and its future holds None. 
+    
+    Example Usage: 
+        upload = submitting_optional_transfer(storage.writing_file, 'registrations/BGEN.txt', content)
+    """
+    if not sharepoint_budget_spent(): 
+        return submitting_transfer(function, *args, **kwargs)
+    
+    description = getattr(function, '__name__', str(function))
+    print(f'[Info] Sharepoint request budget spent, {description} {args[0] if args else ""} skipped.')
+    future = Future()
+    future.set_result(None)
+    future.description = description
+    future.progress = {'at': time.monotonic()}
+    return future
+
+
+def transfer_expired(future: Future) -> bool: 
+    """
+    Tells whether a transfer (see submitting_transfer) is stuck: still running without having sent any Sharepoint 
+    request for twice transfer_settings()['request_timeout'] seconds (a single request gives up after request_timeout, 
+    see TimedRequests, so a transfer making progress always sends requests more often). A long transfer (a large 
+    chunked upload, throttled requests) is not expired as long as it keeps sending requests, and transfers waiting for 
+    a free thread are not expired. 
+    """
+    timeout = global_params.transfer_settings()['request_timeout']
+    return not future.done() and time.monotonic() - future.progress.get('at', time.monotonic()) > 2 * timeout
+
+
+def waiting_transfers(futures: List[Future]) -> list: 
+    """
+    Waits for transfers (see submitting_transfer) and returns their results. 
+    
+    Args: 
+        futures (List[Future]): transfers of interest
+    
+    Returns: 
+        list of results, in futures order. Raises the error of the first failed transfer, or TimeoutError if a transfer 
+        is stuck (see transfer_expired); a stuck transfer is given up, so it sends no more requests if it ever resumes. 
+    
+    Example Usage: 
+        waiting_transfers([order_upload, budget_upload])
+    """
+    results = []
+    for future in futures: 
+        while True: 
+            try: 
+                results.append(future.result(timeout = 1))
+                break
+            except concurrent.futures.TimeoutError: 
+                if transfer_expired(future): 
+                    future.progress['abandoned'] = True
+                    future.cancel()
+                    raise TimeoutError(f'Sharepoint transfer {future.description} sent no request for '
+                                       f'{2 * global_params.transfer_settings()["request_timeout"]} seconds.')
+    return results
+
+
+def downloading_sharepoint_file(sharepoint_file: str, 
+                                sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/') -> bytes:
+    """
+    Downloads a file from Sharepoint through a local cache: the local copy is kept with the ETag and last modified 
+    date Sharepoint sent along with it, and the next download is a conditional request (If-None-Match / 
+    If-Modified-Since). When the file did not change, Sharepoint only answers 304 and the local copy is used. 
+    Hits, misses and bytes saved are counted for the run (see sharepoint_cache_statistics). 
+    
+    Args: 
+        sharepoint_file (str): server relative url of the file (e.g. '/sites/EnrolmentDashboard/Shared%20Documents/projections.xlsx')
+        sharepoint_base_url (str): Sharepoint base url
+    
+    Returns: 
+        byte content of the file
+    
+    Example Usage: 
+        byte_content = downloading_sharepoint_file(sharepoint_file = '/sites/EnrolmentDashboard/Shared%20Documents/projections.xlsx')
+    """
+    # Local copy and its validators
+    cache_folder = Path(global_params.transfer_settings()['cache_folder']) / 'sharepoint'
+    local_file = cache_folder / sharepoint_file.replace('%20', ' ').strip('/')
+    manifest_path = cache_folder / 'manifest.json'
+    with _cache_lock: 
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        validators = manifest.get(sharepoint_file) if local_file.exists() else None
+    
+    def fetching(session):
+        ctx = session['ctx']
+        url = r"{0}/web/getFileByServerRelativePath(DecodedUrl='{1}')/\$value".format(ctx.service_root_url(), sharepoint_file)
+        request = RequestOptions(url)
+        if validators is not None: 
+            if validators.get('ETag'): 
+                request.set_header('If-None-Match', validators['ETag'])
+            if validators.get('Last-Modified'): 
+                request.set_header('If-Modified-Since', validators['Last-Modified'])
+        response = ctx.pending_request().execute_request_direct(request)
+        response.raise_for_status()
+        return response
+    
+    response = calling_sharepoint(fetching, sharepoint_base_url = sharepoint_base_url)
+    
+    # Unchanged file, taken from local copy
+    if response.status_code == 304: 
+        with _cache_lock: 
+            byte_content = local_file.read_bytes()
+            _cache_stats['hits'] += 1
+            _cache_stats['bytes_saved'] += len(byte_content)
+        print(f'[Info] {local_file.name} unchanged on Sharepoint, taken from local cache.')
+        return byte_content
+    
+    # New or changed file, local copy and its validators refreshed together (never a copy with validators of another version)
+    byte_content = response.content
+    with _cache_lock: 
+        _cache_stats['misses'] += 1
+        local_file.parent.mkdir(parents = True, exist_ok = True)
+        temporary = local_file.with_name(f'{local_file.name}.{os.getpid()}.tmp')
+        temporary.write_bytes(byte_content)
+        os.replace(temporary, local_file)
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        manifest[sharepoint_file] = {'ETag': response.headers.get('ETag'), 
+                                     'Last-Modified': response.headers.get('Last-Modified')}
+        temporary = manifest_path.with_name(f'{manifest_path.name}.{os.getpid()}.tmp')
+        temporary.write_text(json.dumps(manifest))
+        os.replace(temporary, manifest_path)
+    return byte_content
+
+
+def sharepoint_cache_statistics() -> dict:
+    """
+    Returns the download cache counters of the current run: hits (files served from local copy), misses (files 
+    downloaded) and bytes_saved. 
+    
+    Example Usage: 
+        logger.info(f'Sharepoint cache: {custom_sharepoint.sharepoint_cache_statistics()}')
+    """
+    with _cache_lock: 
+        return dict(_cache_stats)
+
+
+def loading_side_file(local_folder: str, 
+                      file_name: str, 
+                      sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/') -> pd.DataFrame: 
+    """
+    Loads an order or budget file from Sharepoint with its declared schema (see global_params.side_files_schema): 
+    Program and School as categories, Budget as integer. The file is read at once (no row by row parsing) and kept 
+    for the rest of the run (until starting_sharepoint_session), so all callers of a run share the same frame. 
+    
+    Args: 
+        local_folder (str): folder within sharepoint containing file of interest ('orders' or 'budgets')
+        file_name (str): name of file to load
+        sharepoint_base_url (str): Sharepoint base url
+    
+    Returns: 
+        pd.DataFrame indexed by Program (first occurrence of every program, in file order) with School or Budget column
+    
+    Example Usage: 
+        budget = loading_side_file(local_folder = 'budgets', file_name = 'budget_fall.txt')
+        budget.loc['ACTG', 'Budget']
+    """
+    files = _session.setdefault('files', {})
+    if (local_folder, file_name) not in files: 
+        schema = global_params.side_files_schema()[local_folder]
+        byte_content = storage.reading_file(path = f'{local_folder}/{file_name}')
+        files[(local_folder, file_name)] = parsing_side_file(byte_content = byte_content, schema = schema)
+    return files[(local_folder, file_name)]
+
+
+def parsing_side_file(byte_content: bytes, 
+                      schema: dict) -> pd.DataFrame: 
+    """
+    Parses a side file (see loading_side_file) with a schema mapping column names, in file order, to data types. 
+    Integer columns with empty values get 0. A program listed more than once takes the values of its last row. 
+    """
+    names = list(schema)
+    numeric = [name for name in names if schema[name].startswith('int')]
+    dataframe = pd.read_csv(io.BytesIO(byte_content), 
+                            sep = '\t', 
+                            header = 0, 
+                            names = names, 
+                            usecols = range(len(names)), 
+                            dtype = {name: ('float64' if name in numeric else schema[name]) for name in names})
+    dataframe[numeric] = dataframe[numeric].fillna(0)
+    dataframe = dataframe.astype(schema)
+    
+    # Programs listed twice: the last row wins (as it did when side files were read into dictionaries), in the place 
+    # of the first one
+    duplicated = dataframe[names[0]].duplicated()
+    if duplicated.any(): 
+        print(f'[Info] {names[0]} listed more than once in side file, keeping last rows: {sorted(set(dataframe.loc[duplicated, names[0]].astype(str)))}')
+    first_rows = dataframe[names[0]][~duplicated]
+    dataframe = dataframe[~dataframe[names[0]].duplicated(keep = 'last')].set_index(names[0]).loc[first_rows]
+    return dataframe
+
+
+def remembering_side_file(local_folder: str, 
+                          file_name: str, 
+                          byte_content: bytes): 
+    """
+    Keeps the content of a side file just written (see side_files_handling.setting_order_budget) as the version of 
+    the run, so loading_side_file does not download it back. 
+    """
+    _session.setdefault('files', {})[(local_folder, file_name)] = parsing_side_file(byte_content = byte_content, 
+                                                                                    schema = global_params.side_files_schema()[local_folder])
+
+
+def parsing_two_column_file(byte_content: bytes, 
+                            col2_name: str = 'School') -> pd.DataFrame: 
+    """
+    Parses a two column text file (see sharepoint_download) into Program and col2_name columns, both as text.
+    """
+    # Reading both columns at once, as text
+    order = pd.read_csv(io.BytesIO(byte_content), 
+                        sep = '\t', 
+                        usecols = [0, 1], 
+                        dtype = str, 
+                        keep_default_na = False)
+    order.columns = ['Program', col2_name]
+    order.index = order.index + 1
+    return order
+
+
 #Constrtucting SharePoint URL and credentials 
 def sharepoint_download(sharepoint_base_url,
                         local_folder,
@@ -37,34 +594,11 @@ def sharepoint_download(sharepoint_base_url,
                                     local_folder = 'orders',
                                     file_name = 'order.txt')
     """
-	# Getting credentials
-    sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-    
-    # Root location for project
-    folder_in_sharepoint = '/sites/EnrolmentDashboard/Shared%20Documents/'+local_folder+'/'
-
-    #Constructing Details For Authenticating SharePoint
-    auth = AuthenticationContext(sharepoint_base_url)
-    auth.acquire_token_for_user(sharepoint_user, sharepoint_password)
-    ctx = ClientContext(sharepoint_base_url, auth)
-    web = ctx.web
-    ctx.load(web)
-    ctx.execute_query()
-
-    #Reading File from SharePoint Folder
-    sharepoint_file = folder_in_sharepoint+file_name
-    response = File.open_binary(ctx, sharepoint_file)
-    
-    # Wrangling file into a file, reading line by line 
-    s = response.text
-    order = pd.DataFrame()
-    for i in range(len(s.splitlines())):
-        order.loc[i,'Program'] = s.splitlines()[i].split('\t')[0]
-        order.loc[i,col2_name] = s.splitlines()[i].split('\t')[1]
-    order = order.drop(labels=0, axis=0)
-    
+    #Reading File from storage (SharePoint by default, local cache when unchanged)
+    byte_content = storage.reading_file(path = local_folder+'/'+file_name)
     
-    return order;
+    return parsing_two_column_file(byte_content = byte_content, 
+                                   col2_name = col2_name);
 
 def sharepoint_download_excel(sharepoint_base_url, 
                               file_name, 
@@ -85,30 +619,18 @@ def sharepoint_download_excel(sharepoint_base_url,
          sharepoint_download_excel(sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/',
                                     name = 'order.txt')
     """
-	# Getting credentials
-    sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-    
-    # Root location for project
+    # Location within Shared Documents
     if folder is None: 
-        folder_in_sharepoint = '/sites/EnrolmentDashboard/Shared%20Documents/'
+        path = file_name
     else:
-        folder_in_sharepoint = f'/sites/EnrolmentDashboard/Shared%20Documents/{folder}/'
-
-    #Constructing Details For Authenticating SharePoint
-    auth = AuthenticationContext(sharepoint_base_url)
-    auth.acquire_token_for_user(sharepoint_user, sharepoint_password)
-    ctx = ClientContext(sharepoint_base_url, auth)
-    web = ctx.web
-    ctx.load(web)
-    ctx.execute_query()
+        path = f'{folder}/{file_name}'
     
-    #Reading File from SharePoint Folder
-    sharepoint_file = folder_in_sharepoint+file_name
-    response = File.open_binary(ctx, sharepoint_file)
+    #Reading File from storage (SharePoint by default, local cache when unchanged)
+    byte_content = storage.reading_file(path = path)
     
 	#save data to BytesIO stream
     bytes_file_obj = io.BytesIO()
-    bytes_file_obj.write(response.content)
+    bytes_file_obj.write(byte_content)
     bytes_file_obj.seek(0) #set file object to start
     
 	#read excel file and each sheet into pandas dataframe 
@@ -126,12 +648,174 @@ def sharepoint_download_excel(sharepoint_base_url,
 
 
 
+def is_transient_error(error: Exception) -> bool:
+    """
+    Tells whether an error coming from Sharepoint is worth retrying: connection problems, timeouts, throttling (429) 
+    and server errors (5xx).
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)): 
+        return True
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None: 
+        return status_code == 429 or status_code >= 500
+    message = str(error).lower()
+    return any(word in message for word in ['429', '500', '502', '503', '504', 'timed out', 'connection'])
+
+
+def uploaded_offset(session: dict, 
+                    file_url: str, 
+                    upload_id: str) -> int: 
+    """
+    Asks Sharepoint how many bytes of an upload session it received (ExpectedContentRange of GetUploadStatus), so a 
+    chunk whose answer was lost is not sent twice. Returns None when Sharepoint knows no such session (not started, 
+    or already finished). 
+    """
+    try: 
+        status = session['ctx'].web.get_file_by_server_relative_url(file_url).get_upload_status(upload_id)
+        session['ctx'].execute_query()
+    except Exception as e: 
+        if is_transient_error(e) or is_authentication_error(e): 
+            raise
+        return None
+    expected_range = status.properties.get('ExpectedContentRange')
+    return int(str(expected_range).split('-')[0]) if expected_range else None
+
+
+def sending_chunk(file_content: bytes, 
+                  offset: int, 
+                  chunk_size: int, 
+                  file_url: str, 
+                  upload_id: str): 
+    """
+    Builds the operation (see calling_sharepoint) sending the chunk of an upload session starting at offset: start, 
+    continue or finish, depending on its position. When the operation runs again after a failure, Sharepoint is first 
+    asked how far the upload got (see uploaded_offset), and the chunk is only sent if it was not received. 
+    
+    Args: 
+        file_content (bytes): content of the whole file
+        offset (int): position of the chunk within file_content
+        chunk_size (int): size (bytes) of the chunk
+        file_url (str): server relative url of the file being uploaded
+        upload_id (str): upload session id
+    
+    Returns: 
+        operation taking the session dictionary and returning the offset of the next chunk
+    """
+    chunk = file_content[offset:offset + chunk_size]
+    step = 'start' if offset == 0 else ('finish' if offset + len(chunk) >= len(file_content) else 'continue')
+    attempts = {'count': 0}
+    
+    def sending(session):
+        attempts['count'] += 1
+        if attempts['count'] > 1: 
+            received = uploaded_offset(session, file_url, upload_id)
+            if received is not None and received != offset: 
+                print(f'[Info] Sharepoint already received {received} bytes of {file_url.split("/")[-1]}, resuming from there.')
+                return received
+            if received is None and step == 'finish': 
+                # No session left: the finish chunk was received if the file is complete
+                target_file = session['ctx'].web.get_file_by_server_relative_url(file_url)
+                session['ctx'].load(target_file, ['Length'])
+                session['ctx'].execute_query()
+                if int(target_file.properties.get('Length', -1)) == len(file_content): 
+                    return len(file_content)
+        
+        target_file = session['ctx'].web.get_file_by_server_relative_url(file_url)
+        if step == 'start': 
+            result = target_file.start_upload(upload_id, chunk)
+        elif step == 'continue': 
+            result = target_file.continue_upload(upload_id, offset, chunk)
+        else: 
+            target_file.finish_upload(upload_id, offset, chunk)
+        session['ctx'].execute_query()
+        return offset + len(chunk) if step == 'finish' else int(result.value)
+    return sending
+
+
+def uploading_file(file_content: bytes, 
+                   file_name: str, 
+                   folder_url: str = 'Shared Documents/', 
+                   sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/'):
+    """
+    Uploads a file to a Sharepoint folder. Files up to transfer_settings()['chunk_threshold'] bytes go in a single 
+    request; larger ones through an upload session (startUpload, continueUpload, finishUpload) of chunk_size chunks on 
+    a temporary file, moved over the target once complete (the target is untouched if the upload fails). A chunk 
+    failing for a transient reason (see is_transient_error) is sent again, with backoff (see calling_sharepoint), 
+    from the offset Sharepoint says it received, so an upload resumes instead of starting over. 
+    
+    Args: 
+        file_content (bytes): content of the file
+        file_name (str): name given to the file in Sharepoint
+        folder_url (str): folder, relative to the site, where the file is stored
+        sharepoint_base_url (str): Sharepoint base url
+    
+    Returns: 
+        None
+    
+    Example Usage: 
+        uploading_file(file_content = Path('reports/2024F_EnrolmentReport.xlsx').read_bytes(), 
+                       file_name = 'DashboardInput_fall.xlsx')
+    """
+    settings = global_params.transfer_settings()
+    
+    # Small files, single request
+    if len(file_content) <= settings['chunk_threshold']: 
+        def uploading(session):
+            target_folder = session['ctx'].web.get_folder_by_server_relative_url(folder_url)
+            target_folder.upload_file(file_name, file_content)
+            session['ctx'].execute_query()
+        calling_sharepoint(uploading, sharepoint_base_url = sharepoint_base_url)
+        return None
+    
+    # Large files, upload session on a temporary file (created empty, then filled chunk by chunk), moved over the 
+    # target once complete, so a failed upload never leaves the target empty or incomplete
+    upload_id = str(uuid.uuid4())
+    folder_path = urlparse(sharepoint_base_url).path.rstrip('/') + '/' + folder_url.strip('/')
+    file_url = folder_path + '/' + file_name
+    temporary_name = f'{file_name}.{upload_id[:8]}.uploading'
+    temporary_url = folder_path + '/' + temporary_name
+    def creating(session):
+        session['ctx'].web.get_folder_by_server_relative_url(folder_url).upload_file(temporary_name, b'')
+        session['ctx'].execute_query()
+    calling_sharepoint(creating, sharepoint_base_url = sharepoint_base_url)
+    
+    chunk_size = min(settings['chunk_size'], len(file_content) - 1) # at least a start and a finish chunk
+    offset = 0
+    try: 
+        while offset < len(file_content): 
+            offset = calling_sharepoint(sending_chunk(file_content = file_content, 
+                                                      offset = offset, 
+                                                      chunk_size = chunk_size, 
+                                                      file_url = temporary_url, 
+                                                      upload_id = upload_id), 
+                                        sharepoint_base_url = sharepoint_base_url)
+        
+        def moving(session):
+            session['ctx'].web.get_file_by_server_relative_url(temporary_url).moveto(file_url, 1) # 1: overwrite
+            session['ctx'].execute_query()
+        calling_sharepoint(moving, sharepoint_base_url = sharepoint_base_url)
+    except Exception: 
+        # Temporary file removed (best effort), target left as it was
+        try: 
+            def deleting(session):
+                session['ctx'].web.get_file_by_server_relative_url(temporary_url).delete_object()
+                session['ctx'].execute_query()
+            calling_sharepoint(deleting, sharepoint_base_url = sharepoint_base_url)
+        except Exception as e: 
+            print(f'[Info] Temporary file {temporary_name} could not be removed ({e}).')
+        raise
+    print(f'[Info] {file_name} uploaded in {-(-len(file_content) // chunk_size)} chunks.')
+    return None
+
+
 def sharepoint_upload(sharepoint_base_url,
                         root, 
                         report_name,
-                        file_name = 'DashboardInput.xlsx'):
+                        file_name = 'DashboardInput.xlsx',
+                        file_content: bytes = None):
         """
         This function uploads a dataframe embedded into a excel file directly to sharepoint.
+        When the workbook was built in memory, its content is uploaded as is, without reading the report from disk.
         
         Args: 
             sharepoint_user (str): Sharepoint user
@@ -140,6 +824,7 @@ def sharepoint_upload(sharepoint_base_url,
             root (str): local root path
             report_name (str): Name of the report to be uploaded
             file_name (str): name given to the upload file in Sharepoint
+            file_content (bytes): content of the workbook (read from root/reports/<report_name>.xlsx by default)
         
         Returns: 
             pd.DataFrame containing the data of interest 
@@ -151,33 +836,17 @@ def sharepoint_upload(sharepoint_base_url,
                                 root = root,
                                 report_name = report_name)
         """
-        # Getting credentials
-        sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-        
-        # Folder URL relative to the site URL where the file will be stored
-        folder_url = 'Shared Documents/'
-        
-
-        # Authenticate to SharePoint
-        auth_ctx = AuthenticationContext(sharepoint_base_url)
-        if auth_ctx.acquire_token_for_user(sharepoint_user, sharepoint_password):
-            client_ctx = ClientContext(sharepoint_base_url, auth_ctx)
-
-            # Get the target folder
-            target_folder = client_ctx.web.get_folder_by_server_relative_url(folder_url)
-
-            # Read file and upload
+        # Read file (unless already in memory)
+        if file_content is None:
             report_name = report_name+".xlsx"
             file_path = Path(root /'reports'/ report_name)
-
             with open(file_path, 'rb') as content_file:
                 file_content = content_file.read()
-            target_file = target_folder.upload_file(file_name, file_content)
-            client_ctx.execute_query()
 
-            print(f"[Info] {file_name} successfully uploaded to SharePoint.")
-        else:
-            print(f"Failed to authenticate to SharePoint for user {sharepoint_user}.")
+        # Upload to Shared Documents (in chunks when the file is large)
+        storage.writing_file(path = file_name, 
+                             content = file_content)
+        print(f"[Info] {file_name} successfully uploaded to SharePoint.")
             
         return None;
 
@@ -225,43 +894,30 @@ def upload_dataframe_as_txt_to_sharepoint(sharepoint_base_url,
                                                 dataframe = dataframe, 
                                                 file_name = 'file.txt')
     """
-	# Getting credentials
-    sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-    
-    # Creating connection 
-    ctx_auth = AuthenticationContext(sharepoint_base_url)
-    ctx_auth.acquire_token_for_user(sharepoint_user, sharepoint_password)
-    ctx = ClientContext(sharepoint_base_url, ctx_auth)
-
     # Convert DataFrame to text (CSV format in this example)
     csv_data = dataframe.to_csv(index=False, sep='\t')
 
-    # Get the destination folder
-    destination_folder = ctx.web.get_folder_by_server_relative_url(destination_folder_url)
-
     # Upload the CSV data as a text file
-    target_file = destination_folder.upload_file(file_name, StringIO(csv_data))
-
-    ctx.execute_query()
+    storage.writing_file(path = storage.relative_path(destination_folder_url) + '/' + file_name, 
+                         content = csv_data.encode('utf-8'))
     return None
 
 
 def list_files_in_sharepoint(term, 
-                             folder):
+                             folder,
+                             metadata: bool = False):
     """
     Lists files within a SharePoint folder.
 
     Args:
 		- term (str): term of interest
 		- folder (str): folder to pull data
+		- metadata (bool): If True, returns name, size and last modified time of each file instead of names only (set as False by default)
 
     Returns:
-		- List of file names within the specified SharePoint folder.
-		- Connection to folder within Sharepoint
+		- List of file names (or file metadata dictionaries) within the specified SharePoint folder.
+		- Folder path within storage (see storage.reading_file and storage.writing_file)
     """
-    # Loading credentials
-    sharepoint_user, sharepoint_password =  python_utils.load_credentials(sharepoint = True)
-    
     # helper dict
     intake_dict = global_params.intake_dict()
     # {'F':'fall',
@@ -269,21 +925,77 @@ def list_files_in_sharepoint(term,
     #                'S':'spring'}
     # setting locations
     
-    sharepoint_url = 'https://mylambton.sharepoint.com'
-    folder_url  = f'/sites/EnrolmentDashboard/Shared%20Documents/program_history/{folder}/{intake_dict[term[-1]]}'
+    folder  = f'program_history/{folder}/{intake_dict[term[-1]]}'
     
-    # Authenticate with SharePoint
-    authcookie = Office365(sharepoint_url, 
-                           username=sharepoint_user, 
-                           password=sharepoint_password).GetCookies()
-    site = Site(sharepoint_url+'/sites/EnrolmentDashboard/',  
-                version=Version.v2016,
-                authcookie=authcookie)
+    # List files (SharePoint by default)
+    files = storage.listing_files(folder = folder)
+    if not metadata: 
+        files = [file['Name'] for file in files]
+    return files, folder
 
-    # Get folder
-    folder = site.Folder(folder_url)
 
-    # List files
-    files = folder.files
-    files = [file['Name'] for file in files]
-    return files, folder
+def downloading_folder_files(folder, 
+                             files: List[dict], 
+                             cache_folder, 
+                             max_workers: int = None):
+    """
+    Downloads a set of files from a Sharepoint folder on the transfer manager (see submitting_transfer), handing each file over 
+    as soon as it arrives. Files whose size and last modified time match the local copy are read from the local 
+    cache instead of being downloaded again. 
+    
+    Args: 
+        folder (str): Folder path within storage (output of list_files_in_sharepoint)
+        files (List[dict]): Files metadata ('Name', 'Length', 'TimeLastModified'), as given by list_files_in_sharepoint
+        cache_folder (str or Path): Local folder where copies of the files are kept
+        max_workers (int): Maximum number of simultaneous downloads (all of the transfer manager by default)
+    
+    Returns: 
+        generator of (file name, byte content) tuples, in order of arrival
+    
+    Example Usage: 
+        files, folder = list_files_in_sharepoint(term = '2024F', folder = 'applications', metadata = True)
+        for file_name, byte_content in downloading_folder_files(folder = folder, 
+                                                                files = files, 
+                                                                cache_folder = 'cache/applications'):
+            ...
+    """
+    # Local copies and their Sharepoint signature (size and last modified time)
+    cache_folder = Path(cache_folder)
+    cache_folder.mkdir(parents = True, exist_ok = True)
+    manifest_path = cache_folder / 'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    
+    def fetching_file(file):
+        signature = {'Length': str(file['Length']), 
+                     'TimeLastModified': str(file['TimeLastModified'])}
+        local_file = cache_folder / file['Name']
+        
+        # Unchanged files are taken from local copy
+        if manifest.get(file['Name']) == signature and local_file.exists(): 
+            return file['Name'], local_file.read_bytes(), signature, True
+        
+        byte_content = storage.reading_file(path = f"{folder}/{file['Name']}")
+        local_file.write_bytes(byte_content)
+        return file['Name'], byte_content, signature, False
+
+    hits = 0
+    try:
+        # At most max_workers files in flight, next one submitted as soon as one arrives
+        pending = list(files)
+        running = set()
+        while pending or running: 
+            while pending and (max_workers is None or len(running) < max_workers): 
+                running.add(submitting_transfer(fetching_file, pending.pop(0)))
+            done, running = wait(running, timeout = 1, return_when = FIRST_COMPLETED)
+            for future in running: 
+                if transfer_expired(future): 
+                    waiting_transfers([future])
+            for future in done: 
+                file_name, byte_content, signature, cached = waiting_transfers([future])[0]
+                manifest[file_name] = signature
+                hits += cached
+                yield file_name, byte_content
+    finally:
+        manifest_path.write_text(json.dumps(manifest))
+    
+    print(f'[Info] {len(files) - hits} files downloaded, {hits} files taken from local cache ({cache_folder}).')
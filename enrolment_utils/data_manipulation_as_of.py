@@ -3,7 +3,7 @@ import numpy as np
 import datetime as dt
 import pyodbc
 from typing import List
-from enrolment_utils import queries_as_of
+from enrolment_utils import queries_as_of, count_cube
 # from tqdm import tqdm
 
 
@@ -32,7 +32,7 @@ def Applications(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
-        # Running query
+        # Running query (not read from the count cube: ApplicationsQuery adds k years, so past terms get their latest status)
         dataset = queries_as_of.ApplicationsQuery(term,str(k), cnxn)
         
         # assumption. If level is missing, assume as AAL01. Setting it as a integer
@@ -84,7 +84,7 @@ def DeletedApplications(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
-        # Running query
+        # Running query (not read from the count cube: ApplicationsQuery adds k years, so past terms get their latest status)
         dataset = queries_as_of.ApplicationsQuery(term,str(k), cnxn)
         
         # assumption. If level is missing, assume as AAL01. Setting it as integer
@@ -135,6 +135,12 @@ def Offers(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'Offers', column_name = 'Offers '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
          # Running query
         dataset = queries_as_of.OffersQuery(term,str(k), cnxn)
         
@@ -197,6 +203,12 @@ def TableauOutstandingOffers(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'OutstandingOffers', column_name = 'Outstanding Offers '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.TableauQuery(term,str(k), cnxn)
         
@@ -311,6 +323,12 @@ def TableauHolds(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'Holds', column_name = 'Hold '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.TableauQuery(term,str(k), cnxn)
         
@@ -367,6 +385,12 @@ def TableauWithdrawals(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'Withdrawals', column_name = 'Withdrawals and Refused '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.TableauQuery(term,str(k), cnxn)
         
@@ -421,6 +445,12 @@ def TableauWaitlist(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'Waitlist', column_name = 'Waitlisted '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.TableauQuery(term,str(k), cnxn)
         
@@ -477,6 +507,12 @@ def confirmations(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'Confirmations', column_name = 'Confirmations '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.ConfirmationsQuery(term,str(k), cnxn)
 
@@ -521,6 +557,12 @@ def FirstApplications(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'FirstApplications', column_name = 'First Choice Applicants '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # Running query
         dataset = queries_as_of.FirstApplicationsQuery(term,str(k), cnxn)
         
@@ -1025,6 +1067,12 @@ def term_deposits(order: pd.DataFrame,
 
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
+        
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup_students(term = term, k = k, metric = 'Term01Deposits' if aal01 else 'UpperYearDeposits', column_name = 'Returning students '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = ['Program', 'student'], how = 'left')
+            continue
         # running the query 
         dataset = queries_as_of.ReturningStudentsQuery(term,str(k), cnxn)
 
@@ -1094,6 +1142,12 @@ def registrations(order: pd.DataFrame,
 
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
+        
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup_students(term = term, k = k, metric = 'Term01Registrations' if aal01 else 'UpperYearRegistrations', column_name = 'Registrations '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = ['Program', 'student'], how = 'left')
+            continue
         # running the query 
         dataset = queries_as_of.xstl_query_term_level_campus(term,str(k), cnxn)
         
@@ -1153,6 +1207,12 @@ def total_registrations(order:pd.DataFrame,
         # k is the number to pass to the query, it tells the query how many years back it should go to retrieve data as of today
         k = int(terms[-1][0:4]) - int(term[0:4])
         
+        # Past terms are read from the daily count cube, when materialized
+        dataset = count_cube.count_cube_lookup(term = term, k = k, metric = 'TotalRegistrations', column_name = 'Total Registrations '+term)
+        if dataset is not None: 
+            order = order.merge(dataset, on = 'Program',how = 'left')
+            continue
+        
         # running the query 
         dataset = queries_as_of.xstl_query_term_level_campus(term,str(k), cnxn)
         
@@ -0,0 +1,362 @@
+import pandas as pd 
+import numpy as np
+import pyodbc
+from typing import List
+from enrolment_utils import queries_as_of, python_utils
+
+
+# Statuses used by the as of today builders (data_manipulation_as_of), so numbers are comparable with the workbook
+OFFER_STATUSES = 'WAC|WCF|MTS|MVD|WMS|ACC|ACU|HMS|WTN|AOF'
+CONFIRMATION_STATUSES = ['CCC','CUC','MTS','MVD']
+HOLD_STATUSES = ['HDE','HLCI','HLD','HLF','HLG','HLM','HLN','HLR','HLS','HLT','HLX','HMD',
+                 'HME','HMM','HMS','HLS','HLB','HLA']
+WITHDRAWAL_STATUSES = ['RFQ','RST','WAC','WAP','WCF','WMS']
+WAITLIST_STATUSES = ['WTL','WTN']
+REGISTRATION_STATUSES = ['A','D','N']
+
+FUNNEL_METRICS = ['FirstApplications', 'Applications', 'Offers', 'Confirmations', 
+                  'Holds', 'Withdrawals', 'Waitlist', 'Registrations']
+
+# Every metric that can be rebuilt as of any date (funnel metrics plus the split used by deposits and registrations sheets)
+ALL_METRICS = ['FirstApplications', 'Applications', 'Offers', 'OutstandingOffers', 
+               'Confirmations', 'Holds', 'Withdrawals', 'Waitlist', 'Registrations', 
+               'Term01Deposits_domestic', 'Term01Deposits_international', 
+               'UpperYearDeposits_domestic', 'UpperYearDeposits_international', 
+               'Term01Registrations_domestic', 'Term01Registrations_international', 
+               'UpperYearRegistrations_domestic', 'UpperYearRegistrations_international', 
+               'TotalRegistrations']
+
+
+def status_intervals(dataset: pd.DataFrame, 
+                     key: str, 
+                     date_column: str, 
+                     pos_column: str) -> pd.DataFrame:
+    """
+    This function turns a status history into validity intervals, so the status as of any date is the one whose 
+    interval contains such date. It matches the as of logic of the queries: the status as of a date is the one with the 
+    lowest position among statuses dated on or before such date (SELECT TOP 1 POS ... WHERE STATUS_DATE <= @STAT_DATE). 
+    A status is then valid from its status date until the first date of any status with a lower position, and never 
+    valid if such status is dated on or before its own. 
+    
+    Args: 
+        dataset (pd.DataFrame): status history (output of ApplicationStatusHistoryQuery or RegistrationStatusHistoryQuery)
+        key (str): column identifying each record
+        date_column (str): column with status dates
+        pos_column (str): column with status position (1 being the latest status)
+    
+    Returns: 
+        pd.DataFrame with the same rows plus 'valid_from' and 'valid_to' columns (valid_to is exclusive), oldest 
+        position first
+    """
+    dataset = dataset.copy()
+    dataset['valid_from'] = pd.to_datetime(dataset[date_column]).dt.normalize()
+    
+    # Statuses of lower position end the validity of the current one
+    dataset = dataset.sort_values([key, pos_column]).reset_index(drop = True)
+    dataset['valid_to'] = earlier_rows_minimum(dataset['valid_from'], dataset[key])
+    dataset = dataset.sort_values([key, pos_column], ascending = [True, False]).reset_index(drop = True)
+    return dataset
+
+
+def earlier_rows_minimum(dates: pd.Series, 
+                         groups) -> pd.Series:
+    """
+    Earliest of the dates of the previous rows of each group (pd.Timestamp.max for the first row of a group, missing 
+    dates being ignored). Used as the end of validity of rows that only count while no earlier row does. 
+    """
+    never = pd.Timestamp.max.normalize()
+    dates = dates.fillna(never)
+    return dates.groupby(groups).cummin().groupby(groups).shift(1).fillna(never)
+
+
+def counting_as_of_dates(intervals: pd.DataFrame, 
+                         mask: pd.Series, 
+                         group_column: str, 
+                         groups: List[str], 
+                         dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    This function counts, for every group and every date, how many intervals flagged by mask contain such date. 
+    All dates are evaluated at once: count(valid_from <= date) - count(valid_to <= date). 
+    
+    Args: 
+        intervals (pd.DataFrame): output of status_intervals
+        mask (pd.Series): boolean flag of statuses to be counted 
+        group_column (str): column to group by (typically program)
+        groups (List[str]): groups to report, in order (groups without records are counted as zero)
+        dates (pd.DatetimeIndex): as of dates to evaluate
+    
+    Returns: 
+        np.ndarray of shape (groups, dates) with counts
+    """
+    dates = dates.values.astype('datetime64[ns]')
+    counts = np.zeros((len(groups), len(dates)), dtype = int)
+    positions = {group: i for i, group in enumerate(groups)}
+    for group, rows in intervals.loc[mask, [group_column, 'valid_from', 'valid_to']].groupby(group_column):
+        if group not in positions: 
+            continue
+        starts = np.sort(rows['valid_from'].values.astype('datetime64[ns]'))
+        ends = np.sort(rows['valid_to'].values.astype('datetime64[ns]'))
+        counts[positions[group]] = np.searchsorted(starts, dates, side = 'right') - np.searchsorted(ends, dates, side = 'right')
+    return counts
+
+
+def new_student_flag(program: pd.Series, 
+                     level: pd.Series) -> pd.Series:
+    """
+    AAL 04 for FIRE, AALs 01 and 03 for TREX and AAL 01 for the rest of the programs are new students
+    """
+    return (((program == 'FIRE') & (level == 4)) | 
+            ((program == 'TREX') & (level.isin([1,3]))) | 
+            (level == 1))
+
+
+def new_student_section_flag(program: pd.Series, 
+                             section: pd.Series) -> pd.Series:
+    """
+    Same as new_student_flag, on CTRL course sections as the deposits and registrations builders read them (text 
+    compared to '01', '03' and '04', so a missing section is a returning student)
+    """
+    section = section.astype(str)
+    return (((program == 'FIRE') & (section == '04')) | 
+            ((program == 'TREX') & (section == '03')) | 
+            (section == '01'))
+
+
+def application_metrics(intervals: pd.DataFrame) -> dict:
+    """
+    This function flags application statuses counted by each metric, following the definitions used on the as of 
+    today builders (data_manipulation_as_of).
+    
+    Args: 
+        intervals (pd.DataFrame): output of status_intervals over ApplicationStatusHistoryQuery
+    
+    Returns: 
+        dictionary with metric name as key and boolean pd.Series as value 
+    """
+    # assumption. If level is missing, assume as AAL01. Setting it as integer
+    level = intervals['Level'].fillna(1).astype(int)
+    new = new_student_flag(intervals['Program'], level)
+    status = intervals['Status'].fillna('')
+    
+    # Offers also include DNA when the application had an ACC or ACU status at any time (full history, as the 
+    # PreviousStatuses column of OffersQuery)
+    had_acceptance = status.str.contains('ACC|ACU').groupby(intervals['Application_ID']).transform('any')
+    
+    # OffersQuery and ConfirmationsQuery only keep applicants with a preferred address (inner join)
+    has_address = intervals['Has_Address'] == 1
+    
+    metrics = {'FirstApplications': intervals['Choice'] == 1, 
+               'Applications': new & (status != 'DLT'), 
+               'Offers': has_address & new & (status.str.contains(OFFER_STATUSES) | ((status == 'DNA') & had_acceptance)), 
+               'OutstandingOffers': status.isin(['ACC','ACU']), 
+               'Confirmations': has_address & status.isin(CONFIRMATION_STATUSES), 
+               'Holds': status.isin(HOLD_STATUSES), 
+               'Withdrawals': status.isin(WITHDRAWAL_STATUSES), 
+               'Waitlist': status.isin(WAITLIST_STATUSES)}
+    return metrics
+
+
+def registration_metrics(intervals: pd.DataFrame) -> dict:
+    """
+    This function flags registration statuses counted as registrations: full-time term 01 registrations (domestic and 
+    international together), the same split by term 01/upper year and student type, and total registrations. 
+    Full-time is read from the current STTR_STUDENT_LOAD (STUDENT_TERMS keeps no history), as 
+    xstl_query_term_level_campus does for every as of date. 
+    
+    Args: 
+        intervals (pd.DataFrame): output of status_intervals over RegistrationStatusHistoryQuery
+    
+    Returns: 
+        dictionary with metric name as key and boolean pd.Series as value 
+    """
+    # Section compared as text, as in data_manipulation_as_of.registrations
+    new = new_student_section_flag(intervals['program'], intervals['AAL'])
+    registered = intervals['status'].isin(REGISTRATION_STATUSES)
+    full_time = registered & intervals['current_load'].isin(['F','O'])
+    international = intervals['imm_status'] == 'SV'
+    
+    metrics = {'Registrations': new & full_time, 
+               'Term01Registrations_domestic': new & full_time & ~international, 
+               'Term01Registrations_international': new & full_time & international, 
+               'UpperYearRegistrations_domestic': ~new & full_time & ~international, 
+               'UpperYearRegistrations_international': ~new & full_time & international, 
+               'TotalRegistrations': registered & intervals['current_load'].isin(['F','O','P'])}
+    return metrics
+
+
+def deposit_intervals(dataset: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function computes when each row of ReturningStudentsQuery counts as a deposit, following 
+    data_manipulation_as_of.term_deposits and deposist_process: 
+        - payments of $10 or more count from their payment date
+        - otherwise, an RO flag (tipically OSAP) counts from its date, or, without RO flag, a sponsorship from the day 
+          after being applied (an RO flag not yet in the system discards the sponsorship)
+        - students are split into term 01/upper year (by the section of the row) and domestic/international first, and 
+          each student is counted once per split, on the program of its first row (in query order) counting as deposit
+    A row is then valid from the date it counts until any previous row of the same student and split counts. 
+    
+    Args: 
+        dataset (pd.DataFrame): output of ReturningStudentsQuery as of today (number = 0), so every payment is included
+    
+    Returns: 
+        pd.DataFrame with the rows counting as deposit at some date, with 'new', 'international', 'valid_from' and 
+        'valid_to' columns
+    """
+    dataset = dataset.reset_index(drop = True)
+    dataset['new'] = new_student_section_flag(dataset['Program'], dataset['AAL'])
+    dataset['international'] = dataset['IMMIGRATION_STATUS'] == 'SV'
+    
+    # Sponsorships count from the day after being applied
+    sponsor = pd.to_datetime(dataset['SPONSOR_APPLIED'], errors = 'coerce').dt.normalize() + pd.Timedelta(days = 1)
+    sponsor = sponsor.where(dataset['SPONSORSHIP'].notnull())
+    
+    # RO flags (tipically OSAP) replace sponsorships
+    has_ro = dataset['STNT'].str.contains('RO', na = False)
+    ro = pd.to_datetime(dataset['STNT_Date'].astype(str).str[0:19], format = '%Y-%m-%dT%H:%M:%S', errors = 'coerce').dt.normalize()
+    flag = ro.where(has_ro, sponsor)
+    
+    # Payments of $10 CAD or more
+    paid = pd.to_datetime(dataset['Pay Date'], errors = 'coerce').dt.normalize()
+    paid = paid.where(dataset['Pay Amt'] >= 10)
+    
+    # Each student is counted once per split, on its first row counting as deposit
+    dataset['valid_from'] = pd.concat([flag, paid], axis = 1).min(axis = 1)
+    dataset['valid_to'] = earlier_rows_minimum(dataset['valid_from'], 
+                                               [dataset['Student ID'], dataset['new'], dataset['international']])
+    dataset = dataset[dataset['valid_from'].notnull() & (dataset['valid_from'] < dataset['valid_to'])]
+    return dataset.reset_index(drop = True)
+
+
+def deposit_metrics(intervals: pd.DataFrame) -> dict:
+    """
+    This function flags deposits by term 01/upper year and student type, as the Term01Deposits and UpperYearDeposits sheets. 
+    
+    Args: 
+        intervals (pd.DataFrame): output of deposit_intervals
+    
+    Returns: 
+        dictionary with metric name as key and boolean pd.Series as value 
+    """
+    new = intervals['new']
+    international = intervals['international']
+    
+    metrics = {'Term01Deposits_domestic': new & ~international, 
+               'Term01Deposits_international': new & international, 
+               'UpperYearDeposits_domestic': ~new & ~international, 
+               'UpperYearDeposits_international': ~new & international}
+    return metrics
+
+
+def counting_metrics_as_of_dates(term: str, 
+                                 dates: pd.DatetimeIndex, 
+                                 programs: List[str] = None, 
+                                 deposits: bool = False, 
+                                 cnxn: pyodbc.Connection = None):
+    """
+    This function counts every metric for every program of a term as of every date. Each source is queried once. 
+    
+    Args: 
+        term (str): Term of interest
+        dates (pd.DatetimeIndex): as of dates to evaluate
+        programs (List[str]): programs to keep (all programs by default)
+        deposits (bool): If True, deposits are also computed (one more query). Set as False by default
+        cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+    
+    Returns: 
+        List of programs, and dictionary with metric name as key and np.ndarray (programs x dates) as value
+    """
+    # Creating connection if none is provided
+    if cnxn is None: 
+        cnxn = python_utils.get_connection()
+    
+    # One query per source for all dates
+    sources = [(status_intervals(dataset = queries_as_of.ApplicationStatusHistoryQuery(term, cnxn), 
+                                 key = 'Application_ID', 
+                                 date_column = 'Status_Date', 
+                                 pos_column = 'Pos'), 'Program', application_metrics), 
+               (status_intervals(dataset = queries_as_of.RegistrationStatusHistoryQuery(term, cnxn), 
+                                 key = 'Cred_ID', 
+                                 date_column = 'status_date', 
+                                 pos_column = 'pos'), 'program', registration_metrics)]
+    if deposits: 
+        sources.append((deposit_intervals(queries_as_of.ReturningStudentsQuery(term, '0', cnxn)), 'Program', deposit_metrics))
+    
+    # Programs to report
+    if programs is not None: 
+        sources = [(intervals[intervals[column].isin(programs)].reset_index(drop = True), column, metrics) 
+                   for intervals, column, metrics in sources]
+        groups = list(programs)
+    else: 
+        groups = sorted(set().union(*[set(intervals[column].dropna()) for intervals, column, _ in sources]))
+    
+    # Counting every metric for every date (programs x dates matrices)
+    counts = {}
+    for intervals, column, metrics in sources:
+        for metric, mask in metrics(intervals).items():
+            counts[metric] = counting_as_of_dates(intervals = intervals, 
+                                                  mask = mask, 
+                                                  group_column = column, 
+                                                  groups = groups, 
+                                                  dates = dates)
+    return groups, counts
+
+
+def funnel_counts_as_of_dates(terms: List[str], 
+                              dates: List[str], 
+                              programs: List[str] = None, 
+                              align_years: bool = True, 
+                              cnxn: pyodbc.Connection = None) -> pd.DataFrame:
+    """
+    This function computes the enrolment funnel counts (first choice applications, applications, offers, confirmations, 
+    holds, withdrawals, waitlist and registrations) per program and term as of any number of dates. 
+    
+    Each term's status history is pulled once, and every date is evaluated in a single vectorized pass, so the cost 
+    barely grows with the number of dates. This makes backfills (a weekly series of every sheet) and re-running a past 
+    day's workbook cheap, without editing any query. Applications are counted as of each date (the Applications sheet 
+    reads the latest status of past terms instead, see data_manipulation_as_of.Applications). 
+    
+    Args: 
+        terms (List[str]): List of terms of interest
+        dates (List[str]): as of dates to be evaluated, in %Y-%m-%d format
+        programs (List[str]): programs to keep (all programs by default)
+        align_years (bool): If True, each term is evaluated as of the same day k years back, k being the difference 
+                            between the last term and such term (as the workbook does). Set as True by default
+        cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+    
+    Returns: 
+        pd.DataFrame with columns Program, term, as_of_date and one column per metric
+    
+    Example Usage: 
+        funnel_counts_as_of_dates(terms = ['2022F','2023F','2024F'], 
+                                  dates = ['2024-03-01','2024-03-08','2024-03-15'], 
+                                  programs = ['ACTG','BGEN'])
+    """
+    # Creating connection if none is provided
+    if cnxn is None: 
+        cnxn = python_utils.get_connection()
+    
+    as_of_dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    
+    frames = []
+    for term in terms: 
+        
+        # k is the number of years to go back, so past terms are compared as of the same day
+        k = int(terms[-1][0:4]) - int(term[0:4]) if align_years else 0
+        term_dates = pd.DatetimeIndex(as_of_dates - pd.DateOffset(years = k))
+        
+        # All dates of the term at once
+        groups, counts = counting_metrics_as_of_dates(term = term, 
+                                                      dates = term_dates, 
+                                                      programs = programs, 
+                                                      cnxn = cnxn)
+        
+        # Long format: one row per program and date
+        dataset = pd.DataFrame({'Program': np.repeat(groups, len(as_of_dates)), 
+                                'term': term, 
+                                'as_of_date': np.tile(as_of_dates.values, len(groups))})
+        for metric in FUNNEL_METRICS: 
+            dataset[metric] = counts[metric].ravel()
+        frames.append(dataset)
+    
+    dataframe = pd.concat(frames, ignore_index = True)
+    return dataframe
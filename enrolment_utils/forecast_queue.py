@@ -0,0 +1,371 @@
+import pandas as pd
+import json
+import uuid
+import time
+import socket
+import os
+import argparse
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+from typing import List
+from enrolment_utils import global_params, probs_target_utils
+
+
+def connecting_queue(queue_folder: str = None) -> Path:
+    """
+    This function opens the forecast queue, a folder that every host running workers can reach (a network share), and
+    creates its subfolders if needed: pending, running, done and failed (one file per forecasting job, the folder
+    holding it being its status) and results (one file per run and program). Jobs are claimed by renaming their file
+    (see claiming_job): a rename is atomic on a local disk as on SMB and NFS shares, so two workers never hold the
+    same job, whatever host they run on. Leases are timed with the clock of each host, which must be kept in sync.
+
+    Args:
+        queue_folder (str): queue folder (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        Path of the queue folder
+
+    Example Usage:
+        queue = connecting_queue()
+    """
+    if queue_folder is None:
+        queue_folder = global_params.forecasting_settings()['queue_folder']
+    queue = Path(queue_folder)
+    for folder in ['pending', 'running', 'done', 'failed', 'results']:
+        (queue/folder).mkdir(parents = True, exist_ok = True)
+    return queue
+
+
+def encoding_payload(job: dict) -> str:
+    """
+    This function writes the arguments of a forecasting job as JSON, histories (dataframes) as records, so a queue
+    payload is plain data whoever wrote it (no pickle, which runs code when loaded).
+
+    Args:
+        job (dict): arguments of the forecasting function (program or school, term, target values and histories)
+
+    Returns:
+        payload (str)
+
+    Example Usage:
+        encoding_payload(job = {'program': 'BGEN', 'dataframe': dataframe, 'target_value': 40, 'term': '2024F'})
+    """
+    def encoding(value):
+        if isinstance(value, pd.DataFrame):
+            return {'__dataframe__': json.loads(value.to_json(orient = 'records', date_format = 'iso')),
+                    'columns': [str(column) for column in value.columns],
+                    'dates': [str(column) for column in value.columns if pd.api.types.is_datetime64_any_dtype(value[column])]}
+        if hasattr(value, 'item'):
+            # numpy scalars
+            return value.item()
+        raise TypeError(f'{type(value).__name__} can not be put on the forecast queue')
+    return json.dumps(job, default = encoding)
+
+
+def decoding_payload(payload: str) -> dict:
+    """
+    This function reads the arguments of a forecasting job written by encoding_payload, histories back as dataframes.
+
+    Args:
+        payload (str): JSON payload of a queued job
+
+    Returns:
+        job (dict) of forecasting function arguments
+
+    Example Usage:
+        decoding_payload(payload = payload)
+    """
+    def decoding(value):
+        if '__dataframe__' not in value:
+            return value
+        dataframe = pd.DataFrame.from_records(value['__dataframe__'], columns = value['columns'])
+        for column in value['dates']:
+            dataframe[column] = pd.to_datetime(dataframe[column])
+        return dataframe
+    return json.loads(payload, object_hook = decoding)
+
+
+def job_file_name(run_id: str,
+                  number: int,
+                  attempts: int = 0,
+                  claimed_at: float = None,
+                  worker: str = None) -> str:
+    """
+    Name of the file of a job: run, position in the run and, once claimed, attempts, claim time (ms) and worker, so a
+    claim and its lease are a single rename.
+    """
+    name = f'{run_id}__{number:06d}'
+    if claimed_at is not None:
+        name += f'__{attempts}__{int(claimed_at * 1000)}__{worker}'
+    return name + '.json'
+
+
+def parsing_job_file_name(path: Path) -> dict:
+    """
+    Reads run, position, attempts, claim time and worker back from the name of a job file (see job_file_name).
+    """
+    parts = path.stem.split('__', 4)
+    job = {'run_id': parts[0], 'number': int(parts[1]), 'attempts': 0, 'claimed_at': None, 'worker': None}
+    if len(parts) == 5:
+        job.update({'attempts': int(parts[2]), 'claimed_at': int(parts[3]) / 1000, 'worker': parts[4]})
+    return job
+
+
+def moving_job(source: Path,
+               target: Path) -> bool:
+    """
+    Moves a job file (claims, releases or closes the job). Returns False when another worker moved it first.
+    """
+    try:
+        os.rename(source, target)
+        return True
+    except (FileNotFoundError, FileExistsError):
+        return False
+
+
+def enqueuing_forecasts(jobs: List[dict],
+                        function: str = 'forecasting_program',
+                        queue_folder: str = None) -> str:
+    """
+    This function puts forecasting jobs on the queue, to be taken by any worker (see working_forecast_queue). Every
+    job is written aside and then moved to pending, so workers never read half a job.
+
+    Args:
+        jobs (List[dict]): arguments of the forecasting function, one dictionary per job (as for
+                           probs_target_utils.forecasting_programs)
+        function (str): name of the probs_target_utils function run on every job (forecasting_program or forecasting_school)
+        queue_folder (str): queue folder (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        run_id (str) identifying these jobs and their results
+
+    Example Usage:
+        run_id = enqueuing_forecasts(jobs = jobs)
+    """
+    run_id = uuid.uuid4().hex
+    queue = connecting_queue(queue_folder)
+    for number, job in enumerate(jobs):
+        temporary = queue/f'{run_id}__{number:06d}.tmp'
+        temporary.write_text(encoding_payload({'function': function,
+                                               'name': job.get('school', job.get('program')),
+                                               'job': job}))
+        os.replace(temporary, queue/'pending'/job_file_name(run_id = run_id, number = number))
+    print(f'[Info] {len(jobs)} forecasting jobs queued (run {run_id})')
+    return run_id
+
+
+def claiming_job(queue: Path,
+                 worker: str,
+                 run_id: str = None):
+    """
+    This function takes the next job from the queue for a worker: a pending job, or a running one whose worker has
+    held it longer than its lease (fit_timeout, the worker is assumed dead). Jobs tried max_attempts times are failed.
+    A job is claimed by renaming its file into running with the worker and claim time in its name; when two workers
+    try for the same job, only one rename succeeds and the other worker moves on to the next job.
+
+    Args:
+        queue (Path): queue folder (see connecting_queue)
+        worker (str): worker name
+        run_id (str): only take jobs of this run (any run by default)
+
+    Returns:
+        (job file, function, job arguments) or None when there is nothing to do
+
+    Example Usage:
+        claiming_job(queue = queue, worker = 'host-1234')
+    """
+    settings = global_params.forecasting_settings()
+    pattern = '*.json' if run_id is None else f'{run_id}__*.json'
+    now = time.time()
+
+    # Expired leases first (their jobs have waited longest), then pending jobs in queue order
+    candidates = []
+    for path in sorted((queue/'running').glob(pattern)):
+        job = parsing_job_file_name(path)
+        if job['claimed_at'] + settings['fit_timeout'] >= now:
+            continue
+        if job['attempts'] >= settings['max_attempts']:
+            if moving_job(path, queue/'failed'/path.name):
+                print(f"[Info] Forecasting job {path.name} failed: too many attempts")
+            continue
+        candidates.append((path, job))
+    candidates += [(path, parsing_job_file_name(path)) for path in sorted((queue/'pending').glob(pattern))]
+
+    for path, job in candidates:
+        claimed = queue/'running'/job_file_name(run_id = job['run_id'],
+                                                number = job['number'],
+                                                attempts = job['attempts'] + 1,
+                                                claimed_at = now,
+                                                worker = worker)
+        if moving_job(path, claimed):
+            content = decoding_payload(claimed.read_text())
+            return claimed, content['function'], content['job']
+    return None
+
+
+def working_forecast_queue(queue_folder: str = None,
+                           run_id: str = None,
+                           idle_exit_seconds: int = None):
+    """
+    This function runs a forecast worker: it takes jobs from the queue, runs them and writes their results to the
+    results folder, until the queue stays empty for idle_exit_seconds. Any number of workers, on any host with access to
+    the queue folder and the forecasting backend, can run at the same time.
+
+    Args:
+        queue_folder (str): queue folder (taken from global_params.forecasting_settings by default)
+        run_id (str): only work on jobs of this run (any run by default)
+        idle_exit_seconds (int): seconds without jobs before exiting (never exits by default)
+
+    Returns:
+        None
+
+    Example Usage:
+        python -m enrolment_utils.forecast_queue --idle-exit 600
+    """
+    settings = global_params.forecasting_settings()
+    worker = f'{socket.gethostname()}-{os.getpid()}'.replace('__', '_')
+    queue = connecting_queue(queue_folder)
+    idle_since = time.monotonic()
+    done = 0
+
+    while True:
+        claimed = claiming_job(queue = queue, worker = worker, run_id = run_id)
+        if claimed is None:
+            if idle_exit_seconds is not None and time.monotonic() - idle_since >= idle_exit_seconds:
+                break
+            time.sleep(settings['queue_poll_seconds'])
+            continue
+
+        path, function, job = claimed
+        run = parsing_job_file_name(path)['run_id']
+        try:
+            forecasts = getattr(probs_target_utils, function)(**job)
+            finished_at = datetime.now().isoformat(timespec = 'seconds')
+            # Results written aside and then moved (the same results, if the job was also run by another worker)
+            (queue/'results'/run).mkdir(exist_ok = True)
+            for i, r in forecasts.iterrows():
+                temporary = queue/'results'/run/f"{r['program']}.{worker}.tmp"
+                temporary.write_text(json.dumps({'program': r['program'],
+                                                 'probability': float(r['probability']),
+                                                 'projected_regs': float(r['projected_regs']),
+                                                 'worker': worker,
+                                                 'finished_at': finished_at}))
+                os.replace(temporary, queue/'results'/run/f"{r['program']}.json")
+            if not moving_job(path, queue/'done'/path.name):
+                print(f'[Info] Forecasting job {path.name} was taken over by another worker.')
+            done += 1
+        except Exception as e:
+            print(f'[Info] Forecasting job {path.name} failed: {e}')
+            moving_job(path, queue/'failed'/path.name)
+        idle_since = time.monotonic()
+
+    print(f'[Info] Worker {worker} exiting after {done} jobs')
+
+
+def waiting_forecast_results(run_id: str,
+                             programs: List[str],
+                             timeout: int = None,
+                             queue_folder: str = None) -> pd.DataFrame:
+    """
+    This function waits until every job of a run is finished (or failed), or until timeout, and collects the results.
+    Programs without result are reported with zeros.
+
+    Args:
+        run_id (str): run of interest (see enqueuing_forecasts)
+        programs (List[str]): programs expected in results, in output order
+        timeout (int): seconds to wait (taken from global_params.forecasting_settings by default)
+        queue_folder (str): queue folder (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        Dataframe (pd.DataFrame) with program, probability and projected_regs, in programs order (programs without
+        result listed in dataframe.attrs['failed'])
+
+    Example Usage:
+        waiting_forecast_results(run_id = run_id, programs = ['ACTG', 'BGEN'])
+    """
+    settings = global_params.forecasting_settings()
+    if timeout is None:
+        timeout = settings['queue_timeout']
+    queue = connecting_queue(queue_folder)
+    deadline = time.monotonic() + timeout
+
+    while True:
+        remaining = sum(1 for folder in ['pending', 'running'] for path in (queue/folder).glob(f'{run_id}__*.json'))
+        if remaining == 0:
+            break
+        if time.monotonic() >= deadline:
+            print(f'[Info] Timed out waiting for forecasts, {remaining} jobs unfinished.')
+            break
+        time.sleep(settings['queue_poll_seconds'])
+
+    results = {}
+    for path in (queue/'results'/run_id).glob('*.json'):
+        result = json.loads(path.read_text())
+        results[result['program']] = result
+
+    failures = [program for program in programs if program not in results]
+    dataframe = pd.DataFrame({'program': programs,
+                              'probability': [results[p]['probability'] if p not in failures else 0 for p in programs],
+                              'projected_regs': [int(results[p]['projected_regs']) if p not in failures else 0 for p in programs]})
+    print(f'[Info] {len(programs) - len(failures)} programs forecasted through the queue, {len(failures)} failed.')
+    dataframe.attrs['failed'] = failures
+    return dataframe
+
+
+def queue_forecasting_programs(jobs: List[dict],
+                               function: str = 'forecasting_program',
+                               local_workers: int = None,
+                               timeout: int = None,
+                               queue_folder: str = None) -> pd.DataFrame:
+    """
+    This function forecasts jobs through the queue: they are queued, taken by workers (on this host, local_workers of
+    them are started for this run, and any other host running working_forecast_queue helps), and their results
+    collected. Same output as probs_target_utils.forecasting_programs.
+
+    Args:
+        jobs (List[dict]): arguments of the forecasting function, one dictionary per job
+        function (str): name of the probs_target_utils function run on every job (forecasting_program or forecasting_school)
+        local_workers (int): worker processes started on this host (taken from global_params.forecasting_settings by default)
+        timeout (int): seconds to wait for results (taken from global_params.forecasting_settings by default)
+        queue_folder (str): queue folder (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        Dataframe (pd.DataFrame) with program, probability and projected_regs, in jobs order
+
+    Example Usage:
+        queue_forecasting_programs(jobs = jobs)
+    """
+    if local_workers is None:
+        local_workers = global_params.forecasting_settings()['local_workers']
+    programs = [program for job in jobs for program in job.get('programs', [job.get('program')])]
+    if len(jobs) == 0:
+        return pd.DataFrame(columns = ['program', 'probability', 'projected_regs'])
+
+    run_id = enqueuing_forecasts(jobs = jobs, function = function, queue_folder = queue_folder)
+
+    # Local workers only work on this run, and stay until all its results are in (a job whose worker died is taken
+    # again once its lease expires)
+    workers = [multiprocessing.Process(target = working_forecast_queue, kwargs = {'queue_folder': queue_folder, 'run_id': run_id})
+               for i in range(local_workers)]
+    for worker in workers:
+        worker.start()
+
+    dataframe = waiting_forecast_results(run_id = run_id,
+                                         programs = programs,
+                                         timeout = timeout,
+                                         queue_folder = queue_folder)
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+    return dataframe
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Forecast worker: takes forecasting jobs from the queue until it stays empty.')
+    parser.add_argument('--queue-folder', default = None, help = 'queue folder (forecasting settings by default)')
+    parser.add_argument('--idle-exit', type = int, default = None, help = 'seconds without jobs before exiting (never by default)')
+    args = parser.parse_args()
+
+    working_forecast_queue(queue_folder = args.queue_folder,
+                           idle_exit_seconds = args.idle_exit)
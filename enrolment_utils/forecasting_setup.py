@@ -0,0 +1,41 @@
+import argparse
+import time
+import pandas as pd
+
+
+def setting_up_forecasting_backend(compiler: bool = True):
+    """
+    This function installs cmdstan (the engine behind prophet) and checks the forecasting backend works by fitting a
+    small model. It only needs to run once per machine (and again after upgrading prophet or cmdstanpy), instead of
+    on every import of probs_target_utils.
+
+    Args:
+        compiler (bool): install the C++ toolchain along with cmdstan (only valid on Windows, set as True by default)
+
+    Returns:
+        None
+
+    Example Usage:
+        python -m enrolment_utils.forecasting_setup
+    """
+    import cmdstanpy
+    from prophet import Prophet
+
+    start = time.perf_counter()
+    cmdstanpy.install_cmdstan(compiler = compiler)
+    print(f'[Info] cmdstan ready in {time.perf_counter() - start:.1f} seconds')
+
+    # Checking a model can be fitted
+    start = time.perf_counter()
+    dataframe = pd.DataFrame({'ds': pd.date_range('2023-01-01', periods = 60),
+                              'y': range(60)})
+    Prophet().fit(dataframe)
+    print(f'[Info] Forecasting backend verified, test model fitted in {time.perf_counter() - start:.1f} seconds')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'One-time setup of the forecasting backend (cmdstan for prophet).')
+    parser.add_argument('--no-compiler', action = 'store_true', help = 'do not install the C++ toolchain (not needed outside Windows)')
+    args = parser.parse_args()
+
+    setting_up_forecasting_backend(compiler = not args.no_compiler)
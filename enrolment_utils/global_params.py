@@ -129,14 +129,177 @@ def start_end_term_dates():
         'S': '-05-05'}
 	return end_date_map, start_date_map
 
+def transfer_settings():
+	"""
+	Returns a dictionary with the settings used when moving files from and to Sharepoint.
+
+	The dictionary contains the following keys:
+	- 'max_workers': Maximum number of simultaneous downloads/uploads.
+	- 'cache_folder': Local folder where copies of Sharepoint files are kept between runs.
+	- 'session_lifetime': Seconds a Sharepoint session is used before logging in again (tokens last about an hour).
+	- 'request_timeout': Connect and read timeout (seconds) of every Sharepoint request. A transfer sending no request for
+	  twice that long is reported as stuck; long transfers making progress (chunked uploads, throttling) are not.
+	- 'chunk_threshold': Files larger than this (bytes) are uploaded in chunks, smaller ones in a single request.
+	- 'chunk_size': Size (bytes) of every chunk of a chunked upload.
+	- 'max_retries': Retries of a Sharepoint request failing for a transient reason (throttling 429/503, server errors,
+	  timeouts) before it is given up.
+	- 'backoff_base': Seconds of the first backoff after a transient error, doubled on every retry (with random jitter),
+	  unless Sharepoint says how long to wait (Retry-After).
+	- 'backoff_max': Longest backoff (seconds) without Retry-After.
+	- 'request_budget': Sharepoint requests (logins and retries included) of a run after which optional transfers (history
+	  file updates) are skipped, None for no limit. The report itself is always uploaded.
+
+	Returns:
+		dict: A dictionary with transfer settings.
+	"""
+	transfer_dict = {'max_workers': 8,
+					 'cache_folder': 'cache',
+					 'session_lifetime': 3000,
+					 'request_timeout': 300,
+					 'chunk_threshold': 8 * 1024 * 1024,
+					 'chunk_size': 4 * 1024 * 1024,
+					 'max_retries': 5,
+					 'backoff_base': 2,
+					 'backoff_max': 60,
+					 'request_budget': 5000}
+	return transfer_dict
+
+def storage_settings():
+	"""
+	Returns a dictionary with the settings of the storage where report inputs and outputs live (see storage module).
+
+	The dictionary contains the following keys:
+	- 'backend': 'sharepoint' (Shared Documents of the Enrolment Dashboard site) or 'local' (a local folder with the
+	  same layout, to run or benchmark the pipeline where Sharepoint cannot be reached).
+	- 'local_folder': Local folder standing for Shared Documents when backend is 'local'.
+
+	Returns:
+		dict: A dictionary with storage settings.
+	"""
+	storage_dict = {'backend': 'sharepoint',
+					'local_folder': 'storage/Shared Documents'}
+	return storage_dict
+
+def report_settings():
+	"""
+	Returns a dictionary with the settings of the daily report (the Dashboard input workbook).
+
+	The dictionary contains the following keys:
+	- 'local_copies': Also write the workbook to the reports folder (<term>_EnrolmentReport.xlsx and DashboardInput.xlsx).
+	  The workbook is built in memory and uploaded from there; set it to False to skip the local copies.
+
+	Returns:
+		dict: A dictionary with report settings.
+	"""
+	report_dict = {'local_copies': True}
+	return report_dict
+
+def side_files_schema():
+	"""
+	Returns a dictionary with the schema of the side files (two tab separated columns with header), per Sharepoint folder.
+
+	The dictionary contains the following keys:
+	- 'orders': Program and School of every program reported (order files).
+	- 'budgets': Program and Budget (number of registrations targeted) of every program (budget files).
+
+	Every schema maps column names, in file order, to their data type.
+
+	Returns:
+		dict: A dictionary with side files schemas.
+	"""
+	schema_dict = {'orders': {'Program': 'category',
+							  'School': 'category'},
+				   'budgets': {'Program': 'category',
+							   'Budget': 'int64'}}
+	return schema_dict
+
+def count_cube_settings():
+	"""
+	Returns a dictionary with the settings of the daily count cube (precomputed as of counts for past terms).
+
+	The dictionary contains the following keys:
+	- 'cube_folder': Local folder where one cube file per term is stored.
+	- 'days': Number of days of the enrolment cycle kept in the cube, starting on the cycle start date.
+
+	Returns:
+		dict: A dictionary with count cube settings.
+	"""
+	cube_dict = {'cube_folder': 'cache/count_cube',
+				 'days': 730}
+	return cube_dict
+
+def backfill_settings():
+	"""
+	Returns a dictionary with the settings used when building program histories from scratch.
+
+	The dictionary contains the following keys:
+	- 'max_workers': Number of workers pulling data from production at the same time.
+	- 'partition_days': Number of days pulled by each partition (unit of work and checkpoint).
+	- 'checkpoint_folder': Local folder where finished partitions are stored.
+
+	Returns:
+		dict: A dictionary with backfill settings.
+	"""
+	backfill_dict = {'max_workers': 4,
+					 'partition_days': 30,
+					 'checkpoint_folder': 'cache/backfill'}
+	return backfill_dict
+
+def forecasting_settings():
+	"""
+	Returns a dictionary with the settings used when forecasting registrations for every program.
+
+	The dictionary contains the following keys:
+	- 'max_workers': Number of processes fitting models at the same time.
+	- 'fit_timeout': Seconds given to each program to fit and predict before being reported as timed out.
+	- 'model_folder': Local folder where fitted models are stored (one file per term and program).
+	- 'engine': Forecasting engine used by the probability report, 'prophet', 'school' (one model per school) or 'analog' (previous years curves).
+	- 'analog_years': Number of previous enrolment cycles used by the analog engine.
+	- 'mcmc_samples': Prophet MCMC samples, 0 fits by MAP estimation (much faster).
+	- 'uncertainty_samples': Prophet uncertainty samples drawn when predicting, 0 skips them (only yhat is used).
+	- 'result_folder': Local folder where forecast results are cached (one file per term).
+	- 'probability_method': 'normal' (probability given by the engine) or 'monte_carlo' (share of simulated outcomes
+	  reaching target, simulated with residuals of analog projections whatever the engine, see monte_carlo module).
+	  Quantile columns are reported with both.
+	- 'simulations': Number of simulated end of cycle outcomes per program.
+	- 'quantiles': Quantiles of simulated outcomes reported as projected_p<quantile> columns.
+	- 'distribution': Where models are fitted, 'pool' (processes on this host) or 'queue' (forecast queue workers, see forecast_queue).
+	- 'queue_folder': Forecast queue folder, on a share reached by every host running workers (jobs are claimed by
+	  renaming their file, see forecast_queue).
+	- 'queue_timeout': Seconds the report waits for queued forecasts before reporting missing ones with zeros.
+	- 'queue_poll_seconds': Seconds between queue checks (workers and report).
+	- 'local_workers': Queue workers started on the host running the report.
+	- 'max_attempts': Times a queued job is tried (a job held by a worker longer than fit_timeout is tried again).
+
+	Returns:
+		dict: A dictionary with forecasting settings.
+	"""
+	forecasting_dict = {'max_workers': 4,
+						'fit_timeout': 600,
+						'model_folder': 'cache/models',
+						'engine': 'prophet',
+						'analog_years': 4,
+						'mcmc_samples': 0,
+						'uncertainty_samples': 0,
+						'result_folder': 'cache/forecasts',
+						'probability_method': 'normal',
+						'simulations': 2000,
+						'quantiles': [0.1, 0.5, 0.9],
+						'distribution': 'pool',
+						'queue_folder': 'cache/forecast_queue',
+						'queue_timeout': 3600,
+						'queue_poll_seconds': 2,
+						'local_workers': 4,
+						'max_attempts': 3}
+	return forecasting_dict
+
 def program_school_dict(file_name):
 
-    # Importing auxiliary files (order and order end of cycle)
+    # Importing auxiliary files (order and order end of cycle), once per Sharepoint session
     sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard'
 
-    order = custom_sharepoint.sharepoint_download(sharepoint_base_url = sharepoint_base_url,
-                                                      local_folder = 'orders',
-                                                      file_name = file_name)
-
+    order = custom_sharepoint.loading_side_file(local_folder = 'orders',
+                                                file_name = file_name,
+                                                sharepoint_base_url = sharepoint_base_url)
 
-    return order.set_index(order.columns[0])[order.columns[1]].to_dict()
\ No newline at end of file
+    return order['School'].astype(str).to_dict()
\ No newline at end of file
@@ -1,5 +1,5 @@
 from enrolment_utils import data_manipulation_as_of, data_manipulation_historical, global_params
-from enrolment_utils import custom_sharepoint, apps_confs_progression
+from enrolment_utils import custom_sharepoint, apps_confs_progression, storage
 # from utils import credentials
 from enrolment_utils import OCAS_data
 from enrolment_utils import side_files_handling
@@ -23,7 +23,7 @@ import pandas as pd
 import numpy as np
 import warnings
 import logging
-import shutil
+import io
 import os
 
 warnings.filterwarnings("ignore")
@@ -50,6 +50,9 @@ def enroment_dashboard_update(intake:str):
 	# Importing auxiliary files (order and order end of cycle)
 	sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/'
 
+	# One Sharepoint session for the whole run
+	custom_sharepoint.starting_sharepoint_session()
+
 	# Initializing global parameters
 	intake_mapping = global_params.naming_files()
 	if intake in intake_mapping:
@@ -62,17 +65,16 @@ def enroment_dashboard_update(intake:str):
 	else:
 		print(f"Invalid intake value: {intake}")
 
-	# Pulling data from Projections file
-	side_files_handling.setting_order_budget(terms = terms, 
-										  sharepoint_base_url = sharepoint_base_url)
-
-	# Setting the list of programs of interest
-	order = custom_sharepoint.sharepoint_download(sharepoint_base_url = sharepoint_base_url,
-													local_folder = 'orders',
-													file_name = file_name_order)
+	# Pulling data from Projections file (on the transfer manager, while connecting to production)
+	order_budget = custom_sharepoint.submitting_transfer(side_files_handling.setting_order_budget, 
+														 terms = terms, 
+														 sharepoint_base_url = sharepoint_base_url)
 
     # Creating conextion to production 
 	cnxn = utils_geral.get_connection()
+
+	# Setting the list of programs of interest (as just written to sharepoint)
+	order = custom_sharepoint.waiting_transfers([order_budget])[0]
         
     # Handling with paths and file naming 
 	root = Path.cwd()
@@ -80,15 +82,17 @@ def enroment_dashboard_update(intake:str):
 	report_name = terms[-1] +'_EnrolmentReport'
 	report_path = 'reports/'+report_name+'.xlsx'
 	output_root = Path(root/report_path)
+	local_copies = global_params.report_settings()['local_copies']
         
-	# if path does not exist, create it
+	# if path does not exist, create it (only needed for local copies)
 	report_path = root/'reports'
-	if not Path.exists(report_path):
+	if local_copies and not Path.exists(report_path):
 		report_path.mkdir(parents= True, exist_ok= True)
 
 
-    #Creating overall output file 
-	with pd.ExcelWriter(output_root, engine='xlsxwriter') as writer:
+    #Creating overall output file (in memory, uploaded from there)
+	output = io.BytesIO()
+	with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
 		data_manipulation_as_of.FirstApplications(order = order, 
                                                 terms = terms, 
                                                 cnxn = cnxn).to_excel(excel_writer = writer, 
@@ -285,21 +289,32 @@ def enroment_dashboard_update(intake:str):
 		print('[Info] probabilities of hitting budgets added successfully')
 		logger.info('probabilities of hitting budgets added successfully.')
 	
-	# Upload file to sharepoint
-	custom_sharepoint.sharepoint_upload(sharepoint_base_url = sharepoint_base_url,
-                                        root = root,
-                                        report_name = report_name, 
-										file_name = f'DashboardInput_{intake}.xlsx')
-
-	logger.info('Sharepoint updated successfully.')
-
-	
+	# Upload file to sharepoint, straight from memory (on the transfer manager, while local copies are made). The report 
+	# goes up even when the request budget is spent (only optional transfers are skipped)
+	if custom_sharepoint.sharepoint_budget_spent():
+		print('[Info] Sharepoint request budget spent, uploading the report anyway.')
+		logger.info(f'Sharepoint request budget spent before the report upload: {custom_sharepoint.sharepoint_request_statistics()}')
+	file_content = output.getvalue()
+	upload = custom_sharepoint.submitting_transfer(custom_sharepoint.sharepoint_upload, 
+												   sharepoint_base_url = sharepoint_base_url,
+												   root = root,
+												   report_name = report_name, 
+												   file_name = f'DashboardInput_{intake}.xlsx',
+												   file_content = file_content)
 	
 	print('[Info]  All registrations all programs all AALs included successfully')
 	logger.info('All registrations all programs all AALs included successfully.')
 	
-	dst_path = Path(root/f'reports/DashboardInput.xlsx')
-	shutil.copy(output_root, dst_path)
+	if local_copies:
+		dst_path = Path(root/f'reports/DashboardInput.xlsx')
+		output_root.write_bytes(file_content)
+		dst_path.write_bytes(file_content)
+
+	custom_sharepoint.waiting_transfers([upload])
+	logger.info('Sharepoint updated successfully.')
+	logger.info(f'Sharepoint download cache: {custom_sharepoint.sharepoint_cache_statistics()}')
+	logger.info(f'Storage: {storage.storage_statistics()}')
+	logger.info(f'Sharepoint requests: {custom_sharepoint.sharepoint_request_statistics()}')
 	print('[Info] Daily report and Dashboard input successfully created.')
 
 	end_time = time.perf_counter()
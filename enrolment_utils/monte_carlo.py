@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+from typing import List
+from enrolment_utils import global_params, analog_forecast
+
+
+def historical_residuals(jobs: List[dict],
+                         years: int = None) -> np.ndarray:
+    """
+    This function measures, for every program, how much end of cycle registrations deviated from the typical path in
+    previous cycles: relative deviation of every analog year projection from their average
+    (see analog_forecast.analog_projections).
+
+    Args:
+        jobs (List[dict]): one dictionary per program with program, dataframe (ds, y), target_value and term
+        years (int): number of previous cycles to use (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        np.ndarray with shape (programs, years) of relative residuals (NaN when a year gives no projection)
+
+    Example Usage:
+        residuals = historical_residuals(jobs = jobs)
+    """
+    projections, _ = analog_forecast.analog_projections(jobs = jobs, years = years)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        valid = np.isfinite(projections).sum(axis = 1)
+        mean = np.nanmean(np.where(valid[:, None] > 0, projections, 0), axis = 1)
+        residuals = projections / mean[:, None] - 1
+    residuals[~np.isfinite(residuals)] = np.nan
+    return residuals
+
+
+def simulating_outcomes(point: np.ndarray,
+                        residuals: np.ndarray,
+                        simulations: int = None,
+                        seed: int = 0) -> np.ndarray:
+    """
+    This function simulates end of cycle registrations for all programs at once, by drawing historical residuals
+    (bootstrap) around every program point forecast. Programs with less than two residuals of their own draw from
+    the residuals of all programs.
+
+    Args:
+        point (np.ndarray): point forecast (projected registrations) of every program
+        residuals (np.ndarray): programs x years relative residuals (see historical_residuals)
+        simulations (int): number of simulations per program (taken from global_params.forecasting_settings by default)
+        seed (int): random seed, so the same inputs give the same report
+
+    Returns:
+        np.ndarray with shape (programs, simulations)
+
+    Example Usage:
+        outcomes = simulating_outcomes(point = projected_regs, residuals = residuals)
+    """
+    if simulations is None:
+        simulations = global_params.forecasting_settings()['simulations']
+    rng = np.random.default_rng(seed)
+    point = np.asarray(point, dtype = float)
+
+    # Own residuals first in every row (NaN are sorted last), draws only among them
+    counts = np.isfinite(residuals).sum(axis = 1)
+    ordered = np.sort(residuals, axis = 1)
+    index = np.floor(rng.random((len(point), simulations)) * np.maximum(counts, 1)[:, None]).astype(int)
+    own = np.take_along_axis(ordered, index, axis = 1)
+
+    pooled = residuals[np.isfinite(residuals)]
+    if pooled.size == 0:
+        pooled = np.zeros(1)
+    shared = pooled[rng.integers(0, pooled.size, (len(point), simulations))]
+
+    draws = np.where(counts[:, None] >= 2, own, shared)
+    return point[:, None] * (1 + draws)
+
+
+def target_probabilities(outcomes: np.ndarray,
+                         targets: np.ndarray,
+                         current: np.ndarray,
+                         quantiles: List[float] = None) -> pd.DataFrame:
+    """
+    This function computes, for all programs at once, the probability of reaching target (share of simulated outcomes
+    at or above target) and quantiles of projected registrations. Registrations are not simulated below current ones.
+
+    Args:
+        outcomes (np.ndarray): programs x simulations end of cycle registrations (see simulating_outcomes)
+        targets (np.ndarray): target number of registrations of every program
+        current (np.ndarray): current registrations of every program
+        quantiles (List[float]): quantiles to report (taken from global_params.forecasting_settings by default)
+
+    Returns:
+        Dataframe (pd.DataFrame) with probability and one projected_p<quantile> column per quantile, in programs order
+
+    Example Usage:
+        target_probabilities(outcomes = outcomes, targets = targets, current = current)
+    """
+    if quantiles is None:
+        quantiles = global_params.forecasting_settings()['quantiles']
+    targets = np.asarray(targets, dtype = float)
+    current = np.asarray(current, dtype = float)
+
+    outcomes = np.maximum(outcomes, current[:, None])
+    probability = np.where(current >= targets, 1, (outcomes >= targets[:, None]).mean(axis = 1))
+
+    dataframe = pd.DataFrame({'probability': probability})
+    values = np.quantile(outcomes, quantiles, axis = 1)
+    for quantile, value in zip(quantiles, values):
+        dataframe[f'projected_p{int(round(quantile * 100))}'] = np.floor(value).astype(int)
+    return dataframe
+
+
+def adding_monte_carlo(forecasts: pd.DataFrame,
+                       jobs: List[dict]) -> pd.DataFrame:
+    """
+    This function completes engine forecasts (program, probability, projected_regs) with Monte Carlo results: end of
+    cycle registrations are simulated around projected_regs with historical residuals, which gives quantile columns
+    and, when global_params.forecasting_settings()['probability_method'] is 'monte_carlo', the probability of reaching
+    target too. Failed forecasts (listed in forecasts.attrs['failed']) are left with zeros.
+
+    Args:
+        forecasts (pd.DataFrame): engine output, one row per job program
+        jobs (List[dict]): one dictionary per program with program, dataframe (ds, y), target_value and term
+
+    Returns:
+        Dataframe (pd.DataFrame) with program, probability, projected_regs and quantile columns, in jobs order
+
+    Example Usage:
+        adding_monte_carlo(forecasts = forecasts, jobs = jobs)
+    """
+    settings = global_params.forecasting_settings()
+    failed = forecasts.attrs.get('failed', [])
+    columns = [f'projected_p{int(round(quantile * 100))}' for quantile in settings['quantiles']]
+    if len(jobs) == 0:
+        return pd.DataFrame(columns = ['program', 'probability', 'projected_regs'] + columns)
+
+    forecasts = forecasts.drop_duplicates(subset = 'program').set_index('program').loc[[job['program'] for job in jobs]].reset_index()
+    current = np.array([job['dataframe']['y'].iloc[-1] for job in jobs], dtype = float)
+    targets = np.array([job['target_value'] for job in jobs], dtype = float)
+
+    outcomes = simulating_outcomes(point = forecasts['projected_regs'].to_numpy(dtype = float),
+                                   residuals = historical_residuals(jobs = jobs))
+    simulated = target_probabilities(outcomes = outcomes,
+                                     targets = targets,
+                                     current = current)
+
+    if settings['probability_method'] == 'monte_carlo':
+        forecasts['probability'] = simulated['probability'].values
+    for column in columns:
+        forecasts[column] = simulated[column].values
+    forecasts.loc[forecasts['program'].isin(failed), ['probability', 'projected_regs'] + columns] = 0
+    forecasts.attrs['failed'] = failed
+    return forecasts
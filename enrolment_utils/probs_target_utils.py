@@ -1,28 +1,47 @@
-from enrolment_utils import custom_sharepoint, apps_confs_progression, global_params, python_utils
-from prophet import Prophet
+from enrolment_utils import custom_sharepoint, apps_confs_progression, global_params, python_utils, backfill, analog_forecast, monte_carlo, forecast_queue, storage
 # import python_utils
 import pandas as pd
 import pyodbc
 from tqdm import tqdm
-from scipy.stats import norm
 from io import StringIO
-
-from office365.runtime.auth.authentication_context import AuthenticationContext
-from office365.sharepoint.client_context import ClientContext
-from office365.sharepoint.files.file import File
+from typing import List
+import multiprocessing
+import math
+import time
+import hashlib
+import json
+import os
+from pathlib import Path
 
 from datetime import datetime, timedelta
 
-from shareplum import Office365
-from shareplum import Site
-from shareplum.site import Version
 import logging 
-import cmdstanpy
-# cmdstanpy.install_cmdstan()
-cmdstanpy.install_cmdstan(compiler=True) # only valid on Windows
 
-# Set the logging level to WARNING to suppress informational messages
-logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+# Forecasting backend (prophet and cmdstan) is only loaded when a model is actually fitted. Installing cmdstan is a 
+# one-time setup step: python -m enrolment_utils.forecasting_setup
+_backend = {}
+
+def loading_forecasting_backend() -> dict:
+    """
+    This function loads the forecasting backend (prophet) the first time it is needed, so importing this module (and 
+    the main pipeline) does not pay for it, e.g. in test mode. 
+    
+    Returns: 
+        dictionary with Prophet class and model_to_json, model_from_json serialization functions
+    
+    Example Usage: 
+        model = loading_forecasting_backend()['Prophet']()
+    """
+    if not _backend: 
+        from prophet import Prophet
+        from prophet.serialize import model_to_json, model_from_json
+        
+        # Set the logging level to WARNING to suppress informational messages
+        logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+        _backend.update({'Prophet': Prophet, 
+                         'model_to_json': model_to_json, 
+                         'model_from_json': model_from_json})
+    return _backend
 
 def getting_individual_dates(start_date: str, 
                              end_date: str):
@@ -110,12 +129,14 @@ def creating_dates_per_term(start_year:int, end_year:int, term:str) -> dict:
 
 
 
-def final_enrolment_day_be_term(term: str): 
+def final_enrolment_day_be_term(term: str, 
+                                as_of: datetime = None): 
     """
     This function computes the number of days before hitting day 10th of enrolment cycle
     
     Args: 
         term (str): Term of interest
+        as_of (datetime): Date to count from (today by default, set it to replay past cycles)
     
     Returns: 
         Integer number of days until day 10th of enrolment cycle
@@ -129,7 +150,9 @@ def final_enrolment_day_be_term(term: str):
         end_date = datetime(int(term[:4]), 5, 20)
     
     # All reporting should be made based on the current day the code is run. 
-    periods = (end_date - datetime.now()).days
+    if as_of is None: 
+        as_of = datetime.now()
+    periods = (end_date - as_of).days
     
     # In case number is not positive, correct that so it would not crash 
     if periods<= 0:
@@ -138,12 +161,656 @@ def final_enrolment_day_be_term(term: str):
     return periods
     
 
+def loading_budget_table(file_name_budget: str, 
+                         sharepoint_base_url: str = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/') -> pd.DataFrame:
+    """
+    This function loads the budget (target) file once for a whole run, indexed by program. Every successful download 
+    is kept as a local copy, which is used instead (with a warning in the run log) when Sharepoint cannot be reached. 
+    
+    Args: 
+        file_name_budget (str): file containing budget numbers of interest
+        sharepoint_base_url (str): Sharepoint base url
+    
+    Returns: 
+        Dataframe (pd.DataFrame) indexed by Program (category) with target (int) column 
+    
+    Example Usage: 
+        budget = loading_budget_table(file_name_budget = 'budget_fall.txt')
+    """
+    cached_copy = Path(global_params.transfer_settings()['cache_folder'])/'budgets'/file_name_budget
+    try: 
+        # Importing budget data (sharepoint, typed)
+        target = custom_sharepoint.loading_side_file(local_folder = 'budgets', 
+                                                     file_name = file_name_budget, 
+                                                     sharepoint_base_url = sharepoint_base_url)
+        cached_copy.parent.mkdir(parents = True, exist_ok = True)
+        target.to_csv(cached_copy, sep = '\t')
+    except Exception as e: 
+        if not cached_copy.exists(): 
+            raise
+        print(f'[Info] Budget file could not be downloaded ({e}), using local copy from {cached_copy}')
+        logging.getLogger('EnrolmentReport2').warning(f'Budget file {file_name_budget} could not be downloaded ({e}), '
+                                                      f'using local copy from {cached_copy}')
+        target = custom_sharepoint.parsing_side_file(byte_content = cached_copy.read_bytes(), 
+                                                     schema = global_params.side_files_schema()['budgets'])
+    
+    return target.rename(columns = {'Budget': 'target'})[['target']]
+
+
+def preparing_program_forecast(program:str, 
+                               start_year:int, 
+                               end_year:int,
+                               term: str, 
+                               file_name_budget: str,
+                               budget: pd.DataFrame = None,
+                               cnxn: pyodbc.Connection = None):
+    """
+    This function gathers everything needed to forecast a program: it updates the program history files (registrations, 
+    applications and confirmations) and reads the program target value. It is the part of the forecast talking to 
+    production and Sharepoint, so it runs on the main process. 
+    
+    Args: 
+        program (str): Program of interest to retrieve data.
+        start_year (int): start year to start tracking historical data
+        end_year (int): start year to start tracking historical data
+        term (str): Term of interest
+        file_name_budget (str): file containing budget numbers of interest
+        budget (pd.DataFrame): budget table from loading_budget_table (loaded from file_name_budget if not provided)
+        cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+        
+    Returns: 
+        Dataframe (pd.DataFrame) with registrations history (ds, y) and target value (int)
+    
+    Example Usage: 
+        preparing_program_forecast(program = 'BGEN',
+                                   start_year = 2018, 
+                                   end_year = 2024,
+                                   term = '2024F',
+                                   file_name_budget = 'budget_fall.txt')
+    """
+    # Importing budget data (once per run when provided by the caller)
+    if budget is None: 
+        budget = loading_budget_table(file_name_budget = file_name_budget)
+    
+    # If no connection is provided, create one
+    if cnxn is None: 
+        cnxn = python_utils.get_connection()
+
+    # Getting programs historical data (uploads run while the next history is queried)
+    transfers = []
+    dataframe = program_full_data(program = program, 
+                                start_year = start_year, 
+                                end_year = end_year,
+                                term = term,
+                                cnxn = cnxn,
+                                folder_name = 'registrations', 
+                                transfers = transfers)
+    # apps 
+    program_full_data(program = program, 
+                                start_year = start_year, 
+                                end_year = end_year,
+                                term = term,
+                                cnxn = cnxn,
+                                folder_name= 'applications', 
+                                transfers = transfers)
+    
+    # confs
+    program_full_data(program = program, 
+                                start_year = start_year, 
+                                end_year = end_year,
+                                term = term,
+                                cnxn = cnxn,
+                                folder_name= 'confirmations', 
+                                transfers = transfers)
+    custom_sharepoint.waiting_transfers(transfers)
+
+    # Importing target values from target file
+    target_value = int(budget.loc[program, 'target'])
+    
+    return dataframe, target_value
+
+
+def training_fingerprint(dataframe: pd.DataFrame) -> str:
+    """
+    This function summarizes a registrations history (ds, y) in a short hash, so a stored model can be matched 
+    against the data it was trained on. 
+    
+    Args: 
+        dataframe (pd.DataFrame): registrations history (ds, y)
+    
+    Returns: 
+        fingerprint (str) of the training data
+    
+    Example Usage: 
+        training_fingerprint(dataframe = dataframe)
+    """
+    hashed = pd.util.hash_pandas_object(dataframe[['ds', 'y']].astype(str), index = False).values
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+
+def model_path(program: str, 
+               term: str) -> Path:
+    """
+    This function provides the local path where the fitted model of a program (for a given term) is stored. 
+    
+    Example Usage: 
+        model_path(program = 'BGEN', term = '2024F')
+    """
+    return Path(global_params.forecasting_settings()['model_folder'])/term/f'{program}.json'
+
+
+def stan_init(model: 'Prophet') -> dict:
+    """
+    This function retrieves the parameters of a fitted model, so they can be used as starting point when fitting 
+    the same program again (warm start). 
+    
+    Args: 
+        model (Prophet): fitted model
+    
+    Returns: 
+        dictionary with initial values for k, m, sigma_obs, delta and beta
+    
+    Example Usage: 
+        model.fit(dataframe, init = stan_init(previous_model))
+    """
+    init = {}
+    for parameter in ['k', 'm', 'sigma_obs']: 
+        init[parameter] = model.params[parameter][0][0]
+    for parameter in ['delta', 'beta']: 
+        init[parameter] = model.params[parameter][0]
+    return init
+
+
+def creating_prophet_model() -> 'Prophet':
+    """
+    This function creates an (unfitted) Prophet model with the sampling settings from global_params.forecasting_settings:
+    MAP estimation or MCMC sampling (mcmc_samples) and number of uncertainty samples drawn when predicting 
+    (uncertainty_samples, 0 skips them as only yhat is used). 
+    
+    Example Usage: 
+        model = creating_prophet_model()
+    """
+    settings = global_params.forecasting_settings()
+    Prophet = loading_forecasting_backend()['Prophet']
+    return Prophet(mcmc_samples = settings['mcmc_samples'], 
+                   uncertainty_samples = settings['uncertainty_samples']) # Thanks facebook! 
+
+
+def fitting_program_model(program: str, 
+                          dataframe: pd.DataFrame, 
+                          term: str, 
+                          store: bool = True) -> 'Prophet':
+    """
+    This function fits the forecasting model of a program using the model store: if the stored model was trained on 
+    the very same data it is reused as it is, otherwise the new model is warm-started from the stored parameters 
+    (falling back to a cold fit if that fails). The fitted model is stored along with its training data fingerprint.
+    
+    Args: 
+        program (str): Program of interest
+        dataframe (pd.DataFrame): registrations history (ds, y)
+        term (str): Term of interest
+        store (bool): If False, the model store is neither read nor updated (plain cold fit, used when backtesting)
+    
+    Returns: 
+        fitted model (Prophet)
+    
+    Example Usage: 
+        fitting_program_model(program = 'BGEN', 
+                              dataframe = dataframe, 
+                              term = '2024F')
+    """
+    path = model_path(program = program, term = term)
+    # Models fitted with a different estimation (MAP vs MCMC) are not reused
+    fingerprint = training_fingerprint(dataframe) + f"-mcmc{global_params.forecasting_settings()['mcmc_samples']}"
+    start = time.perf_counter()
+    
+    # Retrieving stored model (if any)
+    previous = None
+    if store and path.exists(): 
+        try: 
+            stored = json.loads(path.read_text())
+            previous = loading_forecasting_backend()['model_from_json'](stored['model'])
+            if stored['fingerprint'] == fingerprint: 
+                print(f'[Info] Model for {program} reused, training data did not change.')
+                previous.uncertainty_samples = global_params.forecasting_settings()['uncertainty_samples']
+                return previous
+        except Exception as e: 
+            print(f'[Info] Stored model for {program} could not be read: {e}')
+            previous = None
+    
+    # Warm start from previous parameters, cold fit otherwise
+    fit_type = 'cold'
+    model = None
+    if previous is not None: 
+        try: 
+            model = creating_prophet_model()
+            model.fit(dataframe, init = stan_init(previous))
+            fit_type = 'warm'
+        except Exception as e: 
+            print(f'[Info] Warm start for {program} failed, fitting from scratch: {e}')
+            model = None
+    if model is None: 
+        model = creating_prophet_model()
+        model.fit(dataframe)
+    print(f'[Info] Model for {program} fitted ({fit_type} start) in {time.perf_counter() - start:.1f} seconds.')
+    if not store: 
+        return model
+    
+    # Storing model (written aside and then moved, so a crash never leaves half a file)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps({'fingerprint': fingerprint, 
+                                     'model': loading_forecasting_backend()['model_to_json'](model)}))
+    os.replace(temporary, path)
+    return model
+
+
+def predicting_horizon(model: 'Prophet', 
+                       term: str, 
+                       as_of: datetime = None) -> pd.Series: 
+    """
+    This function forecasts, with a fitted model, the dates of interest up to the end of the enrolment cycle (after 
+    today, or after two months ago close to the end of the cycle), predicting those dates only. 
+    
+    Args: 
+        model (Prophet): fitted model
+        term (str): Term of interest
+        as_of (datetime): Date the forecast is made (today by default, set it to replay past cycles)
+    
+    Returns: 
+        pd.Series with forecasted values (yhat) over the horizon
+    
+    Example Usage: 
+        predicting_horizon(model = model, term = '2024F')
+    """
+    if as_of is None: 
+        as_of = datetime.now()
+    
+    # Counting number of days to reach end of cycle + day 10th (more or less 14 days more )
+    periods = final_enrolment_day_be_term(term = term, as_of = as_of) + 15
+
+    # Keeping dates of interest only (after today, or after two months ago close to the end of the cycle)
+    today = as_of.date()
+    if periods < 30: 
+        two_months_ago = today - timedelta(days=60)
+        cutoff = two_months_ago.strftime(format = '%Y-%m-%d')
+    else:
+        cutoff = today.strftime(format = '%Y-%m-%d')
+
+    # Forecasting to the data up to end of enrolment cycle (september 20), predicting those dates only
+    future = model.make_future_dataframe(periods = periods)
+    future = future[future['ds'] > cutoff]
+    forecast = model.predict(future)
+    return forecast.loc[forecast['ds'] > cutoff, 'yhat']
+
+
+def summarizing_forecast(program: str, 
+                         yhat: pd.Series, 
+                         current: float, 
+                         target_value: int) -> pd.DataFrame: 
+    """
+    This function turns forecasted values over the horizon into the probability to reach target and the projected 
+    number of registrations of a program. 
+    
+    Args: 
+        program (str): Program of interest
+        yhat (pd.Series): forecasted values over the horizon (see predicting_horizon)
+        current (float): current number of registrations
+        target_value (int): target number of registrations for the program
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability of reaching target value and projected registrations
+    
+    Example Usage: 
+        summarizing_forecast(program = 'BGEN', yhat = yhat, current = 12, target_value = 40)
+    """
+    from scipy.stats import norm
+    
+    # If current registrations is greater than target value, prob of reaching target is trivially 1
+    if current >= target_value: 
+        prob = 1
+        
+    else:
+        # Creating probability based on distribution of forecasted values (assumption: normality)
+        prob = 1-norm.cdf(target_value, loc=yhat.mean(), scale=yhat.std())
+
+    # forecast
+    baseline = int((int(yhat.max())+int(yhat.min()))/2)
+    if baseline < current: 
+        projected_regs =  current
+    else: 
+        projected_regs =  baseline        
+
+    # Building dataframe
+    dataframe = pd.DataFrame({'program': program, 
+                            'probability': prob, 
+                            'projected_regs': projected_regs }, 
+                            index = [0])
+    
+    dataframe = dataframe.fillna(0)
+    return dataframe
+
+
+def predicting_program(program: str, 
+                       model: 'Prophet', 
+                       dataframe: pd.DataFrame, 
+                       target_value: int, 
+                       term: str, 
+                       as_of: datetime = None):
+    """
+    This function uses a fitted model to compute the probability to reach target and the projected number of 
+    registrations of a program. 
+    
+    Args: 
+        program (str): Program of interest
+        model (Prophet): model fitted on the program registrations history
+        dataframe (pd.DataFrame): registrations history (ds, y) the model was fitted on
+        target_value (int): target number of registrations for the program
+        term (str): Term of interest
+        as_of (datetime): Date the forecast is made (today by default, set it to replay past cycles)
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability of reaching target value and projected registrations
+    
+    Example Usage: 
+        predicting_program(program = 'BGEN', 
+                           model = model, 
+                           dataframe = dataframe, 
+                           target_value = 40, 
+                           term = '2024F')
+    """
+    yhat = predicting_horizon(model = model, 
+                              term = term, 
+                              as_of = as_of)
+    
+    dataframe = summarizing_forecast(program = program, 
+                                     yhat = yhat, 
+                                     current = dataframe.iloc[-1]['y'], 
+                                     target_value = target_value)
+    return dataframe
+
+
+def forecasting_program(program: str, 
+                        dataframe: pd.DataFrame, 
+                        target_value: int, 
+                        term: str):
+    """
+    This function fits a forecasting model on a program registrations history and computes the probability to reach 
+    target and the projected number of registrations. It does not touch production nor Sharepoint, so it can run on 
+    worker processes. 
+    
+    Args: 
+        program (str): Program of interest
+        dataframe (pd.DataFrame): registrations history (ds, y), output of preparing_program_forecast
+        target_value (int): target number of registrations for the program
+        term (str): Term of interest
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability of reaching target value and projected registrations
+    
+    Example Usage: 
+        forecasting_program(program = 'BGEN', 
+                            dataframe = dataframe, 
+                            target_value = 40, 
+                            term = '2024F')
+    """
+    # Creating and fitting model (reusing or warm-starting from the stored model)
+    model = fitting_program_model(program = program, 
+                                  dataframe = dataframe, 
+                                  term = term)
+
+    # Forecasting
+    dataframe = predicting_program(program = program, 
+                                   model = model, 
+                                   dataframe = dataframe, 
+                                   target_value = target_value, 
+                                   term = term)
+    return dataframe
+
+
+def forecasting_programs(jobs: List[dict], 
+                         max_workers: int = None, 
+                         timeout: int = None, 
+                         function = None):
+    """
+    This function runs forecasting_program for many programs on a pool of processes, so model fitting uses every core 
+    instead of one (or on the forecast queue workers when global_params.forecasting_settings()['distribution'] is 
+    'queue', see forecast_queue). A program whose forecast fails or times out is reported with zeros (as in test 
+    mode), without stopping the others. 
+    
+    Args: 
+        jobs (List[dict]): one dictionary per program with forecasting_program arguments (program, dataframe, target_value, term)
+        max_workers (int): number of processes (taken from global_params.forecasting_settings by default)
+        timeout (int): seconds of pool time given to each job (taken from global_params.forecasting_settings by default)
+        function (callable): function run on every job (forecasting_program by default). Jobs covering several 
+                             programs (like forecasting_school ones) list them under 'programs'.
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability and projected_regs, in jobs order (failed programs listed 
+        in dataframe.attrs['failed'])
+    
+    Example Usage: 
+        forecasting_programs(jobs = [{'program': 'BGEN', 'dataframe': dataframe, 'target_value': 40, 'term': '2024F'}], 
+                             max_workers = 4)
+    """
+    settings = global_params.forecasting_settings()
+    if max_workers is None: 
+        max_workers = settings['max_workers']
+    if timeout is None: 
+        timeout = settings['fit_timeout']
+    if function is None: 
+        function = forecasting_program
+    if len(jobs) == 0: 
+        return pd.DataFrame(columns = ['program', 'probability', 'projected_regs'])
+    if settings['distribution'] == 'queue': 
+        # Jobs are taken by queue workers (on this or other hosts) instead of a local pool
+        return forecast_queue.queue_forecasting_programs(jobs = jobs, 
+                                                         function = function.__name__)
+    max_workers = max(1, min(max_workers, len(jobs)))
+    
+    # Every job gets its share of pool time; whatever is not done by then is considered timed out
+    deadline = time.monotonic() + timeout * math.ceil(len(jobs) / max_workers)
+    
+    frames = []
+    failures = []
+    # Leaving the pool terminates its processes, including any stuck fit
+    with multiprocessing.Pool(processes = max_workers) as pool:
+        results = [(job, pool.apply_async(function, kwds = job)) for job in jobs]
+        for job, result in results: 
+            name = job.get('school', job.get('program'))
+            programs = job.get('programs', [job.get('program')])
+            try: 
+                frames.append(result.get(timeout = max(0, deadline - time.monotonic())))
+                continue
+            except multiprocessing.TimeoutError: 
+                print(f'[Info] Forecast for {name} timed out.')
+            except Exception as e: 
+                print(f'[Info] Forecast for {name} failed: {e}')
+            failures.extend(programs)
+            frames.append(pd.DataFrame({'program': programs, 'probability': 0, 'projected_regs': 0}))
+    
+    dataframe = pd.concat(frames)
+    print(f'[Info] {len(dataframe) - len(failures)} programs forecasted successfully on {max_workers} processes, {len(failures)} failed.')
+    # Keeping track of failed programs (reported with zeros), so they are not taken as actual forecasts
+    dataframe.attrs['failed'] = failures
+    return dataframe
+
+
+def forecasting_school(school: str, 
+                       programs: List[str], 
+                       dataframes: List[pd.DataFrame], 
+                       target_values: List[int], 
+                       term: str) -> pd.DataFrame: 
+    """
+    This function forecasts all programs of a school with a single model fitted on the school registrations (sum of 
+    its programs). The school forecast is allocated to programs by their historical share of school registrations at 
+    the end of previous cycles, plus a residual correction (difference between current program registrations and its 
+    share of current school registrations), so small and noisy programs borrow strength from their school. 
+    
+    Args: 
+        school (str): School of interest
+        programs (List[str]): programs of the school
+        dataframes (List[pd.DataFrame]): registrations history (ds, y) of every program
+        target_values (List[int]): target number of registrations of every program
+        term (str): Term of interest
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability and projected_regs for every program of the school
+    
+    Example Usage: 
+        forecasting_school(school = 'School of Business', 
+                           programs = ['ACTG', 'BGEN'], 
+                           dataframes = [actg, bgen], 
+                           target_values = [40, 25], 
+                           term = '2024F')
+    """
+    # Programs histories side by side and school registrations
+    histories = pd.concat([dataframe.assign(ds = pd.to_datetime(dataframe['ds'])).groupby('ds')['y'].last().rename(program) 
+                           for program, dataframe in zip(programs, dataframes)], axis = 1).sort_index().ffill().fillna(0)
+    school_history = histories.sum(axis = 1)
+    
+    # Fitting a single model for the school
+    model = fitting_program_model(program = f'school_{school}', 
+                                  dataframe = pd.DataFrame({'ds': school_history.index, 'y': school_history.values}), 
+                                  term = term)
+    yhat = predicting_horizon(model = model, term = term)
+    
+    # Historical shares: program registrations over school registrations at the end of previous cycles
+    ends = [analog_forecast.cycle_end_date(f'{year}{term[-1]}') for year in range(int(term[:4]) - 10, int(term[:4]))]
+    ends = [end for end in ends if end in histories.index and school_history[end] > 0]
+    if len(ends) > 0: 
+        shares = histories.loc[ends].div(school_history[ends], axis = 0).mean()
+    elif school_history.iloc[-1] > 0: 
+        shares = histories.iloc[-1] / school_history.iloc[-1]
+    else: 
+        shares = pd.Series(1 / len(programs), index = programs)
+    
+    frames = []
+    for program, dataframe, target_value in zip(programs, dataframes, target_values): 
+        current = dataframe.iloc[-1]['y']
+        # Residual correction keeps the allocation anchored on the program current registrations
+        residual = current - shares[program] * school_history.iloc[-1]
+        frames.append(summarizing_forecast(program = program, 
+                                           yhat = shares[program] * yhat + residual, 
+                                           current = current, 
+                                           target_value = target_value))
+    return pd.concat(frames)
+
+
+def school_forecasting_programs(jobs: List[dict], 
+                                max_workers: int = None) -> pd.DataFrame: 
+    """
+    This function groups programs by school and forecasts them with one model per school (see forecasting_school), 
+    running schools in parallel. 
+    
+    Args: 
+        jobs (List[dict]): one dictionary per program with program, school, dataframe, target_value and term
+        max_workers (int): number of processes (taken from global_params.forecasting_settings by default)
+    
+    Returns: 
+        Dataframe (pd.DataFrame) with program, probability and projected_regs, in jobs order (failed programs listed 
+        in dataframe.attrs['failed'])
+    
+    Example Usage: 
+        school_forecasting_programs(jobs = jobs)
+    """
+    schools = {}
+    for job in jobs: 
+        schools.setdefault(job['school'], []).append(job)
+    school_jobs = [{'school': school, 
+                    'programs': [job['program'] for job in members], 
+                    'dataframes': [job['dataframe'] for job in members], 
+                    'target_values': [job['target_value'] for job in members], 
+                    'term': members[0]['term']} 
+                   for school, members in schools.items()]
+    print(f'[Info] {len(jobs)} programs forecasted with {len(school_jobs)} school models.')
+    
+    forecasts = forecasting_programs(jobs = school_jobs, 
+                                     max_workers = max_workers, 
+                                     function = forecasting_school)
+    
+    # Back to jobs order
+    failed = forecasts.attrs['failed']
+    forecasts = forecasts.set_index('program').loc[[job['program'] for job in jobs]].reset_index()
+    forecasts.attrs['failed'] = failed
+    return forecasts
+
+
+def forecast_cache_key(job: dict, 
+                       engine: str) -> str:
+    """
+    This function builds the key identifying a program forecast: program, term, registrations history, target value
+    and forecasting settings (engine and its parameters). As the horizon depends on the day the forecast is made, the
+    date is part of the key too. 
+    
+    Args: 
+        job (dict): program, dataframe (ds, y), target_value and term (as passed to forecasting_programs)
+        engine (str): forecasting engine, 'prophet', 'school' or 'analog'
+    
+    Returns: 
+        key (str)
+    
+    Example Usage: 
+        forecast_cache_key(job = job, engine = 'prophet')
+    """
+    settings = global_params.forecasting_settings()
+    if engine in ['prophet', 'school']: 
+        model_settings = f"mcmc{settings['mcmc_samples']}"
+    else: 
+        model_settings = f"years{settings['analog_years']}"
+    model_settings += f"-{settings['probability_method']}{settings['simulations']}{settings['quantiles']}"
+    key = '|'.join([job['program'], job['term'], training_fingerprint(job['dataframe']), str(job['target_value']), 
+                    engine, model_settings, datetime.now().date().isoformat()])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def forecast_cache_path(term: str) -> Path:
+    """
+    Location of the forecast results cache of a term 
+    """
+    return Path(global_params.forecasting_settings()['result_folder'])/f'{term}.json'
+
+
+def reading_forecast_cache(term: str) -> dict:
+    """
+    This function reads the forecast results cache of a term ({program: {key, probability, projected_regs}}), 
+    empty if there is none (or it cannot be read). 
+    
+    Example Usage: 
+        cache = reading_forecast_cache(term = '2024F')
+    """
+    path = forecast_cache_path(term)
+    if not path.exists(): 
+        return {}
+    try: 
+        return json.loads(path.read_text())
+    except Exception as e: 
+        print(f'[Info] Forecast cache could not be read: {e}')
+        return {}
+
+
+def writing_forecast_cache(term: str, 
+                           cache: dict): 
+    """
+    This function stores the forecast results cache of a term (written aside and then moved). 
+    
+    Example Usage: 
+        writing_forecast_cache(term = '2024F', cache = cache)
+    """
+    path = forecast_cache_path(term)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(cache))
+    os.replace(temporary, path)
+
+
 def getting_target_probabilities_program(program:str, 
                                          start_year:int, 
                                          end_year:int,
                                          term: str, 
                                          file_name_budget: str,
                                          test_mode: bool = False,
+                                         budget: pd.DataFrame = None,
                                          cnxn: pyodbc.Connection = None):
     """
     This function creates a forecasted value for target value and a probability to reach target for a given program
@@ -155,6 +822,7 @@ def getting_target_probabilities_program(program:str,
         term (str): Term of interest
         file_name_budget (str): file containing budget numbers of interest
         test_mode (bool): If True, will not compute probabilites, recommended when testing (set as False by default)
+        budget (pd.DataFrame): budget table from loading_budget_table (loaded from file_name_budget if not provided)
         cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
         
     Returns: 
@@ -169,100 +837,27 @@ def getting_target_probabilities_program(program:str,
     
 
     """
-
-    # Importing budget data (sharepoint)
-    target  = custom_sharepoint.sharepoint_download(sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/',
-                                                 local_folder = 'budgets', 
-                                                 file_name = file_name_budget, 
-                                                 col2_name = 'target')
-    
-    # If no connection is provided, create one
-    if cnxn is None: 
-        cnxn = python_utils.get_connection()
-
-    # Getting programs historical data
-    if not test_mode:
-        dataframe = program_full_data(program = program, 
-                                    start_year = start_year, 
-                                    end_year = end_year,
-                                    term = term,
-                                    cnxn = cnxn,
-                                    folder_name = 'registrations')
-        # apps 
-        program_full_data(program = program, 
-                                    start_year = start_year, 
-                                    end_year = end_year,
-                                    term = term,
-                                    cnxn = cnxn,
-                                    folder_name= 'applications')
-        
-        # confs
-        program_full_data(program = program, 
-                                    start_year = start_year, 
-                                    end_year = end_year,
-                                    term = term,
-                                    cnxn = cnxn,
-                                    folder_name= 'confirmations')
-        # Creating and fitting model 
-        
-        model = Prophet() # Thanks facebook! 
-        model.fit(dataframe)
-
-        # Counting number of days to reach end of cycle + day 10th (more or less 14 days more )
-        periods = final_enrolment_day_be_term(term = term) + 15
-
-        # Forecasting to the data up to end of enrolment cycle (september 20)
-        future = model.make_future_dataframe(periods = periods)
-        forecast = model.predict(future)
-
-        # Keeping forecasted values
-        today = datetime.now().date()
-        if periods < 30: 
-            two_months_ago = today - timedelta(days=60)
-            mask = (forecast['ds'] > two_months_ago.strftime(format = '%Y-%m-%d'))
-        else:
-            mask = (forecast['ds'] > today.strftime(format = '%Y-%m-%d'))
-
-        # Importing target values from target file
-        target_value = int(float(target.loc[target['Program']==program, 'target'].values[0]))
-
-        # If current registrations is greater than target value, prob of reaching target is trivially 1
-        if dataframe.iloc[-1]['y'] >= target_value: 
-            prob = 1
-            
-        else:
-            # Creating probability based on distribution of forecasted values (assumption: normality)
-            # prob =0.5 
-            prob = 1-norm.cdf(target_value, loc=forecast.loc[mask, 'yhat'].mean(), scale=forecast.loc[mask, 'yhat'].std())
-        
-            # Projected number of registrations
-            # projected_regs = dataframe.iloc[-1]['y']
-
-        # forecast
-        baseline = int((int(forecast.loc[mask, 'yhat'].max())+int(forecast.loc[mask, 'yhat'].min()))/2)
-        # baseline = int(forecast.loc[mask, 'yhat'].max())
-        if baseline < dataframe.iloc[-1]['y']: 
-            projected_regs =  dataframe.iloc[-1]['y']
-        else: 
-            projected_regs =  baseline        
-
-
-        # Building dataframe
-        dataframe = pd.DataFrame({'program': program, 
-                                'probability': prob, 
-                                'projected_regs': projected_regs }, 
-                                index = [0])
-        
-        
-        dataframe = dataframe.fillna(0)
-    
     if test_mode: 
         dataframe = pd.DataFrame({'program': program, 
                                 'probability': 0, 
                                 'projected_regs': 0 }, 
                                 index = [0])
-
-		
+        return dataframe
+    
+    # Getting programs historical data and target 
+    dataframe, target_value = preparing_program_forecast(program = program, 
+                                                         start_year = start_year, 
+                                                         end_year = end_year,
+                                                         term = term,
+                                                         file_name_budget = file_name_budget,
+                                                         budget = budget,
+                                                         cnxn = cnxn)
+    
+    # Creating and fitting model 
+    dataframe = forecasting_program(program = program, 
+                                    dataframe = dataframe, 
+                                    target_value = target_value, 
+                                    term = term)
     return dataframe;
 
 def target_probability_report(term: str, 
@@ -271,9 +866,15 @@ def target_probability_report(term: str,
                               start_year:int = 2019,
                               end_year:int = 2023, 
                               test_mode: bool = False,
+                              max_workers: int = None,
+                              engine: str = None,
+                              budget: pd.DataFrame = None,
                               cnxn: pyodbc.Connection = None):
     """
-    This function gets the final version of hitting the target probability report for all programs on current reporting list
+    This function gets the final version of hitting the target probability report for all programs on current reporting list.
+    Programs data is gathered one program at a time, then forecasts are made with the selected engine: 'prophet' 
+    (models fitted in parallel, see forecasting_programs), 'school' (one model per school of the order file, see 
+    school_forecasting_programs) or 'analog' (previous years curves, see analog_forecast.analog_forecasting_programs).
     
     Args: 
         start_year (int): start year to start tracking historical data (set on 2019 by default)
@@ -282,10 +883,14 @@ def target_probability_report(term: str,
         term (str): Enrollment term of interest 
         file_name_budget (str): name of file containing budget numbers of interest 
         test_mode (bool): If True, will not compute probabilites, recommended when testing (set as False by default)
+        max_workers (int): number of processes fitting models (taken from global_params.forecasting_settings by default)
+        engine (str): forecasting engine, 'prophet', 'school' or 'analog' (taken from global_params.forecasting_settings by default)
+        budget (pd.DataFrame): budget table from loading_budget_table (loaded once from file_name_budget if not provided)
         cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
         
     Returns: 
-        dataframe (pd.DataFrame) with all programs and probabilities of reaching target
+        dataframe (pd.DataFrame) with all programs, probabilities of reaching target, projected registrations and 
+        quantiles of projected registrations (see monte_carlo.adding_monte_carlo)
     
     Example usage: 
         target_probability_report(term = '2023F')
@@ -295,22 +900,98 @@ def target_probability_report(term: str,
         cnxn = python_utils.get_connection()
     
     
-    # Importing current reporting data list (sharepoint)
-    order = custom_sharepoint.sharepoint_download(sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/',
-                                    local_folder = 'orders',
-									file_name = file_name)
-    # Creating empty dataframe
-    dataframe = pd.DataFrame()
-    
-    # Iterating over programs in current reporting program list
-    for i, row in order.iterrows(): 
-        dataframe = dataframe.append(getting_target_probabilities_program(program = row['Program'],
-                                                                          start_year = start_year, 
-                                                                          end_year = end_year,
-                                                                          file_name_budget = file_name_budget,
-                                                                          term = term,    
-                                                                          test_mode = test_mode,                                                                      
-                                                                          cnxn = cnxn))
+    # Importing current reporting data list (sharepoint, indexed by Program)
+    order = custom_sharepoint.loading_side_file(local_folder = 'orders',
+                                                file_name = file_name)
+    
+    if test_mode: 
+        dataframe = pd.DataFrame({'program': list(order.index), 
+                                  'probability': 0, 
+                                  'projected_regs': 0 })
+        for quantile in global_params.forecasting_settings()['quantiles']: 
+            dataframe[f'projected_p{int(round(quantile * 100))}'] = 0
+        return dataframe
+    
+    # Importing budget data once for all programs
+    if budget is None: 
+        budget = loading_budget_table(file_name_budget = file_name_budget)
+    
+    # Gathering data for every program in current reporting program list
+    jobs = []
+    for program in order.index: 
+        dataframe, target_value = preparing_program_forecast(program = program,
+                                                             start_year = start_year, 
+                                                             end_year = end_year,
+                                                             file_name_budget = file_name_budget,
+                                                             budget = budget,
+                                                             term = term,    
+                                                             cnxn = cnxn)
+        jobs.append({'program': program, 
+                     'dataframe': dataframe, 
+                     'target_value': target_value, 
+                     'term': term})
+    
+    if engine is None: 
+        engine = global_params.forecasting_settings()['engine']
+    if engine not in ['prophet', 'school', 'analog']: 
+        raise ValueError(f"Unknown forecasting engine '{engine}', use 'prophet', 'school' or 'analog'.")
+    
+    # Programs whose inputs did not change since last forecast are taken from the forecast cache
+    cache = reading_forecast_cache(term = term)
+    keys = {job['program']: forecast_cache_key(job = job, engine = engine) for job in jobs}
+    if engine == 'school': 
+        # A school model depends on all programs of the school, so any change refits them all
+        schools = order['School'].astype(str).to_dict()
+        school_keys = {}
+        for job in jobs: 
+            school_keys[schools[job['program']]] = school_keys.get(schools[job['program']], '') + keys[job['program']]
+        keys = {job['program']: hashlib.sha256(school_keys[schools[job['program']]].encode('utf-8')).hexdigest() for job in jobs}
+    pending = [job for job in jobs if cache.get(job['program'], {}).get('key') != keys[job['program']]]
+    
+    if len(pending) > 0 and engine == 'analog': 
+        # Projecting from previous years (all programs at once)
+        forecasts = analog_forecast.analog_forecasting_programs(jobs = pending)
+    elif len(pending) > 0 and engine == 'school': 
+        # Fitting one model per school, schools in parallel
+        forecasts = school_forecasting_programs(jobs = [dict(job, school = schools[job['program']]) for job in pending], 
+                                                max_workers = max_workers)
+    elif len(pending) > 0: 
+        # Fitting models in parallel
+        forecasts = forecasting_programs(jobs = pending, 
+                                         max_workers = max_workers)
+    else: 
+        forecasts = pd.DataFrame(columns = ['program', 'probability', 'projected_regs'])
+    
+    # Simulating outcomes around new forecasts: quantiles (and probability, depending on settings)
+    if len(pending) > 0: 
+        forecasts = monte_carlo.adding_monte_carlo(forecasts = forecasts, 
+                                                   jobs = pending)
+    columns = ['probability', 'projected_regs'] + [f'projected_p{int(round(quantile * 100))}' 
+                                                   for quantile in global_params.forecasting_settings()['quantiles']]
+    
+    # Updating cache with new forecasts (failed ones are left out, so they are tried again next run)
+    failed = forecasts.attrs.get('failed', [])
+    for i, row in forecasts.iterrows(): 
+        if row['program'] not in failed: 
+            cache[row['program']] = {'key': keys[row['program']]}
+            cache[row['program']].update({column: float(row[column]) if column == 'probability' else int(row[column]) 
+                                          for column in columns})
+    writing_forecast_cache(term = term, cache = cache)
+    print(f'[Info] {len(pending)} programs forecasted, {len(jobs) - len(pending)} reused from forecast cache.')
+    
+    # Putting it all together in order file order
+    forecasts = forecasts.drop_duplicates(subset = 'program').set_index('program')
+    rows = []
+    for job in jobs: 
+        if job['program'] in forecasts.index: 
+            source = forecasts.loc[job['program']]
+        else: 
+            source = cache[job['program']]
+        row = {'program': job['program']}
+        row.update({column: float(source[column]) if column == 'probability' else int(source[column]) 
+                    for column in columns})
+        rows.append(row)
+    dataframe = pd.DataFrame(rows, columns = ['program'] + columns)
         
     return dataframe;
 
@@ -320,7 +1001,8 @@ def program_full_data(program:str,
                       end_year:int, 
                       term: str,
                       cnxn: pyodbc.Connection = None, 
-                      folder_name = 'registrations'):
+                      folder_name = 'registrations', 
+                      transfers: list = None):
     """
     This function gets full historical data for a given program. If there is no program file with data, creates it. 
     It there is program file, it updates it with missing dates. 
@@ -331,6 +1013,8 @@ def program_full_data(program:str,
         end_year (int): start year to start tracking historical data
         term (str): Term of interest 
         cnxn (pyodbc.Connection): Connection to retrieve data from (set as None by default)
+        transfers (list): If provided, the upload of the updated file is added to it (see custom_sharepoint.submitting_transfer) 
+                          for the caller to wait on, instead of being waited on here
         
     Returns: 
         Dataframe (pd.DataFrame) with dates and number of registrations. 
@@ -348,8 +1032,8 @@ def program_full_data(program:str,
 
     program_file = program + '.txt'
     if program_file in files: 
-        # Get the file from SharePoint
-        byte_content = folder.get_file(program_file)
+        # Get the file from storage (SharePoint by default)
+        byte_content = storage.reading_file(path = f'{folder}/{program_file}')
 
         # Convert byte string to a regular string
         content_str = byte_content.decode('utf-8')
@@ -395,45 +1079,33 @@ def program_full_data(program:str,
         dataframe.to_csv(output, sep = '\t', index=False)
         csv_content = output.getvalue().encode('utf-8') # Convert to bytes-like object
 
-        # Upload/update the document
-        folder.upload_file(csv_content, program_file)
+        # Upload/update the document (on the transfer manager, skipped once the request budget is spent)
+        upload = custom_sharepoint.submitting_optional_transfer(storage.writing_file, f'{folder}/{program_file}', csv_content)
 
     if program_file not in files: 
-        # Building program information
-        if folder_name == 'registrations':
-            df_final = apps_confs_progression.building_program_record(program = program,
-                                            start_year = start_year, 
-                                            end_year = end_year,
-                                            term = term,
-                                            cnxn = cnxn)
-        if folder_name == 'applications':
-            df_final = apps_confs_progression.building_program_record_apps(program = program,
-                                            start_year = start_year, 
-                                            end_year = end_year,
-                                            term = term,
-                                            cnxn = cnxn)
-        if folder_name == 'confirmations':
-            df_final = apps_confs_progression.building_program_record_confs(program = program,
-                                            start_year = start_year, 
-                                            end_year = end_year,
-                                            term = term,
-                                            cnxn = cnxn)
+        # Building program information (partitioned and checkpointed, so an interrupted build resumes)
+        df_final = backfill.backfilling_program_history(programs = [program],
+                                                        start_year = start_year, 
+                                                        end_year = end_year,
+                                                        term = term,
+                                                        folder_name = folder_name, 
+                                                        upload = False)[program]
             
         # Convert DataFrame to CSV in-memory and then upload
         output = StringIO()
         df_final.to_csv(output, sep = '\t', index=False)
         csv_content = output.getvalue().encode('utf-8') # Convert to bytes-like object
 
-        # Upload/update the document
-        folder.upload_file(csv_content, program_file)
-
-    # Get the file from SharePoint
-    byte_content = folder.get_file(program_file)
+        # Upload/update the document (on the transfer manager, skipped once the request budget is spent)
+        upload = custom_sharepoint.submitting_optional_transfer(storage.writing_file, f'{folder}/{program_file}', csv_content)
 
-    # Convert byte string to a regular string
-    content_str = byte_content.decode('utf-8')
+    # Waiting for upload, unless the caller does
+    if transfers is None: 
+        custom_sharepoint.waiting_transfers([upload])
+    else: 
+        transfers.append(upload)
 
-    # Convert string to a pandas DataFrame
-    dataframe = pd.read_csv(StringIO(content_str), delimiter='\t')
+    # The uploaded content is the file on SharePoint, no need to download it back
+    dataframe = pd.read_csv(StringIO(csv_content.decode('utf-8')), delimiter='\t')
 
     return dataframe
\ No newline at end of file
@@ -547,4 +547,81 @@ def xstl_query_term_level_campus(term: str,
         ,STC_COURSE_NAME
     """
 
-    return pd.read_sql(query, cnxn)
\ No newline at end of file
+    return pd.read_sql(query, cnxn)
+
+
+def ApplicationStatusHistoryQuery(term: str, 
+                                  cnxn: pyodbc.connect) -> pd.DataFrame:
+    """Query to extract the full status history of every application to a term.
+
+    Unlike the other queries in this module, the history is not cut at a given date, so the status of any application
+    as of any date can be rebuilt from this single result. Applicants without a preferred address are kept (as in
+    TableauQuery and FirstApplicationsQuery) and flagged by Has_Address (OffersQuery and ConfirmationsQuery drop them).
+
+    Args:
+        term (str): Term to be used when retrieving information.
+        cnxn (pyodbc.connect): Connection string to access the database.
+    
+    Returns:
+        pd.DataFrame: Dataframe with one row per application status.
+    """
+    query = f"""
+SELECT AA.APPLICATIONS_ID AS Application_ID
+	,APPL_APPLICANT AS Applicant_ID
+	,APPL_ACAD_PROGRAM AS Program
+	,APPL_PRIORITY AS Level
+	,APPL_CHOICE AS Choice
+	,BB.APPL_STATUS AS Status
+	,BB.APPL_STATUS_DATE AS Status_Date
+	,BB.POS AS Pos
+	,CASE WHEN ADDRESS.ADDRESS_ID IS NULL THEN 0 ELSE 1 END AS Has_Address
+FROM APPLICATIONS AA
+JOIN APPL_STATUSES BB ON AA.APPLICATIONS_ID = BB.APPLICATIONS_ID
+JOIN PERSON P ON APPL_APPLICANT = P.ID
+LEFT JOIN ADDRESS ON ADDRESS_ID = PREFERRED_ADDRESS
+WHERE APPL_START_TERM = '{term}'
+	AND BB.APPL_STATUS_DATE IS NOT NULL
+ORDER BY AA.APPLICATIONS_ID
+	,BB.POS
+    """
+    query = pd.read_sql(query, cnxn)
+    return(query)
+
+
+def RegistrationStatusHistoryQuery(term: str, 
+                                   cnxn: pyodbc.connect) -> pd.DataFrame:
+    """Query to extract the full status history of every CTRL course (registration) of a term, at Sarnia campus.
+
+    Args:
+        term (str): Term to be used when retrieving information.
+        cnxn (pyodbc.connect): Connection string to access the database.
+    
+    Returns:
+        pd.DataFrame: Dataframe with one row per registration status.
+    """
+    query = f"""
+SELECT AA.STUDENT_ACAD_CRED_ID AS Cred_ID
+	,STC_PERSON_ID AS student_id
+	,SUBSTRING(STC_COURSE_NAME, 6, 4) AS program
+	,STC_SECTION_NO AS AAL
+	,IMMIGRATION_STATUS AS imm_status
+	,STTR_STUDENT_LOAD AS current_load
+	,BB.STC_STATUS AS status
+	,BB.STC_STATUS_DATE AS status_date
+	,BB.POS AS pos
+FROM STUDENT_ACAD_CRED AA
+JOIN STC_STATUSES BB ON AA.STUDENT_ACAD_CRED_ID = BB.STUDENT_ACAD_CRED_ID
+JOIN STUDENT_COURSE_SEC SCS ON SCS.STUDENT_COURSE_SEC_ID = AA.STC_STUDENT_COURSE_SEC
+JOIN STUDENT_TERMS ON STUDENT_TERMS_ID = STC_PERSON_ID + '*' + STC_TERM + '*' + STC_ACAD_LEVEL
+JOIN PERSON P ON STC_PERSON_ID = P.ID
+JOIN ADDRESS ON ADDRESS_ID = PREFERRED_ADDRESS
+WHERE STC_TERM = '{term}'
+	AND STC_SUBJECT = 'CTRL'
+	AND SCS_LOCATION = 'MAIN'
+	AND STC_ACAD_LEVEL = 'PS'
+	AND BB.STC_STATUS_DATE IS NOT NULL
+ORDER BY AA.STUDENT_ACAD_CRED_ID
+	,BB.POS
+    """
+    query = pd.read_sql(query, cnxn)
+    return(query)
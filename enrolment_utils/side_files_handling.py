@@ -1,8 +1,88 @@
 import pandas as pd
-from enrolment_utils import custom_sharepoint, global_params, python_utils
+import hashlib
+import io
+import openpyxl
+import re
+from enrolment_utils import custom_sharepoint, global_params, python_utils, storage
 import enrolment_utils.python_utils as utils_geral
 from typing import List
 
+# Parsed projections file, shared by every intake run while the file does not change (see loading_projections)
+_projections = {}
+
+
+def parsing_projections(byte_content: bytes, 
+                        blocks: dict = None) -> dict: 
+    """
+    This function parses the projections workbook in one pass (openpyxl, read only) and keeps, for every sheet of 
+    interest, the program columns (School, Program, Previous Program Codes, Active) and the block of columns of every 
+    term. Terms (e.g. 2024F) are found on the first row under the header, where every term block starts; other notes on 
+    that row are ignored. Cells are read as 
+    pd.read_excel(keep_default_na = False) would: empty cells as '' and whole numbers as int. 
+    
+    Args: 
+        byte_content (bytes): content of projections.xlsx
+        blocks (dict): width of term blocks per sheet ('main' is the first sheet of the workbook), 
+                       {'main': 12, 'Ottawa': 3} if None
+    
+    Returns: 
+        dictionary {sheet: {term: pd.DataFrame}} with program columns followed by the term block columns
+    
+    Example Usage: 
+        parsing_projections(byte_content = storage.reading_file(path = 'budgets/projections.xlsx'))['Ottawa']['2024F']
+    """
+    if blocks is None: 
+        blocks = {'main': 12, 'Ottawa': 3}
+    workbook = openpyxl.load_workbook(io.BytesIO(byte_content), read_only = True, data_only = True)
+    sheets = {}
+    for sheet_name, width in blocks.items(): 
+        worksheet = workbook.worksheets[0] if sheet_name == 'main' else workbook[sheet_name]
+        rows = []
+        for row in worksheet.iter_rows(values_only = True): 
+            row = ['' if value is None else (int(value) if isinstance(value, float) and value.is_integer() else value) 
+                   for value in row]
+            rows.append(row)
+        while rows and all(value == '' for value in rows[-1]): 
+            rows.pop()
+        
+        # Program columns and start of every term block
+        header, data = rows[0], rows[1:]
+        base = [header.index(name) for name in ['School', 'Program', 'Previous Program Codes', 'Active']]
+        starts = {}
+        for i, value in enumerate(data[0] if data else []): 
+            if isinstance(value, str) and re.fullmatch(r'\d{4}[FWS]', value) and value not in starts and i not in base: 
+                starts[value] = i
+        
+        # Only columns of interest are kept
+        sheets[sheet_name] = {}
+        for term, start in starts.items(): 
+            columns = base + list(range(start, start + width))
+            sheets[sheet_name][term] = pd.DataFrame([[row[i] if i < len(row) else '' for i in columns] for row in data], 
+                                                    columns = [header[i] for i in columns])
+    workbook.close()
+    return sheets
+
+
+def loading_projections(sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard') -> dict: 
+    """
+    This function gives the parsed projections file (see parsing_projections). The file is checked on every call 
+    (a conditional download, see custom_sharepoint.downloading_sharepoint_file) but only parsed again when its content 
+    changed, so the three intake runs, and the following runs, share one parse. 
+    
+    Returns: 
+        dictionary {sheet: {term: pd.DataFrame}}, sheets being 'main' and 'Ottawa'
+    
+    Example Usage: 
+        loading_projections()['main']['2024F']
+    """
+    byte_content = storage.reading_file(path = 'budgets/projections.xlsx')
+    digest = hashlib.sha256(byte_content).hexdigest()
+    if _projections.get('digest') != digest: 
+        _projections.update({'digest': digest, 
+                             'sheets': parsing_projections(byte_content = byte_content)})
+        print('[Info] Projections file parsed.')
+    return _projections['sheets']
+
 
 
 def setting_order_budget(terms: List[str], 
@@ -21,25 +101,15 @@ def setting_order_budget(terms: List[str],
         terms (List[str]): List of terms to be reported. (this function is going to take the letter only, which flags the intake)
     
     returns: 
-        None, but updates two files within sharepoint: order and budget
+        order (pd.DataFrame, as custom_sharepoint.sharepoint_download would give it), and updates two files within 
+        sharepoint: order and budget (only when their content changed). Raises when no program is kept, or when the 
+        files cannot be written, rather than going on with an empty or stale order. 
     
     last update: Oct 5, 2023
     """
     # Gets data from projection file (so, everytime there are new projections, it should be updated on sharepoint)
-    projections = custom_sharepoint.sharepoint_download_excel(sharepoint_base_url = sharepoint_base_url,
-                                                                file_name = 'projections.xlsx', 
-                                                                folder = 'budgets')
-
-
-
-    # The projections file is messy, so grab the rigth term and navigate through it, is fundamental 
-    t = projections.isin([terms[-1]]).loc[0,].to_list()
-
-    column = [i for i, x in enumerate(t) if x]
-
-    df1 = projections[['School', 'Program', 'Previous Program Codes', 'Active']]
-    df2 = projections.iloc[:,column[0]:column[0]+12]
-    projections = pd.concat([df1, df2], axis = 1)
+    # The projections file is messy, the term block is located once when the file is parsed (see loading_projections)
+    projections = loading_projections(sharepoint_base_url = sharepoint_base_url)['main'][terms[-1]].copy()
 
     # Columns of interest
     projections.columns=['School', 'Program', 'Previous Program Codes', 'Active', 'Term',
@@ -57,6 +127,9 @@ def setting_order_budget(terms: List[str],
     projections['Budget'] = projections['Budget'].astype(int)
 
     projections['Program'] = projections['Program'].str[:4]
+    # An empty order would silently give an empty report (and overwrite the order files)
+    if projections.empty: 
+        raise ValueError(f'No active program with a budget for {terms[-1]} in the projections file, order not updated.')
     # projections['School'] = projections['School'].str.replace(' ', '')
     # Setting file names based on intake
     file_naming = global_params.naming_files()
@@ -69,21 +142,23 @@ def setting_order_budget(terms: List[str],
     elif terms[-1][-1] == 'S': 
         file_name_order = file_naming['summer']['file_name_order']
         file_name_budget = file_naming['summer']['file_name_budget']
+    else: 
+        raise ValueError(f'Unknown intake of term {terms[-1]}, expecting F, W or S.')
 	
 
-    # Upload order file
-    custom_sharepoint.upload_dataframe_as_txt_to_sharepoint(sharepoint_base_url = sharepoint_base_url, 
-                                                            dataframe = projections[['Program','School']],
-                                                            file_name = file_name_order, 
-                                                            destination_folder_url = '/sites/EnrolmentDashboard/Shared%20Documents/orders'
-                                                           )
-    # Upload budget file
-    custom_sharepoint.upload_dataframe_as_txt_to_sharepoint(sharepoint_base_url = sharepoint_base_url, 
-                                                            dataframe = projections[['Program','Budget']],
-                                                            file_name = file_name_budget, 
-                                                            destination_folder_url = '/sites/EnrolmentDashboard/Shared%20Documents/budgets'
-                                                           )
-    return None; 
+    # Upload order and budget files, unless unchanged since last upload (one after the other: this function already 
+    # runs as a transfer, see main_pipeline)
+    order_content = projections[['Program','School']].to_csv(index=False, sep='\t').encode('utf-8')
+    budget_content = projections[['Program','Budget']].to_csv(index=False, sep='\t').encode('utf-8')
+    storage.writing_changed_file(path = f'orders/{file_name_order}', 
+                                 content = order_content)
+    storage.writing_changed_file(path = f'budgets/{file_name_budget}', 
+                                 content = budget_content)
+
+    # Fresh files are used by the rest of the run (no download back)
+    custom_sharepoint.remembering_side_file(local_folder = 'orders', file_name = file_name_order, byte_content = order_content)
+    custom_sharepoint.remembering_side_file(local_folder = 'budgets', file_name = file_name_budget, byte_content = budget_content)
+    return custom_sharepoint.parsing_two_column_file(byte_content = order_content)
 
 
 def program_information(order: pd.DataFrame,
@@ -162,18 +237,10 @@ def setting_order_budget_ottawa(terms: List[str],
     if cnxn is None: 
         cnxn = python_utils.get_connection()
 
-    # Retrieving Ottawa projections from projections file
-    projections = custom_sharepoint.sharepoint_download_excel(sharepoint_base_url = sharepoint_base_url,
-                                            sheet_name = 'Ottawa',
-                                            file_name = 'projections.xlsx', 
-                                            folder = 'budgets')
-
-    # Keeping columns of interest and renaming them
-    t = projections.isin([terms[-1]]).loc[0,].to_list()
-    column = [i for i, x in enumerate(t) if x]
-    df1 = projections[['School', 'Program', 'Previous Program Codes', 'Active']]
-    df2 = projections.iloc[:,column[0]:column[0]+3]
-    projections = pd.concat([df1, df2], axis = 1)
+    # Retrieving Ottawa projections from projections file (parsed once, see loading_projections)
+    projections = loading_projections(sharepoint_base_url = sharepoint_base_url)['Ottawa'][terms[-1]].copy()
+
+    # Renaming columns of interest
     projections.columns=['school', 'program', 'previous program codes', 'active', 'term',
                             'level', 'international']
     
@@ -0,0 +1,226 @@
+import time
+import threading
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+from enrolment_utils import global_params, custom_sharepoint
+
+# Time spent in storage operations of the current run (see storage_statistics)
+_storage_stats = {'operations': 0, 'seconds': 0.0}
+_stats_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+
+
+def relative_path(url: str) -> str:
+    """
+    Turns a Sharepoint url of a document ('/sites/EnrolmentDashboard/Shared%20Documents/orders/order.txt',
+    'Shared Documents/orders') into a storage path, relative to Shared Documents ('orders/order.txt', 'orders').
+    Storage paths are returned unchanged.
+    """
+    path = url.replace('%20', ' ').strip('/')
+    for prefix in ['sites/EnrolmentDashboard/', 'Shared Documents']:
+        if path.startswith(prefix):
+            path = path[len(prefix):].strip('/')
+    return path
+
+
+def timing_storage(function):
+    """
+    Decorator counting calls and seconds spent in a storage operation (see storage_statistics).
+    """
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with _stats_lock:
+                _storage_stats['operations'] += 1
+                _storage_stats['seconds'] += time.perf_counter() - start
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+
+def storage_statistics() -> dict:
+    """
+    Returns the storage counters of the current run: backend, operations (list, read, write, stat) and seconds spent
+    in them. With the Sharepoint backend, seconds is the Sharepoint latency of the run.
+
+    Example Usage:
+        logger.info(f'Storage: {storage.storage_statistics()}')
+    """
+    with _stats_lock:
+        return dict(_storage_stats, backend = global_params.storage_settings()['backend'])
+
+
+def resetting_storage_statistics():
+    """
+    Resets the storage counters, at the start of every run.
+    """
+    with _stats_lock:
+        _storage_stats.update({'operations': 0, 'seconds': 0.0})
+
+
+def local_root() -> Path:
+    """
+    Local folder standing for Shared Documents when the local backend is selected.
+    """
+    return Path(global_params.storage_settings()['local_folder'])
+
+
+@timing_storage
+def listing_files(folder: str) -> List[dict]:
+    """
+    Lists the files of a storage folder (Sharepoint Shared Documents, or its local copy, depending on
+    global_params.storage_settings()['backend']).
+
+    Args:
+        folder (str): folder, relative to Shared Documents (e.g. 'program_history/registrations/fall')
+
+    Returns:
+        List of dictionaries with Name, Length (bytes) and TimeLastModified (ISO date) of every file
+
+    Example Usage:
+        listing_files(folder = 'program_history/registrations/fall')
+    """
+    folder = relative_path(folder)
+    if global_params.storage_settings()['backend'] == 'local':
+        local_folder = local_root()/folder
+        if not local_folder.exists():
+            return []
+        return [dict(file_status(f'{folder}/{path.name}'), Name = path.name)
+                for path in sorted(local_folder.iterdir()) if path.is_file()]
+
+    # Sharepoint folder (shareplum)
+    folder_url = '/sites/EnrolmentDashboard/Shared%20Documents/' + folder.replace(' ', '%20')
+    files = custom_sharepoint.calling_sharepoint(lambda session: session['site'].Folder(folder_url).files, site = True)
+    return [{'Name': file['Name'],
+             'Length': file.get('Length'),
+             'TimeLastModified': file.get('TimeLastModified')} for file in files]
+
+
+@timing_storage
+def reading_file(path: str) -> bytes:
+    """
+    Reads a file from storage (Sharepoint, through its local download cache, or the local copy of Shared Documents).
+
+    Args:
+        path (str): file path, relative to Shared Documents (e.g. 'orders/order_fall.txt')
+
+    Returns:
+        byte content of the file
+
+    Example Usage:
+        reading_file(path = 'budgets/projections.xlsx')
+    """
+    path = relative_path(path)
+    if global_params.storage_settings()['backend'] == 'local':
+        return (local_root()/path).read_bytes()
+
+    return custom_sharepoint.downloading_sharepoint_file(sharepoint_file = '/sites/EnrolmentDashboard/Shared%20Documents/' + path.replace(' ', '%20'))
+
+
+@timing_storage
+def writing_file(path: str,
+                 content: bytes):
+    """
+    Writes a file to storage (Sharepoint, in chunks when large, or the local copy of Shared Documents).
+
+    Args:
+        path (str): file path, relative to Shared Documents (e.g. 'orders/order_fall.txt')
+        content (bytes): content of the file
+
+    Returns:
+        None
+
+    Example Usage:
+        writing_file(path = 'DashboardInput_fall.xlsx', content = content)
+    """
+    path = relative_path(path)
+    if global_params.storage_settings()['backend'] == 'local':
+        local_file = local_root()/path
+        local_file.parent.mkdir(parents = True, exist_ok = True)
+        temporary = local_file.with_name(local_file.name + '.tmp')
+        temporary.write_bytes(content)
+        os.replace(temporary, local_file)
+        return None
+
+    folder, _, file_name = path.rpartition('/')
+    custom_sharepoint.uploading_file(file_content = content,
+                                     file_name = file_name,
+                                     folder_url = f'Shared Documents/{folder}')
+    return None
+
+
+def writing_changed_file(path: str,
+                         content: bytes) -> bool:
+    """
+    Writes a file to storage only if it is unchanged on both sides since the last time it was written from here: a
+    local manifest (<cache_folder>/uploads.json) keeps the hash of every written file and its size and last modified
+    date in storage right after the write. A different content, or a file edited, replaced or deleted in storage since
+    then, is written again.
+
+    Args:
+        path (str): file path, relative to Shared Documents (e.g. 'orders/order_fall.txt')
+        content (bytes): content of the file
+
+    Returns:
+        True if the file was written, False if it was unchanged
+
+    Example Usage:
+        writing_changed_file(path = 'orders/order_fall.txt', content = content)
+    """
+    path = relative_path(path)
+    manifest_path = Path(global_params.transfer_settings()['cache_folder'])/'uploads.json'
+    key = f"{global_params.storage_settings()['backend']}:{path}"
+    digest = hashlib.sha256(content).hexdigest()
+    with _manifest_lock:
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    written = manifest.get(key)
+    if isinstance(written, dict) and written.get('sha256') == digest:
+        # Same content as last written, checking nobody changed the file in storage since
+        status = file_status(path)
+        if status is not None and status == written.get('status'):
+            print(f'[Info] {path} unchanged, not uploaded.')
+            return False
+
+    writing_file(path = path, content = content)
+    status = file_status(path)
+    with _manifest_lock:
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        manifest[key] = {'sha256': digest, 'status': status}
+        manifest_path.parent.mkdir(parents = True, exist_ok = True)
+        manifest_path.write_text(json.dumps(manifest))
+    return True
+
+
+def file_status(path: str) -> dict:
+    """
+    Gets size and last modified date of a file in storage.
+
+    Args:
+        path (str): file path, relative to Shared Documents
+
+    Returns:
+        dictionary with Length (bytes) and TimeLastModified (ISO date), or None when there is no such file
+
+    Example Usage:
+        file_status(path = 'orders/order_fall.txt')
+    """
+    path = relative_path(path)
+    if global_params.storage_settings()['backend'] == 'local':
+        local_file = local_root()/path
+        if not local_file.is_file():
+            return None
+        status = local_file.stat()
+        return {'Length': status.st_size,
+                'TimeLastModified': datetime.fromtimestamp(status.st_mtime, tz = timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    folder, _, file_name = path.rpartition('/')
+    for file in listing_files(folder):
+        if file['Name'] == file_name:
+            return {'Length': file['Length'], 'TimeLastModified': file['TimeLastModified']}
+    return None
@@ -0,0 +1,24 @@
+import pandas
+import numpy
+from enrolment_utils import analog_forecast
+
+
+def test_analog_forecasting_programs():
+    """Test the analog engine on a program that reaches half of its final registrations at mid cycle every year."""
+    dates = pandas.date_range('2021-09-21', '2024-03-21')
+    start = dates.map(lambda d: pandas.Timestamp(d.year if d.month * 100 + d.day >= 921 else d.year - 1, 9, 21))
+    share = numpy.minimum((dates - start).days / 182.0, 1.0)
+    final = numpy.where(start.year == 2022, 100, 120)
+    history = pandas.DataFrame({'ds': dates, 'y': numpy.round(share * final)})
+    # Current cycle (2024F) is at mid cycle with 50 registrations
+    history.loc[history['ds'] >= '2023-09-21', 'y'] = numpy.round(share[history['ds'] >= '2023-09-21'] * 100)
+
+    result = analog_forecast.analog_forecasting_programs(jobs = [{'program': 'ACTG',
+                                                                  'dataframe': history,
+                                                                  'target_value': 150,
+                                                                  'term': '2024F'}],
+                                                         years = 2)
+
+    assert result['program'].tolist() == ['ACTG']
+    assert result['projected_regs'].iloc[0] == 100
+    assert result['probability'].iloc[0] == 0
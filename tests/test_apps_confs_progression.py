@@ -7,7 +7,7 @@ import pandas
 from pandas._testing import assert_frame_equal
 import pyodbc
 import python_utils
-from enrolment_utils import apps_confs_progression, probs_target_utils
+from enrolment_utils import apps_confs_progression, probs_target_utils, storage
 
 
 @pytest.fixture
@@ -152,4 +152,32 @@ def test_building_program_record_confs(mock_cnxn, mock_dates_dict, mock_dates_li
         mock_retrieve.assert_any_call(program='ACTG',
                                       term='2023F', 
                                       date=date, 
-                                      cnxn=mock_cnxn)
\ No newline at end of file
+                                      cnxn=mock_cnxn)
+
+def test_compiling_historical_college(tmp_path, mocker):
+    # Setup mocks: two program files within the storage folder (local backend)
+    shared_documents = tmp_path/'Shared Documents'
+    history_folder = shared_documents/'program_history'/'applications'/'fall'
+    history_folder.mkdir(parents=True)
+    (history_folder/'ACTG.txt').write_bytes(b'ds\ty\tterm\n2024-01-01\t5\t2024F\n')
+    (history_folder/'BGEN.txt').write_bytes(b'ds\ty\tterm\n2024-01-01\t7\t2024F\n')
+    transfer_settings = dict(apps_confs_progression.global_params.transfer_settings(), max_workers=2, cache_folder=str(tmp_path/'cache'))
+    mocker.patch.object(apps_confs_progression.global_params, 'transfer_settings', return_value=transfer_settings)
+    mocker.patch.object(apps_confs_progression.global_params, 'storage_settings', return_value={'backend': 'local', 'local_folder': str(shared_documents)})
+    mocker.patch.object(apps_confs_progression.global_params, 'program_school_dict', return_value={'ACTG': 'Business', 'BGEN': 'Business'})
+    reading_file = mocker.spy(storage, 'reading_file')
+    terms = ['2020F', '2021F', '2022F', '2023F', '2024F']
+
+    # Call the function under test
+    result_df = apps_confs_progression.compiling_historical_college(terms=terms, folder='applications')
+
+    # Assert all programs are compiled, in listing order, with their school
+    assert list(result_df['program']) == ['ACTG', 'BGEN']
+    assert list(result_df['y']) == [5, 7]
+    assert list(result_df['lambton_school']) == ['Business', 'Business']
+    assert reading_file.call_count == 2
+
+    # Unchanged files are taken from the local cache on the next run
+    result_df = apps_confs_progression.compiling_historical_college(terms=terms, folder='applications')
+    assert list(result_df['y']) == [5, 7]
+    assert reading_file.call_count == 2
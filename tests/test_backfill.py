@@ -0,0 +1,88 @@
+import pandas
+import pytest
+from enrolment_utils import apps_confs_progression, backfill, global_params, probs_target_utils, python_utils
+
+
+DATES = {'2023F': {'start_date': '2022-09-21', 'end_date': '2022-10-20'},
+         '2024F': {'start_date': '2023-09-21', 'end_date': '2023-09-30'}}
+
+
+def test_creating_partitions(monkeypatch):
+    """Test every program, term and day is covered once, in partitions of at most partition_days days."""
+    monkeypatch.setattr(probs_target_utils, 'creating_dates_per_term', lambda **kwargs: DATES)
+
+    partitions = backfill.creating_partitions(programs = ['ACTG', 'BGEN'], term = '2024F', start_year = 2022,
+                                              end_year = 2024, partition_days = 12)
+
+    assert [(partition['program'], partition['term'], len(partition['dates'])) for partition in partitions] == [
+        ('ACTG', '2023F', 12), ('ACTG', '2023F', 12), ('ACTG', '2023F', 6), ('ACTG', '2024F', 10),
+        ('BGEN', '2023F', 12), ('BGEN', '2023F', 12), ('BGEN', '2023F', 6), ('BGEN', '2024F', 10)]
+    actg = [date for partition in partitions if partition['program'] == 'ACTG' for date in partition['dates']]
+    assert actg == (probs_target_utils.getting_individual_dates(start_date = '2022-09-21', end_date = '2022-10-20') +
+                    probs_target_utils.getting_individual_dates(start_date = '2023-09-21', end_date = '2023-09-30'))
+
+
+def test_backfill_resumes_from_checkpoints(tmp_path, monkeypatch):
+    """Test an interrupted backfill only pulls the partitions that were not checkpointed, and gives the full history."""
+    monkeypatch.setattr(probs_target_utils, 'creating_dates_per_term', lambda **kwargs: DATES)
+    monkeypatch.setattr(global_params, 'backfill_settings', lambda: {'max_workers': 2, 'partition_days': 12,
+                                                                     'checkpoint_folder': str(tmp_path/'backfill')})
+    monkeypatch.setattr(python_utils, 'get_connection', lambda: object())
+    pulled = []
+    failing = {'2022-10-15'}
+    def retrieving(program, term, date, cnxn):
+        if date in failing:
+            raise ConnectionError('production went away')
+        pulled.append((program, date))
+        return pandas.DataFrame({'date': [date], 'registrations': [int(date[-2:])]})
+    monkeypatch.setattr(apps_confs_progression, 'retrieving_regs_program_per_term_per_date', retrieving)
+    backfilling = lambda: backfill.backfilling_program_history(programs = ['ACTG'], term = '2024F', start_year = 2022,
+                                                               end_year = 2024, max_workers = 1, upload = False)
+
+    # Interrupted on the third partition (2022-10-15 to 2022-10-20), the others are checkpointed
+    with pytest.raises(ConnectionError):
+        backfilling()
+    assert len(list((tmp_path/'backfill'/'registrations'/'ACTG').glob('*.txt'))) == 3
+
+    # Resuming: only the missing partition is pulled
+    pulled.clear()
+    failing.clear()
+    history = backfilling()['ACTG']
+    assert [date for program, date in pulled] == probs_target_utils.getting_individual_dates(start_date = '2022-10-15',
+                                                                                              end_date = '2022-10-20')
+    assert history.columns.tolist() == ['ds', 'y']
+    assert len(history) == 40
+    assert history['ds'].tolist() == sorted(history['ds'].tolist())
+
+
+def test_backfill_running_term_keeps_one_checkpoint(tmp_path, monkeypatch):
+    """Test a day later only the growing partition of the running term is pulled again, over its own checkpoint."""
+    dates = {term: dict(days) for term, days in DATES.items()}
+    monkeypatch.setattr(probs_target_utils, 'creating_dates_per_term', lambda **kwargs: dates)
+    monkeypatch.setattr(global_params, 'backfill_settings', lambda: {'max_workers': 2, 'partition_days': 12,
+                                                                     'checkpoint_folder': str(tmp_path/'backfill')})
+    monkeypatch.setattr(python_utils, 'get_connection', lambda: object())
+    pulled = []
+    def retrieving(program, term, date, cnxn):
+        pulled.append(date)
+        return pandas.DataFrame({'date': [date], 'registrations': [int(date[-2:])]})
+    monkeypatch.setattr(apps_confs_progression, 'retrieving_regs_program_per_term_per_date', retrieving)
+    backfilling = lambda: backfill.backfilling_program_history(programs = ['ACTG'], term = '2024F', start_year = 2022,
+                                                               end_year = 2024, max_workers = 1, upload = False)
+    backfilling()
+
+    # Next day: the running term has one more day
+    pulled.clear()
+    dates['2024F']['end_date'] = '2023-10-01'
+    history = backfilling()['ACTG']
+
+    assert pulled == probs_target_utils.getting_individual_dates(start_date = '2023-09-21', end_date = '2023-10-01')
+    assert sorted(path.name for path in (tmp_path/'backfill'/'registrations'/'ACTG').iterdir()) == [
+        '2023F_2022-09-21.txt', '2023F_2022-10-03.txt', '2023F_2022-10-15.txt', '2024F_2023-09-21.txt']
+    assert len(history) == 41
+    assert history['ds'].iloc[-1] == '2023-10-01'
+
+    # Same day again: nothing pulled
+    pulled.clear()
+    backfilling()
+    assert pulled == []
@@ -0,0 +1,43 @@
+import pandas
+import pytest
+from enrolment_utils import analog_forecast, backtest, probs_target_utils
+
+
+def writing_history(folder, program, previous_final, current):
+    """History file of a program: previous_final registrations until the 2023F cycle closed, current ever since."""
+    dates = pandas.date_range('2023-09-01', '2024-09-20')
+    dataframe = pandas.DataFrame({'ds': dates.strftime('%Y-%m-%d'), 'y': [previous_final if date <= pandas.Timestamp('2023-09-20') else current
+                                                                           for date in dates]})
+    dataframe.to_csv(folder/f'{program}.txt', sep = '\t', index = False)
+
+
+def test_backtesting_forecasts_scores(tmp_path, monkeypatch):
+    """Test every engine is scored against the actual end of cycle: MAE of projections, Brier score of probabilities."""
+    # ACTG ends with 30 against a target of 10 (reached), BGEN with 5 against 20 (not reached)
+    writing_history(tmp_path, 'ACTG', previous_final = 10, current = 30)
+    writing_history(tmp_path, 'BGEN', previous_final = 20, current = 5)
+    forecasting = lambda job: {'program': job['program'], 'probability': 0.75, 'projected_regs': job['dataframe']['y'].iloc[-1] + 5}
+    monkeypatch.setattr(analog_forecast, 'analog_forecasting_programs', lambda jobs: pandas.DataFrame([forecasting(job) for job in jobs]))
+    as_of_dates = []
+    monkeypatch.setattr(probs_target_utils, 'fitting_program_model', lambda program, dataframe, term, store: dataframe)
+    def predicting_program(program, model, dataframe, target_value, term, as_of):
+        # History cut at the replayed date
+        assert dataframe['ds'].max() == as_of
+        as_of_dates.append(as_of)
+        return pandas.DataFrame({'program': program, 'probability': 1.0, 'projected_regs': 30}, index = [0])
+    monkeypatch.setattr(probs_target_utils, 'predicting_program', predicting_program)
+
+    detail, summary = backtest.backtesting_forecasts(term = '2024F', history_folder = str(tmp_path), frequency_days = 120)
+
+    # Replayed on 2024-01-19, 2024-05-18 and 2024-09-15, histories cut at those dates
+    assert sorted(set(detail['as_of_date'])) == list(pandas.to_datetime(['2024-01-19', '2024-05-18', '2024-09-15']))
+    assert sorted(set(as_of_dates)) == sorted(set(detail['as_of_date']))
+    assert detail['target'].tolist() == [10, 20] * 6
+    summary = summary.set_index('engine')
+    assert summary.loc['analog', 'forecasts'] == 6
+    # Analog: 35 against 30 and 10 against 5; (0.75 - 1)² and (0.75 - 0)²
+    assert summary.loc['analog', 'mae'] == pytest.approx(5)
+    assert summary.loc['analog', 'brier'] == pytest.approx((0.0625 + 0.5625) / 2)
+    # Prophet: 30 against 30 and 25; (1 - 1)² and (1 - 0)²
+    assert summary.loc['prophet', 'mae'] == pytest.approx(12.5)
+    assert summary.loc['prophet', 'brier'] == pytest.approx(0.5)
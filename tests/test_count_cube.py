@@ -0,0 +1,152 @@
+import pytest
+import pandas
+from pandas._testing import assert_frame_equal
+from enrolment_utils import count_cube, data_manipulation_as_of, queries_as_of, global_params
+
+
+TODAY = pandas.Timestamp.today().normalize()
+AS_OF = TODAY - pandas.DateOffset(years=1)
+TERMS = [f'{TODAY.year - 1}F', f'{TODAY.year}F']
+nan = float('nan')
+
+
+def day(offset):
+    """Day relative to today one year back (as of date of the past term)."""
+    return AS_OF + pandas.Timedelta(days=offset)
+
+
+@pytest.fixture
+def application_history():
+    """Fixture with the status history of applications (POS 1 being the latest status)."""
+    rows = [
+        # Offer as of date, confirmed later
+        (1, 10, 'ACTG', 1, 1, 'CCC', day(5), 1, 1), (1, 10, 'ACTG', 1, 1, 'ACC', day(-20), 2, 1), (1, 10, 'ACTG', 1, 1, 'APP', day(-60), 3, 1),
+        # DNA as of date, accepted after it (PreviousStatuses holds the full history)
+        (2, 11, 'ACTG', None, 2, 'ACU', day(3), 1, 1), (2, 11, 'ACTG', None, 2, 'DNA', day(-10), 2, 1), (2, 11, 'ACTG', None, 2, 'APP', day(-40), 3, 1),
+        # Confirmed applicant without preferred address
+        (3, 12, 'BGEN', 1, 1, 'CCC', day(-5), 1, 0), (3, 12, 'BGEN', 1, 1, 'ACC', day(-30), 2, 0),
+        # Returning student, holds and waitlist
+        (4, 13, 'BGEN', 2, 1, 'HLD', day(-2), 1, 1), (4, 13, 'BGEN', 2, 1, 'APP', day(-50), 2, 1),
+        (5, 14, 'ACTG', 1, 3, 'WTL', day(0), 1, 1), (5, 14, 'ACTG', 1, 3, 'ACU', day(-15), 2, 1),
+        # Withdrawn, and an application starting after the as of date
+        (6, 15, 'BGEN', 1, 1, 'WAP', day(-1), 1, 1), (6, 15, 'BGEN', 1, 1, 'ACC', day(-25), 2, 1),
+        (7, 16, 'ACTG', 1, 1, 'APP', day(2), 1, 1),
+    ]
+    return pandas.DataFrame(rows, columns=['Application_ID', 'Applicant_ID', 'Program', 'Level', 'Choice',
+                                           'Status', 'Status_Date', 'Pos', 'Has_Address'])
+
+
+@pytest.fixture
+def registration_history():
+    """Fixture with the status history of CTRL courses."""
+    rows = [
+        (1, 20, 'ACTG', '01', 'CA', 'F', 'A', day(-3), 1), (1, 20, 'ACTG', '01', 'CA', 'F', 'P', day(-30), 2),
+        (2, 21, 'ACTG', '01', 'SV', 'O', 'N', day(-8), 1),
+        (3, 22, 'ACTG', None, 'CA', 'F', 'A', day(-9), 1),
+        (4, 23, 'BGEN', '02', 'SV', 'F', 'A', day(-4), 1),
+        (5, 24, 'BGEN', '01', 'CA', 'P', 'A', day(-6), 1),
+        (6, 25, 'BGEN', '01', 'CA', 'F', 'W', day(-2), 1), (6, 25, 'BGEN', '01', 'CA', 'F', 'A', day(-20), 2),
+        (7, 26, 'ACTG', '01', 'CA', 'F', 'A', day(4), 1),
+    ]
+    return pandas.DataFrame(rows, columns=['Cred_ID', 'student_id', 'program', 'AAL', 'imm_status', 'current_load',
+                                           'status', 'status_date', 'pos'])
+
+
+@pytest.fixture
+def returning_students():
+    """Fixture with ReturningStudentsQuery as of today: one row per registration, payment and sponsorship."""
+    nat = pandas.NaT
+    ro_date = lambda offset: day(offset).strftime('%Y-%m-%dT%H:%M:%S') + ' '
+    rows = [
+        # Sponsored in ACTG first (query order), paid in BGEN earlier: counted in ACTG
+        (30, 'ACTG', '01', 'SP1', day(-5), 'CA', None, None, nan, nat),
+        (30, 'BGEN', '01', None, nat, 'CA', None, None, 50.0, day(-20)),
+        # New in ACTG and returning in BGEN: counted in both splits
+        (31, 'ACTG', '01', None, nat, 'SV', None, None, 100.0, day(-15)),
+        (31, 'BGEN', '02', None, nat, 'SV', None, None, 100.0, day(-15)),
+        # RO flag not yet in the system discards the sponsorship
+        (32, 'ACTG', '01', 'SP2', day(-30), 'CA', 'RO ', ro_date(3), nan, nat),
+        # RO flag in the system
+        (33, 'BGEN', '01', None, nat, 'CA', 'RO ', ro_date(-7), nan, nat),
+        # Paid after the as of date, sponsored before it
+        (34, 'BGEN', '02', 'SP3', day(-12), 'CA', None, None, 200.0, day(6)),
+        # Small payment, and a payment after the as of date
+        (35, 'ACTG', '02', None, nat, 'CA', None, None, 5.0, day(-10)),
+        (36, 'ACTG', None, None, nat, 'SV', None, None, 500.0, day(8)),
+        (37, 'BGEN', '02', None, nat, 'SV', None, None, 500.0, day(-8)),
+    ]
+    return pandas.DataFrame(rows, columns=['Student ID', 'Program', 'AAL', 'SPONSORSHIP', 'SPONSOR_APPLIED',
+                                           'IMMIGRATION_STATUS', 'STNT', 'STNT_Date', 'Pay Amt', 'Pay Date'])
+
+
+def latest_statuses(history, key, date_column, pos_column, number):
+    """Statuses as of today k years back, as the queries pick them (lowest position dated on or before that day)."""
+    stat_date = TODAY - pandas.DateOffset(years=int(number))
+    history = history[history[date_column] <= stat_date].sort_values([key, pos_column])
+    return history.drop_duplicates(key, keep='first').reset_index(drop=True)
+
+
+def mocking_queries(monkeypatch, application_history, registration_history, returning_students):
+    """Replaces the queries by their result over the fixtures, for any term and number of years back."""
+    def applications(term, number, cnxn):
+        dataset = latest_statuses(application_history, 'Application_ID', 'Status_Date', 'Pos', number)
+        previous = application_history.sort_values('Pos').groupby('Application_ID')['Status'].agg(' '.join)
+        dataset['PreviousStatuses'] = dataset['Previous Statuses'] = dataset['Application_ID'].map(previous)
+        dataset['APPL_START_TERM'] = term
+        return dataset.rename(columns={'Status': 'Curr_Status'})
+
+    def registrations(term, number, cnxn):
+        dataset = latest_statuses(registration_history, 'Cred_ID', 'status_date', 'pos', number)
+        return dataset[dataset['status'].isin(['A', 'D', 'N'])].rename(columns={'status': 'curr_status'})
+
+    def deposits(term, number, cnxn):
+        # Payments made after the day are not joined; registrations without payment keep one row
+        stat_date = TODAY - pandas.DateOffset(years=int(number))
+        paid_later = returning_students['Pay Date'] > stat_date
+        dataset = returning_students.copy()
+        dataset.loc[paid_later, ['Pay Amt', 'Pay Date']] = [nan, pandas.NaT]
+        return dataset
+
+    with_address = lambda query: lambda term, number, cnxn: query(term, number, cnxn).query('Has_Address == 1')
+    monkeypatch.setattr(queries_as_of, 'OffersQuery', with_address(applications))
+    monkeypatch.setattr(queries_as_of, 'ConfirmationsQuery', with_address(applications))
+    monkeypatch.setattr(queries_as_of, 'TableauQuery', applications)
+    monkeypatch.setattr(queries_as_of, 'FirstApplicationsQuery', applications)
+    monkeypatch.setattr(queries_as_of, 'xstl_query_term_level_campus', registrations)
+    monkeypatch.setattr(queries_as_of, 'ReturningStudentsQuery', deposits)
+    monkeypatch.setattr(queries_as_of, 'ApplicationStatusHistoryQuery', lambda term, cnxn: application_history)
+    monkeypatch.setattr(queries_as_of, 'RegistrationStatusHistoryQuery', lambda term, cnxn: registration_history)
+
+
+@pytest.mark.parametrize('builder, kwargs', [
+    (data_manipulation_as_of.FirstApplications, {}),
+    (data_manipulation_as_of.Offers, {}),
+    (data_manipulation_as_of.TableauOutstandingOffers, {}),
+    (data_manipulation_as_of.TableauHolds, {}),
+    (data_manipulation_as_of.TableauWithdrawals, {}),
+    (data_manipulation_as_of.TableauWaitlist, {}),
+    (data_manipulation_as_of.confirmations, {}),
+    (data_manipulation_as_of.term_deposits, {'aal01': True}),
+    (data_manipulation_as_of.term_deposits, {'aal01': False}),
+    (data_manipulation_as_of.registrations, {'aal01': True}),
+    (data_manipulation_as_of.registrations, {'aal01': False}),
+    (data_manipulation_as_of.total_registrations, {}),
+])
+def test_count_cube_matches_builders(tmp_path, monkeypatch, application_history, registration_history,
+                                     returning_students, builder, kwargs):
+    """Test every sheet gives the same numbers from the count cube as from the as of queries."""
+    mocking_queries(monkeypatch, application_history, registration_history, returning_students)
+    order = pandas.DataFrame({'Program': ['ACTG', 'BGEN']})
+
+    # Without cube, past term from the queries
+    monkeypatch.setattr(global_params, 'count_cube_settings', lambda: {'cube_folder': str(tmp_path/'empty'), 'days': 730})
+    count_cube._loaded_cubes.clear()
+    expected = builder(order=order.copy(), terms=TERMS, cnxn=None, **kwargs)
+
+    # With cube, past term from the cube
+    monkeypatch.setattr(global_params, 'count_cube_settings', lambda: {'cube_folder': str(tmp_path/'cube'), 'days': 730})
+    count_cube.building_count_cube(term=TERMS[0], cnxn=object())
+    assert count_cube.count_cube_lookup(term=TERMS[0], k=1, metric='Offers', column_name='Offers') is not None
+    result = builder(order=order.copy(), terms=TERMS, cnxn=None, **kwargs)
+
+    assert_frame_equal(result, expected, check_dtype=False)
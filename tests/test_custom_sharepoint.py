@@ -0,0 +1,437 @@
+import json
+import os
+import threading
+import time
+import pytest
+import requests
+from enrolment_utils import custom_sharepoint, global_params
+
+
+def test_parsing_side_file():
+    """Test budget files are read with their schema: Program index, integer budget, last row of a program kept."""
+    byte_content = b'Program\tBudget\nACTG\t120\nBGEN\t\nNURS\t45.0\nACTG\t10\n'
+
+    budget = custom_sharepoint.parsing_side_file(byte_content = byte_content,
+                                                 schema = global_params.side_files_schema()['budgets'])
+
+    assert budget.index.tolist() == ['ACTG', 'BGEN', 'NURS']
+    assert str(budget.index.dtype) == 'category'
+    assert str(budget['Budget'].dtype) == 'int64'
+    assert budget['Budget'].tolist() == [10, 0, 45]
+
+
+def test_program_school_dict_last_row_wins(monkeypatch):
+    """Test a program listed twice in the order file gets the school of its last row, as with a dictionary built row by row."""
+    byte_content = b'Program\tSchool\nACTG\tBusiness\nNURS\tHealth\nACTG\tFinance\n'
+    order = custom_sharepoint.parsing_side_file(byte_content = byte_content,
+                                                schema = global_params.side_files_schema()['orders'])
+    monkeypatch.setattr(custom_sharepoint, 'loading_side_file', lambda **kwargs: order)
+
+    assert list(global_params.program_school_dict(file_name = 'order_fall.txt').items()) == [('ACTG', 'Finance'), ('NURS', 'Health')]
+
+
+def test_calling_sharepoint_backs_off_when_throttled(monkeypatch):
+    """Test throttled requests are retried after the Retry-After delay and counted for the run."""
+    custom_sharepoint.starting_sharepoint_session()
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {})
+    monkeypatch.setattr(custom_sharepoint.time, 'sleep', lambda seconds: None)
+
+    throttled = requests.Response()
+    throttled.status_code = 429
+    throttled.headers['Retry-After'] = '3'
+    answers = [requests.HTTPError(response = throttled), 'content']
+    def operation(session):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    assert custom_sharepoint.calling_sharepoint(operation) == 'content'
+    statistics = custom_sharepoint.sharepoint_request_statistics()
+    assert statistics['requests'] == 2
+    assert statistics['retries'] == 1
+    assert statistics['throttled_seconds'] > 2
+
+
+def test_spent_budget_skips_optional_transfers(monkeypatch):
+    """Test requests past the budget still go through, while optional transfers are skipped."""
+    custom_sharepoint.starting_sharepoint_session()
+    settings = dict(global_params.transfer_settings(), request_budget = 1)
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {})
+
+    assert custom_sharepoint.calling_sharepoint(lambda session: 'first') == 'first'
+    assert custom_sharepoint.sharepoint_budget_spent()
+    assert custom_sharepoint.calling_sharepoint(lambda session: 'second') == 'second'
+
+    uploads = []
+    skipped = custom_sharepoint.submitting_optional_transfer(uploads.append, 'registrations/BGEN.txt')
+    assert custom_sharepoint.waiting_transfers([skipped]) == [None]
+    assert uploads == []
+    assert custom_sharepoint.sharepoint_request_statistics()['requests'] == 2
+
+
+class FakeLogin:
+    """Office365 login stand-in: every login gives a new client context, numbered in the order of the logins."""
+
+    def __init__(self, monkeypatch, pause = 0):
+        self.contexts = []
+        self.pause = pause
+        login = self
+        class FakeContext:
+            def __init__(self, url, auth):
+                self.web = None
+                login.contexts.append(self)
+            def load(self, web):
+                pass
+            def execute_query(self):
+                time.sleep(login.pause)
+        monkeypatch.setattr(custom_sharepoint, 'AuthenticationContext', lambda url: type('Auth', (), {'acquire_token_for_user': lambda self, user, password: None})())
+        monkeypatch.setattr(custom_sharepoint, 'ClientContext', FakeContext)
+        monkeypatch.setattr(custom_sharepoint.python_utils, 'load_credentials', lambda sharepoint: ('user', 'password'))
+
+
+def test_session_lifetime(monkeypatch):
+    """Test the session is reused for the run, and logged in again once older than session_lifetime."""
+    custom_sharepoint.starting_sharepoint_session()
+    login = FakeLogin(monkeypatch)
+    settings = dict(global_params.transfer_settings(), session_lifetime = 100)
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    clock = [1000.0]
+    monkeypatch.setattr(custom_sharepoint.time, 'monotonic', lambda: clock[0])
+
+    first = custom_sharepoint.getting_sharepoint_session()
+    clock[0] += 60
+    assert custom_sharepoint.getting_sharepoint_session()['ctx'] is first['ctx']
+    assert len(login.contexts) == 1
+
+    # Older than its lifetime: logging in again, files read during the run kept
+    first['files']['order_fall.txt'] = 'order'
+    clock[0] += 41
+    second = custom_sharepoint.getting_sharepoint_session()
+    assert second['ctx'] is login.contexts[1]
+    assert second['files'] == {'order_fall.txt': 'order'}
+    assert custom_sharepoint.getting_sharepoint_session()['ctx'] is second['ctx']
+
+    # New run: new session
+    custom_sharepoint.starting_sharepoint_session()
+    assert custom_sharepoint.getting_sharepoint_session()['ctx'] is login.contexts[2]
+
+
+def test_calling_sharepoint_logs_in_again_once(monkeypatch):
+    """Test an authentication error refreshes the session and tries once more, a second one in a row is raised."""
+    custom_sharepoint.starting_sharepoint_session()
+    login = FakeLogin(monkeypatch)
+    expired = requests.Response()
+    expired.status_code = 401
+    used = []
+    def operation(session):
+        used.append(session['ctx'])
+        if len(used) < 2:
+            raise requests.HTTPError(response = expired)
+        return 'content'
+
+    assert custom_sharepoint.calling_sharepoint(operation) == 'content'
+    assert used == login.contexts
+    assert len(used) == 2
+
+    def rejected(session):
+        used.append(session['ctx'])
+        raise requests.HTTPError(response = expired)
+    with pytest.raises(requests.HTTPError):
+        custom_sharepoint.calling_sharepoint(rejected)
+    assert len(used) == 4
+    assert len(login.contexts) == 3
+
+
+def test_session_refreshed_while_in_use(monkeypatch):
+    """Test a session in use by one transfer stays whole while another transfer logs in again."""
+    custom_sharepoint.starting_sharepoint_session()
+    login = FakeLogin(monkeypatch, pause = 0.001)
+    session = custom_sharepoint.getting_sharepoint_session()
+    errors = []
+    refreshing = threading.Event()
+
+    def reading():
+        while not refreshing.is_set():
+            try:
+                current = custom_sharepoint.getting_sharepoint_session()
+                assert set(current) == {'url', 'ctx', 'files', 'created_at'}
+                current['ctx']
+            except Exception as e:
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target = reading)
+    reader.start()
+    for _ in range(50):
+        custom_sharepoint.getting_sharepoint_session(refresh = True)
+    refreshing.set()
+    reader.join()
+
+    assert errors == []
+    # The session a transfer got is its own: still the first login
+    assert session['ctx'] is login.contexts[0]
+    assert len(login.contexts) == 51
+
+
+def test_requests_get_the_request_timeout(monkeypatch):
+    """Test requests of the Sharepoint clients get the request timeout, unless they set one."""
+    calls = []
+    monkeypatch.setattr(requests, 'post', lambda url, **kwargs: calls.append(kwargs.get('timeout')))
+    settings = dict(global_params.transfer_settings(), request_timeout = 42)
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+
+    custom_sharepoint.office365.runtime.client_request.requests.post('https://sharepoint/_api/web')
+    custom_sharepoint.shareplum.office365.requests.post('https://login', timeout = 5)
+
+    assert calls == [42, 5]
+
+
+def test_waiting_transfers_follows_progress(monkeypatch):
+    """Test a long transfer sending requests is waited for, while a transfer sending none is given up and stopped."""
+    custom_sharepoint.starting_sharepoint_session()
+    settings = dict(global_params.transfer_settings(), request_timeout = 0.2)
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {})
+    requests_sent = {'long': 0, 'stuck': 0}
+    def transferring(name, pause, count):
+        for i in range(count):
+            custom_sharepoint.calling_sharepoint(lambda session: requests_sent.__setitem__(name, requests_sent[name] + 1))
+            time.sleep(pause)
+        return name
+
+    # Ten times the request timeout in total, a request every half request timeout
+    long = custom_sharepoint.submitting_transfer(transferring, 'long', 0.1, 20)
+    assert custom_sharepoint.waiting_transfers([long]) == ['long']
+    assert requests_sent['long'] == 20
+
+    # No request for fifteen times the request timeout: given up, and no request sent after
+    stuck = custom_sharepoint.submitting_transfer(transferring, 'stuck', 3, 2)
+    with pytest.raises(TimeoutError):
+        custom_sharepoint.waiting_transfers([stuck])
+    with pytest.raises(TimeoutError):
+        stuck.result(timeout = 10)
+    assert requests_sent['stuck'] == 1
+
+
+class FakeDownloads:
+    """Sharepoint stand-in for downloads: answers with the next of its answers, keeping the headers of every request."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.headers = []
+
+    def service_root_url(self):
+        return 'https://sharepoint/_api'
+
+    def pending_request(self):
+        return self
+
+    def execute_request_direct(self, request):
+        self.headers.append(dict(request.headers))
+        status_code, content, headers = self.answers.pop(0)
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers)
+        return response
+
+
+def test_downloading_file_through_cache(tmp_path, monkeypatch):
+    """Test the second download is conditional, a 304 gives the local copy untouched, a changed file refreshes it."""
+    custom_sharepoint.starting_sharepoint_session()
+    settings = dict(global_params.transfer_settings(), cache_folder = str(tmp_path))
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    fake = FakeDownloads(answers = [(200, b'first', {'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jul 2024 10:00:00 GMT'}),
+                                    (304, b'', {}),
+                                    (200, b'second', {'ETag': '"2"', 'Last-Modified': 'Tue, 02 Jul 2024 10:00:00 GMT'})])
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {'ctx': fake})
+    downloading = lambda: custom_sharepoint.downloading_sharepoint_file(sharepoint_file = '/sites/EnrolmentDashboard/Shared%20Documents/projections.xlsx')
+    local_file = tmp_path/'sharepoint'/'sites'/'EnrolmentDashboard'/'Shared Documents'/'projections.xlsx'
+
+    # First download: nothing to validate against
+    assert downloading() == b'first'
+    assert fake.headers[0] == {}
+    assert local_file.read_bytes() == b'first'
+
+    # Second download: conditional, answered 304 with the local copy, which is not written again
+    os.utime(local_file, ns = (0, 0))
+    assert downloading() == b'first'
+    assert fake.headers[1] == {'If-None-Match': '"1"', 'If-Modified-Since': 'Mon, 01 Jul 2024 10:00:00 GMT'}
+    assert local_file.stat().st_mtime_ns == 0
+    assert custom_sharepoint.sharepoint_cache_statistics() == {'hits': 1, 'misses': 1, 'bytes_saved': 5}
+
+    # Changed file: local copy and validators refreshed, no temporary file left
+    assert downloading() == b'second'
+    assert local_file.read_bytes() == b'second'
+    assert fake.answers == []
+    manifest = json.loads((tmp_path/'sharepoint'/'manifest.json').read_text())
+    assert manifest['/sites/EnrolmentDashboard/Shared%20Documents/projections.xlsx']['ETag'] == '"2"'
+    assert list(tmp_path.rglob('*.tmp')) == []
+
+
+class FakeSharepoint:
+    """Minimal Sharepoint context for uploads: files, upload sessions and a failure to inject after a step."""
+
+    def __init__(self, fail_after = None):
+        self.files = {}
+        self.sessions = {}
+        self.queries = []
+        self.fail_after = fail_after
+        self.web = self
+
+    def get_folder_by_server_relative_url(self, folder_url):
+        fake = self
+        class Folder:
+            def upload_file(self, file_name, content):
+                fake.queries.append(('upload', '/sites/EnrolmentDashboard/' + folder_url.strip('/') + '/' + file_name, content))
+        return Folder()
+
+    def get_file_by_server_relative_url(self, file_url):
+        fake = self
+        class Result:
+            value = None
+            properties = {}
+        class File:
+            url = file_url
+            properties = {}
+            def start_upload(self, upload_id, chunk):
+                return fake.queueing(('start', file_url, upload_id, 0, chunk))
+            def continue_upload(self, upload_id, offset, chunk):
+                return fake.queueing(('continue', file_url, upload_id, offset, chunk))
+            def finish_upload(self, upload_id, offset, chunk):
+                return fake.queueing(('finish', file_url, upload_id, offset, chunk))
+            def get_upload_status(self, upload_id):
+                return fake.queueing(('status', file_url, upload_id))
+            def moveto(self, new_url, flag):
+                fake.queueing(('move', file_url, new_url))
+            def delete_object(self):
+                fake.queueing(('delete', file_url))
+        fake.result_type = Result
+        return File()
+
+    def queueing(self, query):
+        result = self.result_type()
+        self.queries.append(query + (result,))
+        return result
+
+    def load(self, file, properties):
+        file.properties = {'Length': len(self.files.get(file.url, b''))}
+
+    def execute_query(self):
+        queries, self.queries = self.queries, []
+        for query in queries:
+            step = query[0]
+            if step == 'upload':
+                self.files[query[1]] = query[2]
+            elif step in ('start', 'continue', 'finish'):
+                _, file_url, upload_id, offset, chunk, result = query
+                if step != 'start' and self.sessions.get(upload_id) != offset:
+                    raise ValueError('Invalid upload session or offset')
+                if step == 'start' and upload_id in self.sessions:
+                    raise ValueError('Upload session already started')
+                self.files[file_url] = self.files[file_url][:offset] + chunk
+                self.sessions[upload_id] = offset + len(chunk)
+                result.value = offset + len(chunk)
+                if step == 'finish':
+                    del self.sessions[upload_id]
+            elif step == 'status':
+                if query[2] not in self.sessions:
+                    raise ValueError('No such upload session')
+                query[3].properties = {'ExpectedContentRange': f'{self.sessions[query[2]]}-'}
+            elif step == 'move':
+                self.files[query[2]] = self.files.pop(query[1])
+            elif step == 'delete':
+                self.files.pop(query[1], None)
+            if step == self.fail_after:
+                self.fail_after = None
+                raise requests.ConnectionError('Connection reset')
+
+
+def uploading_with(monkeypatch, fake, file_content):
+    """Runs uploading_file against a fake Sharepoint, with 10 bytes chunks above 16 bytes."""
+    settings = dict(global_params.transfer_settings(), chunk_threshold = 16, chunk_size = 10)
+    custom_sharepoint.starting_sharepoint_session()
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {'ctx': fake})
+    monkeypatch.setattr(custom_sharepoint.time, 'sleep', lambda seconds: None)
+    custom_sharepoint.uploading_file(file_content = file_content, file_name = 'DashboardInput_fall.xlsx')
+
+
+def test_uploading_file_single_request(monkeypatch):
+    """Test small files go in a single request."""
+    fake = FakeSharepoint()
+    uploading_with(monkeypatch, fake, b'small file')
+    assert fake.files == {'/sites/EnrolmentDashboard/Shared Documents/DashboardInput_fall.xlsx': b'small file'}
+
+
+@pytest.mark.parametrize('fail_after', [None, 'start', 'continue', 'finish'])
+def test_uploading_file_in_chunks(monkeypatch, fail_after):
+    """Test large files go in chunks to a temporary file moved over the target, resuming after a lost answer."""
+    fake = FakeSharepoint(fail_after = fail_after)
+    target = '/sites/EnrolmentDashboard/Shared Documents/DashboardInput_fall.xlsx'
+    fake.files[target] = b'previous report'
+    file_content = bytes(range(35))
+
+    uploading_with(monkeypatch, fake, file_content)
+
+    assert fake.files == {target: file_content}
+    assert fake.sessions == {}
+    assert custom_sharepoint.sharepoint_request_statistics()['retries'] == (fail_after is not None)
+
+
+def test_uploading_file_failure_keeps_target(monkeypatch):
+    """Test a failed chunked upload leaves the target as it was and removes the temporary file."""
+    fake = FakeSharepoint()
+    target = '/sites/EnrolmentDashboard/Shared Documents/DashboardInput_fall.xlsx'
+    fake.files[target] = b'previous report'
+    monkeypatch.setattr(custom_sharepoint, 'sending_chunk', lambda **kwargs: (_ for _ in ()).throw(ValueError('Bad chunk')))
+
+    with pytest.raises(ValueError):
+        uploading_with(monkeypatch, fake, bytes(range(35)))
+    assert fake.files == {target: b'previous report'}
+
+
+class SlowSharepoint(FakeSharepoint):
+    """Fake Sharepoint answering every request after a delay, throttling one chunk once (429 with Retry-After)."""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.throttled = False
+
+    def execute_query(self):
+        time.sleep(self.delay)
+        if not self.throttled and any(query[0] == 'continue' for query in self.queries):
+            self.throttled = True
+            self.queries = []
+            throttled = requests.Response()
+            throttled.status_code = 429
+            throttled.headers['Retry-After'] = '2'
+            raise requests.HTTPError(response = throttled)
+        super().execute_query()
+
+
+def test_slow_chunked_upload_as_transfer(monkeypatch):
+    """Test a chunked upload taking much longer than the request timeout, throttled once, is waited for as a transfer."""
+    fake = SlowSharepoint(delay = 0.3)
+    settings = dict(global_params.transfer_settings(), chunk_threshold = 16, chunk_size = 10, request_timeout = 0.5)
+    custom_sharepoint.starting_sharepoint_session()
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    monkeypatch.setattr(custom_sharepoint, 'getting_sharepoint_session', lambda **kwargs: {'ctx': fake})
+    file_content = bytes(range(120))
+
+    start = time.monotonic()
+    upload = custom_sharepoint.submitting_transfer(custom_sharepoint.sharepoint_upload,
+                                                   sharepoint_base_url = 'https://mylambton.sharepoint.com/sites/EnrolmentDashboard/',
+                                                   root = None,
+                                                   report_name = None,
+                                                   file_name = 'DashboardInput_fall.xlsx',
+                                                   file_content = file_content)
+    assert custom_sharepoint.waiting_transfers([upload]) == [None]
+
+    # Twelve chunks and the throttling wait: several times the request timeout
+    assert time.monotonic() - start > 8 * settings['request_timeout']
+    assert fake.files == {'/sites/EnrolmentDashboard/Shared Documents/DashboardInput_fall.xlsx': file_content}
+    assert custom_sharepoint.sharepoint_request_statistics()['retries'] == 1
@@ -0,0 +1,55 @@
+import pytest
+import pandas
+import numpy
+from enrolment_utils import data_manipulation_as_of_dates
+
+
+@pytest.fixture
+def mock_status_history():
+    """Fixture to mock the status history of two applications (POS 1 being the latest status)."""
+    return pandas.DataFrame({
+        'Application_ID': [1, 1, 1, 2, 2],
+        'Program': ['ACTG', 'ACTG', 'ACTG', 'ACTG', 'ACTG'],
+        'Level': [1, 1, 1, None, None],
+        'Choice': [1, 1, 1, 2, 2],
+        'Status': ['CCC', 'ACC', 'APP', 'DNA', 'ACU'],
+        'Status_Date': pandas.to_datetime(['2024-03-10', '2024-02-01', '2024-01-05', '2024-02-15', '2024-01-20']),
+        'Pos': [1, 2, 3, 1, 2],
+        'Has_Address': [1, 1, 1, 1, 1]
+    })
+
+
+def test_status_intervals(mock_status_history):
+    intervals = data_manipulation_as_of_dates.status_intervals(dataset=mock_status_history,
+                                                               key='Application_ID',
+                                                               date_column='Status_Date',
+                                                               pos_column='Pos')
+
+    # Oldest status first, each valid until the next one
+    assert list(intervals['Status']) == ['APP', 'ACC', 'CCC', 'ACU', 'DNA']
+    assert intervals.loc[0, 'valid_to'] == pandas.Timestamp('2024-02-01')
+    assert intervals.loc[2, 'valid_to'] == pandas.Timestamp.max.normalize()
+
+
+def test_counting_as_of_dates(mock_status_history):
+    intervals = data_manipulation_as_of_dates.status_intervals(dataset=mock_status_history,
+                                                               key='Application_ID',
+                                                               date_column='Status_Date',
+                                                               pos_column='Pos')
+    metrics = data_manipulation_as_of_dates.application_metrics(intervals)
+    dates = pandas.DatetimeIndex(['2024-01-01', '2024-01-20', '2024-02-20', '2024-03-10'])
+
+    offers = data_manipulation_as_of_dates.counting_as_of_dates(intervals=intervals,
+                                                                mask=metrics['Offers'],
+                                                                group_column='Program',
+                                                                groups=['ACTG', 'BGEN'],
+                                                                dates=dates)
+    confirmations = data_manipulation_as_of_dates.counting_as_of_dates(intervals=intervals,
+                                                                       mask=metrics['Confirmations'],
+                                                                       group_column='Program',
+                                                                       groups=['ACTG', 'BGEN'],
+                                                                       dates=dates)
+
+    # ACU on Jan 20 (offer), ACC on Feb 1 (offer), DNA after ACU on Feb 15 (still an offer), CCC on Mar 10
+    numpy.testing.assert_array_equal(offers, [[0, 1, 2, 1], [0, 0, 0, 0]])
+    numpy.testing.assert_array_equal(confirmations, [[0, 0, 0, 1], [0, 0, 0, 0]])
@@ -0,0 +1,104 @@
+import os
+import signal
+import threading
+import pandas
+from pathlib import Path
+from pandas._testing import assert_frame_equal
+from enrolment_utils import forecast_queue, global_params, probs_target_utils
+
+
+def test_payload_round_trip():
+    """Test job arguments come back from the queue payload with the same histories."""
+    history = pandas.DataFrame({'ds': pandas.to_datetime(['2024-01-01', '2024-01-02']), 'y': [3, 5]})
+    job = {'program': 'BGEN', 'dataframe': history, 'target_value': 40, 'term': '2024F'}
+
+    decoded = forecast_queue.decoding_payload(forecast_queue.encoding_payload(job))
+
+    assert {key: value for key, value in decoded.items() if key != 'dataframe'} == {'program': 'BGEN', 'target_value': 40, 'term': '2024F'}
+    assert_frame_equal(decoded['dataframe'], history)
+
+
+def test_claiming_job_after_lease_expires(tmp_path, monkeypatch):
+    """Test a job held past its lease is claimed again by another worker, and failed after max_attempts."""
+    settings = dict(global_params.forecasting_settings(), fit_timeout = 60, max_attempts = 2)
+    monkeypatch.setattr(global_params, 'forecasting_settings', lambda: settings)
+    clock = [1000.0]
+    monkeypatch.setattr(forecast_queue.time, 'time', lambda: clock[0])
+    history = pandas.DataFrame({'ds': ['2024-01-01'], 'y': [3]})
+
+    run_id = forecast_queue.enqueuing_forecasts(jobs = [{'program': 'BGEN', 'dataframe': history, 'target_value': 40, 'term': '2024F'}],
+                                                queue_folder = str(tmp_path))
+    queue = forecast_queue.connecting_queue(str(tmp_path))
+
+    # First worker claims the job, nobody else can take it while the lease holds
+    path, function, job = forecast_queue.claiming_job(queue = queue, worker = 'worker-1', run_id = run_id)
+    assert function == 'forecasting_program'
+    assert job['program'] == 'BGEN'
+    clock[0] += 30
+    assert forecast_queue.claiming_job(queue = queue, worker = 'worker-2', run_id = run_id) is None
+
+    # First worker died: once the lease expired the job is claimed again
+    clock[0] += 31
+    path = forecast_queue.claiming_job(queue = queue, worker = 'worker-2', run_id = run_id)[0]
+    claim = forecast_queue.parsing_job_file_name(path)
+    assert (claim['worker'], claim['attempts']) == ('worker-2', 2)
+
+    # Second lease expired too, the job has been tried max_attempts times
+    clock[0] += 61
+    assert forecast_queue.claiming_job(queue = queue, worker = 'worker-3', run_id = run_id) is None
+    assert [path.name.split('__')[0] for path in (queue/'failed').iterdir()] == [run_id]
+
+
+def test_claiming_jobs_from_two_connections(tmp_path):
+    """Test two workers, each with its own connection to the queue folder, never claim the same job and leave none."""
+    history = pandas.DataFrame({'ds': ['2024-01-01'], 'y': [3]})
+    jobs = [{'program': f'P{number:03d}', 'dataframe': history, 'target_value': 40, 'term': '2024F'} for number in range(60)]
+    run_id = forecast_queue.enqueuing_forecasts(jobs = jobs, queue_folder = str(tmp_path/'share'))
+    claims = {'worker-1': [], 'worker-2': []}
+    start = threading.Barrier(2)
+
+    def working(worker):
+        queue = forecast_queue.connecting_queue(str(tmp_path/'share'))
+        start.wait()
+        while True:
+            claimed = forecast_queue.claiming_job(queue = queue, worker = worker, run_id = run_id)
+            if claimed is None:
+                break
+            claims[worker].append(claimed[2]['program'])
+
+    threads = [threading.Thread(target = working, args = (worker,)) for worker in claims]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    claimed = claims['worker-1'] + claims['worker-2']
+    assert sorted(claimed) == [job['program'] for job in jobs]
+    assert len(list((tmp_path/'share'/'running').iterdir())) == 60
+
+
+def dying_forecast(program, target_value, marker, **kwargs):
+    """Forecasting function killing its worker the first time it runs (as a crashed host would), working afterwards."""
+    if not Path(marker).exists():
+        Path(marker).touch()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return pandas.DataFrame({'program': program, 'probability': 0.5, 'projected_regs': target_value}, index = [0])
+
+
+def test_job_of_killed_worker_is_completed(tmp_path, monkeypatch):
+    """Test a job whose worker is killed mid-job is taken again by a local worker once its lease expires."""
+    settings = dict(global_params.forecasting_settings(), fit_timeout = 1, queue_poll_seconds = 0.1, max_attempts = 3)
+    monkeypatch.setattr(global_params, 'forecasting_settings', lambda: settings)
+    monkeypatch.setattr(probs_target_utils, 'dying_forecast', dying_forecast, raising = False)
+    jobs = [{'program': program, 'target_value': 40, 'marker': str(tmp_path/'killed')} for program in ['ACTG', 'BGEN', 'NURS']]
+
+    forecasts = forecast_queue.queue_forecasting_programs(jobs = jobs,
+                                                          function = 'dying_forecast',
+                                                          local_workers = 2,
+                                                          timeout = 60,
+                                                          queue_folder = str(tmp_path/'queue'))
+
+    assert (tmp_path/'killed').exists()
+    assert forecasts['program'].tolist() == ['ACTG', 'BGEN', 'NURS']
+    assert forecasts['projected_regs'].tolist() == [40, 40, 40]
+    assert forecasts.attrs['failed'] == []
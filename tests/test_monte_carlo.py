@@ -0,0 +1,31 @@
+import numpy
+from enrolment_utils import monte_carlo
+
+
+def test_target_probabilities():
+    """Test probabilities and quantiles computed from simulated outcomes."""
+    outcomes = numpy.array([[90, 100, 110, 120],
+                            [10, 20, 30, 40]])
+
+    result = monte_carlo.target_probabilities(outcomes = outcomes,
+                                              targets = numpy.array([105, 50]),
+                                              current = numpy.array([95, 50]),
+                                              quantiles = [0.5])
+
+    # First program: 95 (floor at current), 100, 110 and 120 against 105. Second one already reached target
+    assert result['probability'].tolist() == [0.5, 1.0]
+    assert result['projected_p50'].tolist() == [105, 50]
+
+
+def test_simulating_outcomes_pooled_residuals():
+    """Test programs without residuals of their own draw from all programs residuals."""
+    residuals = numpy.array([[-0.5, 0.5],
+                             [numpy.nan, numpy.nan]])
+
+    outcomes = monte_carlo.simulating_outcomes(point = numpy.array([100, 10]),
+                                               residuals = residuals,
+                                               simulations = 50)
+
+    assert outcomes.shape == (2, 50)
+    assert set(outcomes[0]) <= {50, 150}
+    assert set(outcomes[1]) <= {5, 15}
@@ -0,0 +1,243 @@
+import json
+import time
+import pandas
+import pytest
+from datetime import datetime
+from pandas._testing import assert_frame_equal
+from enrolment_utils import analog_forecast, custom_sharepoint, global_params, monte_carlo, probs_target_utils
+
+
+def stub_forecast(program, target_value, **kwargs):
+    """Forecasting function standing for forecasting_program: hangs or fails for some programs."""
+    if program == 'HANG':
+        time.sleep(60)
+    if program == 'FAIL':
+        raise ValueError('fit did not converge')
+    return pandas.DataFrame({'program': program, 'probability': 0.5, 'projected_regs': target_value}, index = [0])
+
+
+def test_forecasting_programs_timeout_and_failure():
+    """Test a hanging fit and a failing one are reported with zeros and listed as failed, the others forecasted."""
+    jobs = [{'program': program, 'target_value': 40} for program in ['ACTG', 'HANG', 'FAIL', 'BGEN']]
+
+    start = time.monotonic()
+    forecasts = probs_target_utils.forecasting_programs(jobs = jobs,
+                                                        max_workers = 2,
+                                                        timeout = 1,
+                                                        function = stub_forecast)
+
+    assert time.monotonic() - start < 30
+    assert forecasts['program'].tolist() == ['ACTG', 'HANG', 'FAIL', 'BGEN']
+    assert forecasts['probability'].tolist() == [0.5, 0, 0, 0.5]
+    assert forecasts['projected_regs'].tolist() == [40, 0, 0, 40]
+    assert forecasts.attrs['failed'] == ['HANG', 'FAIL']
+
+
+class FakeProphet:
+    """Prophet stand-in: records fits and their initial values, parameters being the number of rows seen."""
+    fits = []
+
+    def __init__(self, mcmc_samples = 0, uncertainty_samples = 0):
+        self.uncertainty_samples = uncertainty_samples
+        self.params = None
+
+    def fit(self, dataframe, init = None):
+        if init is not None and init['k'] < 0:
+            raise RuntimeError('bad initial values')
+        FakeProphet.fits.append(init)
+        size = float(len(dataframe))
+        self.params = {'k': [[size]], 'm': [[0.0]], 'sigma_obs': [[1.0]], 'delta': [[0.0]], 'beta': [[0.0]]}
+        return self
+
+
+def fake_backend():
+    """Forecasting backend with FakeProphet and a JSON serialization of its parameters."""
+    def model_from_json(text):
+        model = FakeProphet()
+        model.params = json.loads(text)
+        return model
+    return {'Prophet': FakeProphet,
+            'model_to_json': lambda model: json.dumps(model.params),
+            'model_from_json': model_from_json}
+
+
+def test_fitting_program_model_store(tmp_path, monkeypatch):
+    """Test stored models are reused on the same data, warm start other fits, and are not reused across estimations."""
+    settings = dict(global_params.forecasting_settings(), model_folder = str(tmp_path/'models'))
+    monkeypatch.setattr(global_params, 'forecasting_settings', lambda: settings)
+    monkeypatch.setattr(probs_target_utils, 'loading_forecasting_backend', fake_backend)
+    monkeypatch.setattr(FakeProphet, 'fits', [])
+    history = pandas.DataFrame({'ds': pandas.date_range('2024-01-01', periods = 5), 'y': [1, 2, 3, 5, 8]})
+    fitting = lambda dataframe: probs_target_utils.fitting_program_model(program = 'BGEN', dataframe = dataframe, term = '2024F')
+
+    # Cold fit, stored under the term
+    fitting(history)
+    assert FakeProphet.fits == [None]
+    assert (tmp_path/'models'/'2024F'/'BGEN.json').exists()
+
+    # Same data: stored model reused, no fit
+    assert fitting(history).params['k'] == [[5.0]]
+    assert len(FakeProphet.fits) == 1
+
+    # New day of data: warm start from stored parameters, then stored
+    longer = pandas.concat([history, pandas.DataFrame({'ds': [pandas.Timestamp('2024-01-06')], 'y': [9]})])
+    fitting(longer)
+    assert FakeProphet.fits[-1]['k'] == 5.0
+    fitting(longer)
+    assert len(FakeProphet.fits) == 2
+
+    # Warm start failing: cold fit instead
+    stored = json.loads((tmp_path/'models'/'2024F'/'BGEN.json').read_text())
+    stored['fingerprint'] = 'other data'
+    stored['model'] = json.dumps({'k': [[-1.0]], 'm': [[0.0]], 'sigma_obs': [[1.0]], 'delta': [[0.0]], 'beta': [[0.0]]})
+    (tmp_path/'models'/'2024F'/'BGEN.json').write_text(json.dumps(stored))
+    assert fitting(longer).params['k'] == [[6.0]]
+    assert FakeProphet.fits[-1] is None
+
+    # Different estimation (MCMC instead of MAP): stored model not reused
+    settings['mcmc_samples'] = 300
+    fitting(longer)
+    assert len(FakeProphet.fits) == 4
+    assert FakeProphet.fits[-1]['k'] == 6.0
+
+
+def test_forecast_cache_key():
+    """Test the forecast key only changes when an input of the forecast changes."""
+    history = pandas.DataFrame({'ds': pandas.date_range('2024-01-01', periods = 3), 'y': [1, 2, 3]})
+    job = {'program': 'BGEN', 'dataframe': history, 'target_value': 40, 'term': '2024F'}
+    key = probs_target_utils.forecast_cache_key(job = job, engine = 'prophet')
+
+    assert probs_target_utils.forecast_cache_key(job = dict(job, dataframe = history.copy()), engine = 'prophet') == key
+    assert probs_target_utils.forecast_cache_key(job = dict(job, dataframe = history.assign(y = [1, 2, 4])), engine = 'prophet') != key
+    assert probs_target_utils.forecast_cache_key(job = dict(job, target_value = 41), engine = 'prophet') != key
+    assert probs_target_utils.forecast_cache_key(job = dict(job, term = '2025F'), engine = 'prophet') != key
+    assert probs_target_utils.forecast_cache_key(job = job, engine = 'analog') != key
+
+
+def test_forecast_cache_hit(tmp_path, monkeypatch):
+    """Test programs whose inputs did not change are taken from the forecast cache, changed ones forecasted again."""
+    settings = dict(global_params.forecasting_settings(), result_folder = str(tmp_path/'forecasts'), engine = 'analog')
+    monkeypatch.setattr(global_params, 'forecasting_settings', lambda: settings)
+    order = pandas.DataFrame({'School': ['Business', 'Business']}, index = pandas.Index(['ACTG', 'BGEN'], name = 'Program'))
+    monkeypatch.setattr(custom_sharepoint, 'loading_side_file', lambda **kwargs: order)
+    targets = {'ACTG': 40, 'BGEN': 25}
+    history = pandas.DataFrame({'ds': pandas.date_range('2024-01-01', periods = 3), 'y': [1, 2, 3]})
+    monkeypatch.setattr(probs_target_utils, 'preparing_program_forecast', lambda program, **kwargs: (history, targets[program]))
+    forecasted = []
+    def analog_forecasting_programs(jobs):
+        forecasted.append([job['program'] for job in jobs])
+        return pandas.DataFrame({'program': [job['program'] for job in jobs], 'probability': 0.5,
+                                 'projected_regs': [job['target_value'] for job in jobs]})
+    monkeypatch.setattr(analog_forecast, 'analog_forecasting_programs', analog_forecasting_programs)
+    monkeypatch.setattr(monte_carlo, 'adding_monte_carlo', lambda forecasts, jobs: forecasts.assign(projected_p10 = 1, projected_p50 = 2, projected_p90 = 3))
+    reporting = lambda: probs_target_utils.target_probability_report(term = '2024F', file_name_budget = 'budget_fall.txt',
+                                                                     file_name = 'order_fall.txt', budget = object(), cnxn = object())
+
+    first = reporting()
+    assert forecasted == [['ACTG', 'BGEN']]
+    assert probs_target_utils.reading_forecast_cache(term = '2024F')['BGEN']['projected_regs'] == 25
+
+    # Nothing changed: every program from the cache, same report
+    second = reporting()
+    assert len(forecasted) == 1
+    assert_frame_equal(second, first)
+
+    # Target of one program changed: only that one forecasted again
+    targets['BGEN'] = 30
+    third = reporting()
+    assert forecasted[-1] == ['BGEN']
+    assert third['projected_regs'].tolist() == [40, 30]
+
+
+class FakeFittedModel:
+    """Fitted model stand-in over a daily history: keeps the dates it is asked to predict, yhat being the day number."""
+
+    def __init__(self, start, end):
+        self.history = pandas.date_range(start, end)
+        self.predicted = None
+
+    def make_future_dataframe(self, periods):
+        return pandas.DataFrame({'ds': pandas.date_range(self.history[0], self.history[-1] + pandas.Timedelta(days = periods))})
+
+    def predict(self, future):
+        self.predicted = future['ds']
+        return pandas.DataFrame({'ds': future['ds'], 'yhat': (future['ds'] - self.history[0]).dt.days})
+
+
+@pytest.mark.parametrize('as_of, cutoff, horizon', [
+    # Far from the end of the cycle: from tomorrow to 15 days after September 20
+    (datetime(2024, 6, 1), '2024-06-01', 111 + 15),
+    # Close to the end of the cycle: the last two months are predicted as well
+    (datetime(2024, 9, 10), '2024-07-12', 60 + 10 + 15),
+])
+def test_predicting_horizon_after_cutoff(as_of, cutoff, horizon):
+    """Test only dates after the cutoff, up to the end of the cycle, are predicted."""
+    model = FakeFittedModel(start = '2023-09-21', end = as_of)
+
+    yhat = probs_target_utils.predicting_horizon(model = model, term = '2024F', as_of = as_of)
+
+    assert len(model.predicted) == horizon
+    assert model.predicted.min() == pandas.Timestamp(cutoff) + pandas.Timedelta(days = 1)
+    assert model.predicted.max() == pandas.Timestamp('2024-10-05')
+    assert len(yhat) == horizon
+
+
+def test_school_forecasting_programs(monkeypatch):
+    """Test programs are forecasted with one model per school, allocated by historical shares, back in jobs order."""
+    fitted = {}
+    def fitting_program_model(program, dataframe, term):
+        fitted[program] = dataframe
+        return program
+    monkeypatch.setattr(probs_target_utils, 'fitting_program_model', fitting_program_model)
+    # School forecast over the horizon
+    monkeypatch.setattr(probs_target_utils, 'predicting_horizon', lambda model, term: pandas.Series([20.0, 40.0]))
+    def forecasting_programs(jobs, max_workers, function):
+        # Schools one after the other instead of a pool, the school of NURS failing
+        frames = [function(**job) for job in jobs if job['school'] != 'Health']
+        frames.append(pandas.DataFrame({'program': ['NURS'], 'probability': 0, 'projected_regs': 0}))
+        forecasts = pandas.concat(frames)
+        forecasts.attrs['failed'] = ['NURS']
+        return forecasts
+    monkeypatch.setattr(probs_target_utils, 'forecasting_programs', forecasting_programs)
+
+    # Last cycle ended with ACTG 30 and BGEN 10 (shares 0.75 and 0.25), now at 8 and 4
+    history = lambda end, now: pandas.DataFrame({'ds': ['2023-09-20', '2024-06-01'], 'y': [end, now]})
+    jobs = [{'program': 'ACTG', 'school': 'Business', 'dataframe': history(30, 8), 'target_value': 20, 'term': '2024F'},
+            {'program': 'NURS', 'school': 'Health', 'dataframe': history(50, 20), 'target_value': 60, 'term': '2024F'},
+            {'program': 'BGEN', 'school': 'Business', 'dataframe': history(10, 4), 'target_value': 10, 'term': '2024F'}]
+
+    forecasts = probs_target_utils.school_forecasting_programs(jobs = jobs)
+
+    # One model for Business, fitted on the sum of its programs
+    assert list(fitted) == ['school_Business']
+    assert fitted['school_Business']['y'].tolist() == [40, 12]
+    # Allocation: share of [20, 40] plus the residual (8 - 0.75 * 12 = -1 and 4 - 0.25 * 12 = 1), middle of min and max
+    assert forecasts['program'].tolist() == ['ACTG', 'NURS', 'BGEN']
+    assert forecasts['projected_regs'].tolist() == [21, 0, 8]
+    assert forecasts.attrs['failed'] == ['NURS']
+
+
+def test_loading_budget_table_offline(tmp_path, monkeypatch, caplog):
+    """Test the last budget downloaded is used, with a warning, when Sharepoint cannot be reached."""
+    settings = dict(global_params.transfer_settings(), cache_folder = str(tmp_path))
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    budget = custom_sharepoint.parsing_side_file(byte_content = b'Program\tBudget\nACTG\t120\nBGEN\t45\n',
+                                                 schema = global_params.side_files_schema()['budgets'])
+    monkeypatch.setattr(custom_sharepoint, 'loading_side_file', lambda **kwargs: budget)
+    online = probs_target_utils.loading_budget_table(file_name_budget = 'budget_fall.txt')
+
+    # Sharepoint unreachable: local copy of the last download
+    def unreachable(**kwargs):
+        raise ConnectionError('Sharepoint unreachable')
+    monkeypatch.setattr(custom_sharepoint, 'loading_side_file', unreachable)
+    with caplog.at_level('WARNING', logger = 'EnrolmentReport2'):
+        offline = probs_target_utils.loading_budget_table(file_name_budget = 'budget_fall.txt')
+
+    assert_frame_equal(offline, online)
+    assert offline['target'].tolist() == [120, 45]
+    assert [record.levelname for record in caplog.records] == ['WARNING']
+    assert 'budget_fall.txt' in caplog.records[0].getMessage()
+
+    # No local copy of that file: the error is raised
+    with pytest.raises(ConnectionError):
+        probs_target_utils.loading_budget_table(file_name_budget = 'budget_winter.txt')
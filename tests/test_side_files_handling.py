@@ -0,0 +1,121 @@
+import io
+import openpyxl
+import pandas
+import pytest
+from pandas._testing import assert_frame_equal
+from enrolment_utils import custom_sharepoint, global_params, side_files_handling, storage
+
+
+def building_projections(widths, note = None):
+    """Projections workbook: program columns, then one block of columns per term, the term written on the first data row
+    (in the middle of a block, the first data row may have a note too)."""
+    workbook = openpyxl.Workbook()
+    for sheet_name, width in widths.items():
+        worksheet = workbook.active if sheet_name == 'main' else workbook.create_sheet(sheet_name)
+        worksheet.title = 'Projections' if sheet_name == 'main' else sheet_name
+        header = ['School', 'Program', 'Previous Program Codes', 'Active', 'Notes']
+        rows = [['Business', 'ACTG', 'ACT1', 'Y', None],
+                ['Business', 'BGEN', None, 'N', 'closed'],
+                ['Health', 'NURS', 'NUR1', 'Y', None]]
+        for term in ['2024F', '2025W']:
+            header += [f'{term} column {i}' for i in range(width)]
+            for number, row in enumerate(rows):
+                # Term on the first data row of its block, then levels and budgets (whole numbers stored as floats)
+                block = [term if number == 0 else None, 1.0] + [float(10 * number + i) if i % 3 else None for i in range(width - 2)]
+                if number == 0 and note is not None and width > 3:
+                    block[3] = note
+                row += block[:width]
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def reading_projections_with_pandas(byte_content, sheet_name, term, width):
+    """Term block as it was read before: read_excel, and the term located on the first data row."""
+    projections = pandas.read_excel(io.BytesIO(byte_content), sheet_name = sheet_name, keep_default_na = False)
+    t = projections.isin([term]).loc[0,].to_list()
+    column = [i for i, x in enumerate(t) if x]
+    df1 = projections[['School', 'Program', 'Previous Program Codes', 'Active']]
+    df2 = projections.iloc[:, column[0]:column[0] + width]
+    return pandas.concat([df1, df2], axis = 1)
+
+
+@pytest.mark.parametrize('sheet_name, width', [('main', 12), ('Ottawa', 3)])
+@pytest.mark.parametrize('term', ['2024F', '2025W'])
+def test_parsing_projections(sheet_name, width, term):
+    """Test every term block of the projections workbook matches what read_excel gave."""
+    byte_content = building_projections(widths = {'main': 12, 'Ottawa': 3})
+
+    sheets = side_files_handling.parsing_projections(byte_content = byte_content)
+
+    assert list(sheets) == ['main', 'Ottawa']
+    assert list(sheets[sheet_name]) == ['2024F', '2025W']
+    expected = reading_projections_with_pandas(byte_content = byte_content,
+                                               sheet_name = 0 if sheet_name == 'main' else sheet_name,
+                                               term = term,
+                                               width = width)
+    assert_frame_equal(sheets[sheet_name][term], expected, check_dtype = False)
+
+
+def test_parsing_projections_ignores_notes():
+    """Test a note on the row of the terms does not start a term block, nor shifts the term blocks."""
+    byte_content = building_projections(widths = {'main': 12, 'Ottawa': 3}, note = 'see Ottawa')
+
+    sheets = side_files_handling.parsing_projections(byte_content = byte_content)
+
+    assert list(sheets['main']) == ['2024F', '2025W']
+    for term in ['2024F', '2025W']:
+        expected = reading_projections_with_pandas(byte_content = byte_content, sheet_name = 0, term = term, width = 12)
+        assert_frame_equal(sheets['main'][term], expected, check_dtype = False)
+
+
+@pytest.fixture
+def local_storage(tmp_path, monkeypatch):
+    """Local storage backend holding the projections workbook, with its own cache folder, for a new run."""
+    monkeypatch.setattr(global_params, 'storage_settings', lambda: {'backend': 'local', 'local_folder': str(tmp_path/'shared')})
+    settings = dict(global_params.transfer_settings(), cache_folder = str(tmp_path/'cache'))
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: settings)
+    monkeypatch.setattr(side_files_handling, '_projections', {})
+    custom_sharepoint.starting_sharepoint_session()
+    (tmp_path/'shared'/'budgets').mkdir(parents = True)
+    (tmp_path/'shared'/'budgets'/'projections.xlsx').write_bytes(building_projections(widths = {'main': 12, 'Ottawa': 3}))
+    return tmp_path/'shared'
+
+
+def test_setting_order_budget_local_storage(local_storage, monkeypatch):
+    """Test the order and budget files are written to storage once, and given to the run without downloading them."""
+    order = side_files_handling.setting_order_budget(terms = ['2024F'])
+
+    # Active Level 1 programs with a budget: ACTG (2) and NURS (22), BGEN is closed
+    assert order.to_dict('list') == {'Program': ['ACTG', 'NURS'], 'School': ['Business', 'Health']}
+    assert (local_storage/'orders'/'order_fall.txt').read_bytes() == b'Program\tSchool\nACTG\tBusiness\nNURS\tHealth\n'
+    assert (local_storage/'budgets'/'budget_fall.txt').read_bytes() == b'Program\tBudget\nACTG\t2\nNURS\t22\n'
+    budget = custom_sharepoint.loading_side_file(local_folder = 'budgets', file_name = 'budget_fall.txt')
+    assert budget['Budget'].tolist() == [2, 22]
+
+    # Unchanged projections: nothing written again
+    written = []
+    monkeypatch.setattr(storage, 'writing_file', lambda path, content: written.append(path))
+    side_files_handling.setting_order_budget(terms = ['2024F'])
+    assert written == []
+
+
+def test_setting_order_budget_failures(local_storage, monkeypatch):
+    """Test an order that cannot be written, or that would be empty, is raised to the run instead of giving no programs."""
+    def failing(path, content):
+        raise OSError('storage unreachable')
+    monkeypatch.setattr(storage, 'writing_file', failing)
+    transfer = custom_sharepoint.submitting_transfer(side_files_handling.setting_order_budget, terms = ['2024F'])
+    with pytest.raises(OSError):
+        custom_sharepoint.waiting_transfers([transfer])
+
+    # Every program of the projections closed
+    sheets = side_files_handling.parsing_projections(byte_content = (local_storage/'budgets'/'projections.xlsx').read_bytes())
+    sheets['main']['2024F']['Active'] = 'N'
+    monkeypatch.setattr(side_files_handling, 'loading_projections', lambda **kwargs: sheets)
+    with pytest.raises(ValueError, match = 'No active program'):
+        side_files_handling.setting_order_budget(terms = ['2024F'])
+    assert not (local_storage/'orders').exists()
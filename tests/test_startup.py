@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+# Seconds allowed to import the main pipeline (measured around 0.5 seconds, the forecasting backend is not loaded)
+STARTUP_BUDGET_SECONDS = 3
+
+
+def test_main_pipeline_import_budget():
+    """Test importing the main pipeline is fast and does not load the forecasting backend."""
+    code = ("import sys, time; start = time.perf_counter(); import enrolment_utils.main_pipeline; "
+            "print(time.perf_counter() - start); print(','.join(m for m in ['prophet', 'cmdstanpy'] if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True).stdout.splitlines()
+
+    assert float(output[-2]) < STARTUP_BUDGET_SECONDS
+    assert output[-1] == ''
@@ -0,0 +1,36 @@
+from enrolment_utils import global_params, storage
+
+
+def test_local_storage(tmp_path, monkeypatch):
+    """Test the local backend mirrors Shared Documents: Sharepoint urls and storage paths reach the same files."""
+    monkeypatch.setattr(global_params, 'storage_settings', lambda: {'backend': 'local', 'local_folder': str(tmp_path)})
+
+    storage.writing_file(path = '/sites/EnrolmentDashboard/Shared%20Documents/orders/order_fall.txt',
+                         content = b'Program\tSchool\nACTG\tBusiness\n')
+
+    assert (tmp_path/'orders'/'order_fall.txt').exists()
+    assert storage.reading_file(path = 'orders/order_fall.txt') == b'Program\tSchool\nACTG\tBusiness\n'
+    assert [file['Name'] for file in storage.listing_files(folder = 'orders')] == ['order_fall.txt']
+    assert storage.file_status(path = 'orders/order_fall.txt')['Length'] == 29
+    assert storage.file_status(path = 'orders/missing.txt') is None
+
+
+def test_writing_changed_file(tmp_path, monkeypatch):
+    """Test unchanged files are not written again, unless the file changed in storage since the last write."""
+    monkeypatch.setattr(global_params, 'storage_settings', lambda: {'backend': 'local', 'local_folder': str(tmp_path/'shared')})
+    monkeypatch.setattr(global_params, 'transfer_settings', lambda: {'cache_folder': str(tmp_path/'cache')})
+    path = 'orders/order_fall.txt'
+
+    assert storage.writing_changed_file(path = path, content = b'ACTG\n')
+    assert not storage.writing_changed_file(path = path, content = b'ACTG\n')
+    assert storage.writing_changed_file(path = path, content = b'BGEN\n')
+
+    # Edited in storage by someone else: the same content is written back
+    (tmp_path/'shared'/'orders'/'order_fall.txt').write_bytes(b'BGEN\nACTG\n')
+    assert storage.writing_changed_file(path = path, content = b'BGEN\n')
+    assert storage.reading_file(path = path) == b'BGEN\n'
+
+    # Deleted in storage
+    (tmp_path/'shared'/'orders'/'order_fall.txt').unlink()
+    assert storage.writing_changed_file(path = path, content = b'BGEN\n')
+    assert not storage.writing_changed_file(path = path, content = b'BGEN\n')